@@ -4,14 +4,15 @@ import argparse
 import daemon
 from pathlib import Path
 import signal
-import time
-import subprocess
-import psutil
+import logging
 import argcomplete
 from autoed import __version__
+from autoed.supervisor import WatcherSupervisor, send_command
+from autoed.utility.profiling import profiled
 
 
 # PYTHON_ARGCOMPLETE_OK
+@profiled
 def main():
 
     des = 'AutoED: a package for automatic processing of ED data'
@@ -99,21 +100,9 @@ def main():
     elif args.command == "stop":
         autoed_daemon.stop()
     elif args.command == "kill" and args.pid is not None:
-        if not os.path.exists(autoed_daemon.lock_file):
-            print("No daemon running")
-            sys.exit(0)
-        if args.pid in autoed_daemon.pids.values():
-            kill_process_and_children(args.pid)
-        else:
-            print('The provided PID is not being watched.')
+        autoed_daemon.kill(args.pid)
     elif args.command == "kill" and args.dirname is not None:
-        if not os.path.exists(autoed_daemon.lock_file):
-            print("No daemon running")
-            sys.exit(0)
-        if int(args.dirname) in autoed_daemon.pids.values():
-            kill_process_and_children(int(args.dirname))
-        else:
-            print('The provided PID is not being watched.')
+        autoed_daemon.kill(int(args.dirname))
     else:
         parser.print_help()
         sys.exit(1)
@@ -122,33 +111,11 @@ def main():
 class AutoedDaemon:
 
     def __init__(self):
-        self.directories = []   # Directories to watch
-        self._running = True
         self.lock_file = str(Path.home() / '.autoed.lock')
         self.pid_file = str(Path.home() / '.autoed.pid')
         self.dirs_file = str(Path.home() / '.autoed_dirs.txt')
-        self.pids = {}
-        self.pids, self.directories = self.load_directories()
-
-    def load_directories(self):
-        pids = {}
-        dirs = []
-        if os.path.exists(self.dirs_file):
-            with open(self.dirs_file, 'r') as f:
-                for line in f.readlines():
-                    pid, dirname = line.strip().split()
-                    pid = int(pid)
-                    if psutil.pid_exists(pid):
-                        pids[dirname] = pid
-                        dirs.append(dirname)
-                return pids, dirs
-        return pids, dirs
-
-    def save_dirs(self):
-        with open(self.dirs_file, 'w') as f:
-            for dirname in self.directories:
-                f.write(str(self.pids[dirname]) +
-                        ' ' + dirname + '\n')
+        self.socket_file = str(Path.home() / '.autoed.sock')
+        self.log_file = str(Path.home() / '.autoed_daemon.log')
 
     def start(self):
 
@@ -164,43 +131,50 @@ class AutoedDaemon:
             with open(self.pid_file, 'w') as pf:
                 pf.write(str(os.getpid()))
 
+            set_daemon_logger(self.log_file)
+            supervisor = WatcherSupervisor(self.socket_file, self.dirs_file)
             try:
-                while self._running:
-                    time.sleep(1)
+                supervisor.serve()
             finally:
+                supervisor.stop_all()
                 self.cleanup()
 
+    def request(self, command, **kwargs):
+        """Send a request to the supervisor running in the daemon"""
+
+        if not os.path.exists(self.lock_file):
+            print("No daemon running")
+            sys.exit(0)
+        try:
+            response = send_command(self.socket_file, command, **kwargs)
+        except ConnectionError as e:
+            print(f"The AutoED daemon is not answering ({e}).")
+            sys.exit(1)
+        if not response.get('ok'):
+            print(response.get('error'))
+            sys.exit(1)
+        return response
+
     def restart(self):
         """Kills the running processes and starts watching again"""
 
-        # Kill running processes
-        for indir in self.directories:
-            pid = self.pids[indir]
-            kill_process_and_children(pid)
-
-        dirs = list(self.directories)
-        for in_dir in dirs:
-            self.watch(in_dir)
+        for watcher in self.request('restart')['watchers']:
+            print('Watching path:', watcher['path'])
 
     def stop(self):
-        self._running = False
-
-        # Kill running processes
-        for indir in self.directories:
-            pid = self.pids[indir]
-            kill_process_and_children(int(pid))
 
-        if os.path.exists(self.lock_file):
-            os.remove(self.lock_file)
-        if os.path.exists(self.dirs_file):
-            os.remove(self.dirs_file)
+        try:
+            # The daemon stops its watchers and removes its files
+            response = send_command(self.socket_file, 'shutdown')
+        except ConnectionError:
+            self.cleanup()
+            return
 
-        if os.path.exists(self.pid_file):
-            with open(self.pid_file, 'r') as pf:
-                pid = int(pf.read().strip())
-                print('Stopping autoed daemon')
-                os.kill(pid, signal.SIGTERM)
-            os.remove(self.pid_file)
+        if response.get('ok'):
+            print('Stopping autoed daemon')
+        else:
+            print(response.get('error'))
+            sys.exit(1)
 
     def cleanup(self):
         if os.path.exists(self.lock_file):
@@ -211,32 +185,12 @@ class AutoedDaemon:
         if os.path.exists(self.pid_file):
             with open(self.pid_file, 'r') as pf:
                 pid = int(pf.read().strip())
-                os.kill(pid, signal.SIGTERM)
             os.remove(self.pid_file)
-
-    def is_process_running(self, command):
-        for p in psutil.process_iter(['cmdline']):
-            if p.info['cmdline'] == [command]:
-                return True
-        return False
-
-    def is_subdirectory(self, path_to_check):
-
-        is_sub = False
-        p2 = os.path.abspath(path_to_check)
-        for p1 in self.directories:
-
-            is_sub = is_sub or p2.startswith(p1 + os.sep)
-        return is_sub
-
-    def is_parent_directory(self, path_to_check):
-
-        is_parent = False
-        p2 = os.path.abspath(path_to_check)
-        for p1 in self.directories:
-
-            is_parent = is_parent or p1.startswith(p2 + os.sep)
-        return is_parent
+            if pid != os.getpid():
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
 
     def watch(self,
               dirname,
@@ -248,60 +202,28 @@ class AutoedDaemon:
               test=False,
               ):
 
-        if not os.path.exists(self.lock_file):
-            print("No daemon running")
-            sys.exit(0)
+        options = {'use_inotify': use_inotify, 'sleep_time': sleep_time,
+                   'log_dir': log_dir and os.path.abspath(log_dir),
+                   'dummy': dummy, 'local': local, 'test': test}
+        response = self.request('watch', path=os.path.abspath(dirname),
+                                options=options)
+        print('Watching path:', response['watcher']['path'])
 
-        full_path = os.path.abspath(dirname)
-
-        if not os.path.exists(full_path):
-            print(f'No path found: {full_path}')
-            sys.exit(0)
-        if full_path in self.directories:
-            print(f'Directory {dirname} already watched.')
-            sys.exit(1)
-        elif self.is_subdirectory(full_path):
-            print(f'Can not watch {dirname}.')
-            print(r'Already watching its parent directory.')
-            sys.exit(1)
-        elif self.is_parent_directory(full_path):
-            print(f'Can not watch {dirname}.')
-            print(r'Already watching its subdirectories.')
-            sys.exit(1)
-        else:
-            command = 'autoed_watch '
-            if use_inotify:
-                command += '-i '
-            if sleep_time:
-                command += '-t %.1f ' % sleep_time
-            if local:
-                command += '--local '
-            if dummy:
-                command += '--dummy '
-            if test:
-                command += '--test '
-            if log_dir:
-                log_path = os.path.abspath(log_dir)
-                command += '--log-dir ' + log_path + ' '
-            command += full_path
-            if not self.is_process_running(command):
-                print('Watching path:', full_path)
-                process = subprocess.Popen(command, shell=True)
-                pid = str(process.pid)
-                self.pids[full_path] = pid
-                self.directories.append(full_path)
-                self.save_dirs()
+    def kill(self, pid):
+        self.request('kill', pid=pid)
 
     def list_directories(self):
 
-        if not os.path.exists(self.lock_file):
-            print("No daemon running")
-            sys.exit(0)
+        watchers = self.request('list')['watchers']
         print('Listing watched directories')
         print("PID    PATH")
         print("------------------------------------------")
-        for idx, dirname in enumerate(self.directories):
-            print(f"{self.pids[dirname]}  {dirname}")
+        for watcher in watchers:
+            restarts = ''
+            if watcher['status'] != 'running' or watcher['restarts']:
+                restarts = f"  ({watcher['status']}, "
+                restarts += f"{watcher['restarts']} restarts)"
+            print(f"{watcher['pid']}  {watcher['path']}{restarts}")
         print("------------------------------------------")
         print('')
         msg = ("* Please use 'autoed kill PID' to kill a process.\n")
@@ -309,19 +231,15 @@ class AutoedDaemon:
         print(msg)
 
 
-def kill_process_and_children(pid):
-    try:
-        parent = psutil.Process(pid)
-        children = parent.children(recursive=True)
-        for child in children:
-            child.terminate()
-        psutil.wait_procs(children, timeout=5)
-        parent.terminate()
-        parent.wait(5)
-    except psutil.NoSuchProcess:
-        pass
-    except psutil.TimeoutExpired:
-        pass
+def set_daemon_logger(log_file):
+    """Log the supervisor messages (watcher crashes and restarts)"""
+
+    supervisor_logger = logging.getLogger('autoed.supervisor')
+    supervisor_logger.setLevel(logging.INFO)
+    file_handler = logging.FileHandler(log_file, mode='a')
+    fmt = '%(asctime)s %(levelname)s - %(message)s'
+    file_handler.setFormatter(logging.Formatter(fmt))
+    supervisor_logger.addHandler(file_handler)
 
 
 if __name__ == '__main__':
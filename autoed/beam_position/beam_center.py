@@ -1,22 +1,23 @@
 import h5py
 import hdf5plugin
 import numpy as np
-import os
-import autoed
 from autoed.constants import (SINGLA_GAP_START, SINGLA_GAP_STOP, MID_START,
                               MID_STOP, MID_STEP, BAD_PIXEL_THRESHOLD)
 
 from autoed.beam_position.midpoint_method import (MidpointMethodParams,
                                                   position_from_midpoint)
 from autoed.beam_position.maximum_method import MaxMethodParams, find_max
-from autoed.beam_position.plot import plot_profile
+from autoed.beam_position.plot import plot_profile, deferred_plots
+from autoed.utility.mask import get_singla_mask, apply_singla_mask
 import argparse
 import time
+from autoed.utility.profiling import profiled
 
 
 hdf5plugin
 
 
+@profiled
 def main():
 
     info = 'A script to determine the beam center'
@@ -98,10 +99,7 @@ def main():
 class BeamCenterCalculator:
 
     def __init__(self, filename):
-        mask_path = 'data/singla_mask.npz'
-        mask_path = os.path.join(autoed.__path__[0], mask_path)
-        mask_data = np.load(mask_path)
-        self.mask = mask_data['mask']
+        self.mask = get_singla_mask().mask      # Shared, read-only
 
         index = 0
         self.problem_reading = True
@@ -121,7 +119,7 @@ class BeamCenterCalculator:
                              bad_pixel_threshold=BAD_PIXEL_THRESHOLD):
 
         image = self.dataset[::every, :, :].mean(axis=0)
-        image[self.mask > 0] = 0
+        apply_singla_mask(image)
         image[image > bad_pixel_threshold] = 0
 
         mid_params = MidpointMethodParams(
@@ -140,10 +138,19 @@ class BeamCenterCalculator:
     def center_from_mixed(self, every=20,
                           bad_pixel_threshold=BAD_PIXEL_THRESHOLD,
                           convolution_width=3,
-                          plot_file=None, title=None, ed_root_dir='ED'):
+                          plot_file=None, title=None, ed_root_dir='ED',
+                          defer_plot=False, logger=None):
+        """
+        Compute the beam position by combining midpoint and maximum methods
+
+        If `defer_plot` is True, the figure (`plot_file`) is not rendered
+        here, but queued for rendering in a background thread (see
+        `DeferredPlotQueue`). The `logger` is used to report skipped or
+        failed figures.
+        """
 
         image = self.dataset[::every, :, :].mean(axis=0)
-        image[self.mask > 0] = 0
+        apply_singla_mask(image)
         image[image > bad_pixel_threshold] = 0
 
         # First try midpoint method
@@ -218,7 +225,10 @@ class BeamCenterCalculator:
         plot_params.beam_position = x, y
 
         if plot_file:
-            plot_profile(plot_params)
+            if defer_plot:
+                deferred_plots.submit(plot_params, logger=logger)
+            else:
+                plot_profile(plot_params)
 
         return x, y
 
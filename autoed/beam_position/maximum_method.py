@@ -74,6 +74,12 @@ def max_intensity_binning(profile_smooth, profile_max, params):
     """
     Determine the maximum intensity region using binning
 
+    Note
+    ----
+    Bins of `params.bin_width` pixels start every `params.bin_step` pixels.
+    Their sums are taken from a sliding window view of the smoothed profile,
+    so no bin is sliced or summed in a Python loop.
+
     Parameters
     ----------
     profile_max : 1D numpy.ndarray
@@ -90,29 +96,97 @@ def max_intensity_binning(profile_smooth, profile_max, params):
     """
 
     n = len(profile_max)
-    n_end = (n // params.bin_width) * params.bin_width
-    bins = np.arange(0, n_end, params.bin_step)
-
-    bin_values = []
-    bin_indices = []
-    for ibin in bins:
-        bvalue = profile_smooth[ibin:ibin + params.bin_width]
-        bin_indices.append((ibin, ibin + params.bin_width))
-        bin_values.append(bvalue.sum())
+    bins = _bin_starts(n, params)
 
-    bin_values = np.array(bin_values)
+    bin_values = _window_sums(profile_smooth, bins, params.bin_width)
     max_index = np.argmax(bin_values)
 
-    i1, i2 = bin_indices[max_index]
+    i1 = int(bins[max_index])
+    i2 = i1 + params.bin_width
 
-    selected = np.array(profile_max)
+    local_index = np.argmax(profile_max[i1:i2])
+    if profile_max[i1 + local_index] > 0:
+        beam_position = i1 + local_index
+    else:
+        # A bin without positive pixels. Zeros outside the bin can win the
+        # argmax here, so fall back to masking the full profile.
+        selected = np.zeros_like(profile_max)
+        selected[i1:i2] = profile_max[i1:i2]
+        beam_position = np.argmax(selected)
 
-    selected[0:i1] = 0
-    selected[i2:] = 0
+    return beam_position, i1, i2
 
-    beam_position = np.argmax(selected)
 
-    return beam_position, i1, i2
+def max_intensity_binning_batch(profiles_smooth, profiles_max, params):
+    """
+    Determine the maximum intensity regions for many profiles at once
+
+    Same as `max_intensity_binning`, but applied to every row of the input
+    arrays (e.g. the profiles of individual frames or frame blocks when
+    tracking the beam drift).
+
+    Parameters
+    ----------
+    profiles_smooth : 2D numpy.ndarray
+        Projected average profiles after smoothing, one per row.
+    profiles_max : 2D numpy.ndarray
+        Projected profiles of maximum pixels, one per row.
+    params : MaxMethodParams
+        Parameters for the max method.
+
+    Returns
+    -------
+    beam_positions, i1, i2 : Tuple[1D numpy.ndarray, ...]
+        The beam positions and the indices of the maximum intensity regions
+        for each of the profiles.
+    """
+
+    profiles_smooth = np.atleast_2d(profiles_smooth)
+    profiles_max = np.atleast_2d(profiles_max)
+
+    if profiles_smooth.shape != profiles_max.shape:
+        msg = "Smoothed and maximum profiles must have the same shape "
+        msg += f"({profiles_smooth.shape} != {profiles_max.shape})"
+        raise ValueError(msg)
+
+    n = profiles_max.shape[1]
+    bins = _bin_starts(n, params)
+
+    bin_values = _window_sums(profiles_smooth, bins, params.bin_width)
+    i1 = bins[np.argmax(bin_values, axis=1)]
+    i2 = i1 + params.bin_width
+
+    indices = np.arange(n)
+    in_bin = (indices >= i1[:, None]) & (indices < i2[:, None])
+    beam_positions = np.argmax(np.where(in_bin, profiles_max, 0), axis=1)
+
+    return beam_positions, i1, i2
+
+
+def _bin_starts(n, params):
+    """Start indices of all bins for a profile of length `n`"""
+
+    n_end = (n // params.bin_width) * params.bin_width
+    return np.arange(0, n_end, params.bin_step)
+
+
+def _window_sums(profiles, bins, width):
+    """
+    Sum `profiles[..., b:b + width]` for every bin start `b`
+
+    The sums are differences of the cumulative sum `c`, which starts with
+    0 and is padded with its last value. The last bins may extend past the
+    end of the profile, so those bins are summed over the remaining pixels
+    only.
+    """
+
+    n = profiles.shape[-1]
+    dtype = np.result_type(profiles.dtype, np.float64)
+    c = np.empty(profiles.shape[:-1] + (n + width + 1,), dtype=dtype)
+    c[..., 0] = 0
+    np.cumsum(profiles, axis=-1, out=c[..., 1:n + 1])
+    c[..., n + 1:] = c[..., n:n + 1]
+    return c[..., bins + width] - c[..., bins]
 
 
 def find_max(image, params, axis="x"):
@@ -2,15 +2,21 @@
 
 from __future__ import annotations
 
+import atexit
+import queue
+import threading
+import traceback
 from typing import List, Optional, Tuple
 
 import matplotlib
-import matplotlib.pyplot as plt
 import numpy as np
 from dataclasses import dataclass
 from matplotlib import gridspec
+from matplotlib.figure import Figure
 from matplotlib.patches import Circle
 
+from autoed.utility.logger_pool import dataset_loggers
+
 matplotlib.use('Agg')
 
 
@@ -104,15 +110,20 @@ def plot_profile(params: PlotParams):
     """
     Plots the given profiles along with an image and saves the plot
     as a PNG file.
+
+    Note
+    ----
+    The figure is created without pyplot, so it is safe to call this
+    function from the background worker of `DeferredPlotQueue`.
     """
 
-    fig = plt.figure(figsize=(6, 6))
-    gs = gridspec.GridSpec(2, 2, top=0.92, bottom=0.07, left=0.11, right=0.98,
-                           wspace=0, hspace=0, width_ratios=[3, 1],
-                           height_ratios=[1, 3])
-    ax_x = plt.subplot(gs[0, 0])
-    ax_y = plt.subplot(gs[1, 1])
-    ax = plt.subplot(gs[1, 0])
+    fig = Figure(figsize=(6, 6))
+    gs = gridspec.GridSpec(2, 2, figure=fig, top=0.92, bottom=0.07,
+                           left=0.11, right=0.98, wspace=0, hspace=0,
+                           width_ratios=[3, 1], height_ratios=[1, 3])
+    ax_x = fig.add_subplot(gs[0, 0])
+    ax_y = fig.add_subplot(gs[1, 1])
+    ax = fig.add_subplot(gs[1, 0])
 
     if params.span_xy is not None:
         if len(params.span_xy) != 4:
@@ -154,5 +165,112 @@ def plot_profile(params: PlotParams):
         ax_y.text(0.97, 0.97, params.label_y, va='top', ha='right',
                   transform=ax_y.transAxes, rotation=-90)
 
-    plt.savefig(params.filename, dpi=400)
-    plt.close(fig)
+    fig.savefig(params.filename, dpi=400)
+
+
+class DeferredPlotQueue:
+    """
+    A queue that renders beam position figures in a background thread
+
+    Figures are diagnostic only, so the conversion of a dataset should not
+    wait for them. Plot parameters are queued and rendered later (with the
+    Agg backend) by a single worker thread. When the queue is full, new
+    figures are skipped instead of slowing down the processing.
+    """
+
+    def __init__(self, max_pending=8):
+        """
+        max_pending : int
+            Maximum number of figures waiting to be rendered. If the queue is
+            full, new figures are skipped. Zero or negative means unbounded.
+        """
+
+        self.max_pending = max_pending
+        self._queue = None
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def submit(self, params: PlotParams, logger=None):
+        """
+        Queue a figure for rendering
+
+        Parameters
+        ----------
+        params : PlotParams
+            Parameters of the figure to render with `plot_profile`.
+        logger : logging.Logger, optional
+            Logger used to report rendered, skipped or failed figures. A
+            dataset logger is held until the figure is rendered, so it is
+            not released when the dataset is done with.
+
+        Returns
+        -------
+        queued : boolean
+            True if the figure was queued, False if it was skipped.
+        """
+
+        self._start_worker()
+
+        with self._lock:
+            full = 0 < self.max_pending <= self.pending()
+            if not full:
+                held = bool(logger) and dataset_loggers.hold(logger.name)
+                self._queue.put((params, logger, held))
+
+        if full:
+            if logger:
+                msg = 'Too many figures waiting to be rendered. '
+                msg += f"Skipping figure {params.filename}"
+                logger.warning(msg)
+            return False
+        return True
+
+    def pending(self):
+        """Number of figures waiting to be rendered"""
+
+        if self._queue is None:
+            return 0
+        return self._queue.unfinished_tasks
+
+    def wait(self):
+        """Block until all queued figures are rendered"""
+
+        if self._queue is not None:
+            self._queue.join()
+
+    def _start_worker(self):
+
+        with self._lock:
+            if self._worker is not None:
+                return
+
+            self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self._render_loop,
+                                            name='autoed-plot-worker',
+                                            daemon=True)
+            self._worker.start()
+
+            # Short-lived commands should not exit with figures pending
+            atexit.register(self.wait)
+
+    def _render_loop(self):
+
+        while True:
+            params, logger, held = self._queue.get()
+            try:
+                plot_profile(params)
+                if logger:
+                    logger.info(f"Rendered figure {params.filename}")
+            except Exception:
+                if logger:
+                    msg = f"Failed to render figure {params.filename}\n"
+                    msg += traceback.format_exc()
+                    logger.warning(msg)
+            finally:
+                if held:
+                    dataset_loggers.drop(logger.name)
+                self._queue.task_done()
+
+
+# A Singleton object shared by all datasets in a process
+deferred_plots = DeferredPlotQueue()
@@ -9,6 +9,10 @@ report_dir = 'autoed_report'
 multiplex_dir = 'multiplex'                       # Where to copy all the files
 multiplex_output_dir = 'xia2_multiplex_output'    # Where to keep the results
 multiplex_default_sample = 'default_sample'
+multiplex_merged_dir = 'xia2_multiplex_merged'    # Last merged result
+multiplex_manifest_file = 'multiplex_manifest.json'  # Inputs of the merge
+multiplex_state_file = 'multiplex_state.json'     # Run counter and queue
+multiplex_lock_file = '.multiplex.lock'           # Per-sample lock
 database_json_file = 'autoed_database.json'   # Keeps processing summaries
 xia2_report_dir = 'xia2_reports'              # Keeps xia2 html reports
 beam_report_dir = 'beam_positions'                 # Keeps beam images
@@ -16,6 +20,11 @@ spots_report_dir = 'spots'                         # Keeps spots
 xia2_dials_report_path = 'DEFAULT/NATIVE/SWEEP1/index'
 report_data_dir = 'report_data'
 PROCESS_DONE_TRIGGER = '.done'
+metadata_cache_file = 'metadata_cache.json'    # Kept in the processed dir
+events_file = '.autoed_events.jsonl'           # Kept in the watched dir
+autoed_events_var = 'AUTOED_EVENTS_FILE'       # Events file for subprocesses
+timings_file = '.autoed_timings.jsonl'         # Kept in the watched dir
+autoed_profile_var = 'AUTOED_PROFILE'          # Profile the console scripts
 
 
 SINGLA_GAP_START = 510
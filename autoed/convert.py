@@ -1,30 +1,49 @@
 """A wrapper for the nexgen package"""
 import subprocess
 import os
+import glob
+import logging
+import shutil
+import tempfile
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from pathlib import Path
 
+from autoed.global_config import global_config
 from autoed.utility.misc_functions import is_file_fully_written, overwrite_mask
 
+PHIL_TEMPLATE = 'ED_Singla.phil'
+NEXUS_LOG = 'EDnxs.log'
+
+
+class NexusGenerationError(Exception):
+    """Raised when nexgen fails to write the NeXus file"""
+
 
 def generate_nexus_file(dataset):
     """Generates Nexus file from the dataset files using nexgen"""
 
-    dataset.logger.info(f"Overwriting mask in : {dataset.master_file}")
-    overwrite_mask(dataset.master_file)
-    dataset.logger.info(f"Mask overwritten in : {dataset.master_file}")
+    if global_config.overwrite_mask:
+        overwrite_dataset_mask(dataset)
 
-    phil_file = os.path.join(dataset.path, 'ED_Singla.phil')
+    in_process = global_config.nexgen_in_process
+    phil_file = os.path.join(dataset.path, PHIL_TEMPLATE)
 
     if not os.path.exists(phil_file):
         dataset.logger.info('Copying ED_Singl.phil')
-        cmd = ['nexgen_phil get ED_Singla.phil -o ' + phil_file]
-        subprocess.run(cmd, shell=True, text=True, capture_output=True)
+        if not (in_process and copy_phil_template(phil_file)):
+            cmd = [f"nexgen_phil get {PHIL_TEMPLATE} -o " + phil_file]
+            subprocess.run(cmd, shell=True, text=True, capture_output=True)
     else:
         dataset.logger.info('ED_Singl.phil detected')
 
     if os.path.exists(dataset.nexgen_file):
         dataset.logger.info('Found existing nexus file')
-        cmd = ['rm ' + dataset.nexgen_file]
-        subprocess.run(cmd, shell=True, text=True, capture_output=True)
+        os.remove(dataset.nexgen_file)
         dataset.logger.info('Old Nexus file removed')
 
     phil_written, _, _ = is_file_fully_written(phil_file, polling_interval=0.5)
@@ -32,26 +51,20 @@ def generate_nexus_file(dataset):
         dataset.logger.info('Conversion failed. Phil file not written')
         return 0
 
-    data_file_pattern = dataset.base + r'_data_*.h5'
-    metadata = dataset.metadata
-
-    nex_cmd = 'ED_nexus singla-phil '
-    nex_cmd += '%s ' % phil_file
-    nex_cmd += r'input.datafiles=%s ' % data_file_pattern
-    nex_cmd += 'goniometer.starts=%.0f,0,0,0 ' % metadata.start_angle
-    nex_cmd += 'goniometer.increments=%.5f,0,0,0 ' % metadata.angle_increment
-    nex_cmd += 'goniometer.vectors=0,-1,0,0,0,1,0,1,0,1,0,0 '
-    nex_cmd += 'detector.starts=%f ' % metadata.detector_distance
-    nex_cmd += 'beam.wavelength=%.10f ' % metadata.wavelength
-    if dataset.beam_center:
-        nex_cmd += 'detector.beam_center=%.2f,%.2f ' % dataset.beam_center
-    nex_cmd += '-m %s ' % dataset.master_file
+    phil_args = nexgen_phil_args(dataset, phil_file)
 
     # Remove EDnxs.log if it exists
-    EDnxs_file = os.path.join(dataset.path, 'EDnxs.log')
+    EDnxs_file = os.path.join(dataset.path, NEXUS_LOG)
     if os.path.exists(EDnxs_file):
         os.remove(EDnxs_file)
 
+    if in_process:
+        return generate_nexus_in_process(dataset, phil_file, phil_args)
+
+    nex_cmd = 'ED_nexus singla-phil '
+    nex_cmd += ' '.join(phil_args)
+    nex_cmd += ' -m %s ' % dataset.master_file
+
     dataset.logger.info('Running nexgen with: ' + nex_cmd)
     p = subprocess.run(nex_cmd, shell=True, stdout=subprocess.PIPE,
                        stderr=subprocess.PIPE, cwd=dataset.path)
@@ -65,3 +78,307 @@ def generate_nexus_file(dataset):
         dataset.logger.info('Created Nexus file ' + dataset.nexgen_file)
         dataset.status = 'CONVERTED'
         return 1
+
+
+def overwrite_dataset_mask(dataset):
+    """Overwrite the pixel mask in the master file with the Singla mask"""
+
+    dataset.logger.info(f"Overwriting mask in : {dataset.master_file}")
+    try:
+        n_chunks = overwrite_mask(dataset.master_file)
+    except TimeoutError as e:
+        dataset.logger.warning(str(e))
+        return
+    except ValueError as e:
+        msg = f"Mask not overwritten in : {dataset.master_file} ({e})"
+        dataset.logger.error(msg)
+        return
+
+    if n_chunks is None:
+        msg = f"No pixel mask found in : {dataset.master_file}"
+    elif n_chunks == 0:
+        msg = f"Mask already up to date in : {dataset.master_file}"
+    else:
+        msg = f"Mask overwritten in : {dataset.master_file} "
+        msg += f"({n_chunks} chunks written)"
+    dataset.logger.info(msg)
+
+
+def nexgen_phil_args(dataset, phil_file):
+    """Phil file and parameter overrides passed to nexgen for a dataset"""
+
+    data_file_pattern = dataset.base + r'_data_*.h5'
+    metadata = dataset.metadata
+
+    args = [phil_file]
+    args.append(r'input.datafiles=%s' % data_file_pattern)
+    args.append('goniometer.starts=%.0f,0,0,0' % metadata.start_angle)
+    args.append('goniometer.increments=%.5f,0,0,0' %
+                metadata.angle_increment)
+    args.append('goniometer.vectors=0,-1,0,0,0,1,0,1,0,1,0,0')
+    args.append('detector.starts=%f' % metadata.detector_distance)
+    args.append('beam.wavelength=%.10f' % metadata.wavelength)
+    if dataset.beam_center:
+        args.append('detector.beam_center=%.2f,%.2f' % dataset.beam_center)
+    return args
+
+
+def copy_phil_template(phil_file):
+    """
+    Copy the nexgen ED_Singla.phil template without running nexgen_phil
+
+    Returns
+    -------
+    success : boolean
+        False if the template can not be found in the installed nexgen.
+    """
+
+    try:
+        from importlib.resources import files
+        from nexgen import templates
+        template = files(templates) / PHIL_TEMPLATE
+        if not template.is_file():
+            return False
+        with template.open('rb') as src, open(phil_file, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+    except (ImportError, OSError):
+        return False
+    return True
+
+
+# ---------------------------------------------------------------------------
+# In-process NeXus generation
+# ---------------------------------------------------------------------------
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_nexgen_executor():
+    """
+    Return the (single) worker process that runs nexgen
+
+    The worker is started on first use and then reused for all datasets,
+    so nexgen is imported (and each phil template parsed) only once. A
+    separate process is used because nexgen keeps its configuration in
+    module level objects and its logging set-up is global.
+    """
+
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            context = multiprocessing.get_context('spawn')
+            _executor = ProcessPoolExecutor(max_workers=1,
+                                            mp_context=context)
+        return _executor
+
+
+def _reset_nexgen_executor():
+
+    global _executor
+
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def generate_nexus_in_process(dataset, phil_file, phil_args):
+    """Generate the NeXus file with the nexgen Python API (in a worker)"""
+
+    dataset.logger.info('Running nexgen (in-process) with: ' +
+                        ' '.join(phil_args))
+
+    error = None
+    try:
+        future = get_nexgen_executor().submit(
+            write_nexus_file, dataset.master_file, dataset.nexgen_file,
+            phil_file, phil_args[1:])
+        future.result()
+    except BrokenProcessPool:
+        _reset_nexgen_executor()
+        error = 'The nexgen worker process terminated unexpectedly'
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+
+    if error:
+        dataset.logger.error('Failed to process data with nexgen')
+        dataset.logger.error(error)
+        dataset.status = 'CONVERSION_FAILED'
+        return 0
+
+    dataset.logger.info('Created Nexus file ' + dataset.nexgen_file)
+    dataset.status = 'CONVERTED'
+    return 1
+
+
+@lru_cache(maxsize=16)
+def load_phil_template(phil_file, mtime_ns):
+    """Parse a phil template once (per file version) in the worker"""
+
+    try:
+        import freephil
+        from nexgen.command_line.ED_nexus import ED_phil
+    except ImportError as e:
+        msg = 'The installed nexgen has no phil interface (nexgen_in_process '
+        msg += f"needs nexgen < 0.9): {e}"
+        raise NexusGenerationError(msg) from e
+
+    return ED_phil.fetch(sources=[freephil.parse(file_name=phil_file)])
+
+
+class _ErrorCollector(logging.Handler):
+    """Collects errors that nexgen logs instead of raising"""
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.messages = []
+
+    def emit(self, record):
+        message = record.getMessage()
+        if record.exc_info:
+            message += '\n' + ''.join(
+                traceback.format_exception(*record.exc_info))
+        self.messages.append(message)
+
+
+def write_nexus_file(master_file, nexus_file, phil_file, overrides):
+    """
+    Write a Singla NeXus file with nexgen (runs in the worker process)
+
+    Does the same as `ED_nexus singla-phil PHIL OVERRIDES -m MASTER`, but
+    the file is first written into a temporary directory and then moved
+    into place. Readers therefore never see a partially written file.
+
+    Raises
+    ------
+    NexusGenerationError
+        If nexgen fails, with the error(s) nexgen reported.
+    """
+
+    from nexgen.beamlines.ED_params import ED_coord_system
+    from nexgen.beamlines.ED_singla_nxs import singla_nexus_writer
+
+    template = load_phil_template(phil_file,
+                                  os.stat(phil_file).st_mtime_ns)
+    interpreter = template.command_line_argument_interpreter()
+    params = interpreter.process_and_fetch(overrides).extract()
+
+    datafiles = [Path(f).expanduser().resolve()
+                 for f in sorted(glob.glob(params.input.datafiles))]
+    if not datafiles:
+        msg = f"No data files match '{params.input.datafiles}'"
+        raise NexusGenerationError(msg)
+
+    coord_system = phil_coord_system(params, ED_coord_system)
+
+    scan_idx = params.goniometer.types.index('rotation')
+    scan_info = [params.goniometer.axes[scan_idx],
+                 params.goniometer.starts[scan_idx],
+                 params.goniometer.increments[scan_idx]]
+
+    new_source = {'name': params.source.name,
+                  'facility_id': params.source.facility_id,
+                  'beamline': params.source.beamline_name,
+                  'probe': params.source.probe}
+
+    nexus_dir = os.path.dirname(os.path.abspath(nexus_file))
+    nexgen_logger = logging.getLogger('nexgen')
+    old_handlers = list(nexgen_logger.handlers)
+    errors = _ErrorCollector()
+    nexgen_logger.addHandler(errors)
+
+    with tempfile.TemporaryDirectory(dir=nexus_dir,
+                                     prefix='.nexgen_') as temp_dir:
+        try:
+            singla_nexus_writer(
+                master_file,
+                params.detector.starts[0],
+                params.detector.exposure_time,
+                coord_system,
+                datafiles,
+                params.input.convert_to_mcstas,
+                n_imgs=params.input.n_imgs,
+                scan_axis=scan_info,
+                beam_center=params.detector.beam_center,
+                wavelength=params.beam.wavelength,
+                outdir=temp_dir,
+                new_source_info=new_source,
+                vds_writer=params.input.vds_writer,
+            )
+        finally:
+            # nexgen adds a log file handler on every call
+            for handler in nexgen_logger.handlers:
+                if handler not in old_handlers:
+                    nexgen_logger.removeHandler(handler)
+                    handler.close()
+
+        temp_nexus = os.path.join(temp_dir, os.path.basename(nexus_file))
+        temp_log = os.path.join(temp_dir, NEXUS_LOG)
+        if os.path.exists(temp_log):
+            shutil.move(temp_log, os.path.join(nexus_dir, NEXUS_LOG))
+
+        if errors.messages or not os.path.exists(temp_nexus):
+            msg = '\n'.join(errors.messages) or 'No NeXus file written'
+            raise NexusGenerationError(msg)
+
+        relink_to_directory(temp_nexus, nexus_dir)
+        os.replace(temp_nexus, nexus_file)
+
+
+def phil_coord_system(params, default_coord_system):
+    """
+    Return the ED coordinate system, updated with the phil parameters
+
+    Same as in nexgen's ED_nexus, except that a copy is updated (the worker
+    is reused, so the nexgen default must not be modified).
+    """
+
+    from nexgen.nxs_utils import Axis, TransformationType
+
+    coord_system = dict(default_coord_system)
+
+    if params.coord_system.convention:
+        coord_system['convention'] = params.coord_system.convention
+
+    if params.coord_system.origin:
+        coord_system['origin'] = tuple(params.coord_system.origin)
+
+    if params.coord_system.vectors:
+        from nexgen.command_line.cli_utils import split_arrays
+        vectors = split_arrays(['x', 'y', 'z'], params.coord_system.vectors)
+        translation = TransformationType.TRANSLATION
+        coord_system['x'] = Axis('x', '.', translation, vectors['x'])
+        coord_system['y'] = Axis('y', 'x', translation, vectors['y'])
+        coord_system['z'] = Axis('z', 'y', translation, vectors['z'])
+
+    return coord_system
+
+
+def relink_to_directory(nexus_file, directory):
+    """
+    Make external links to files in `directory` relative (file name only)
+
+    nexgen writes absolute links when the NeXus file is written outside the
+    data directory. After moving the file next to the data, the links
+    should be the same as if it was written there directly.
+    """
+
+    import h5py
+
+    def relink(group):
+        for name in list(group):
+            link = group.get(name, getlink=True)
+            if isinstance(link, h5py.ExternalLink):
+                if os.path.dirname(link.filename) == directory:
+                    path = link.path
+                    del group[name]
+                    group[name] = h5py.ExternalLink(
+                        os.path.basename(link.filename), path)
+            elif isinstance(link, h5py.HardLink):
+                if group.get(name, getclass=True) is h5py.Group:
+                    relink(group[name])
+
+    with h5py.File(nexus_file, 'r+') as file:
+        relink(file)
@@ -1,17 +1,19 @@
 """Define Singla dataset class"""
 import os
-import logging
 import time
 import re
 import traceback
+from collections import OrderedDict
 from autoed.constants import slurm_file
 from autoed.global_config import global_config
-from autoed.convert import generate_nexus_file
-from autoed.process.pipeline import run_processing_pipelines
-from autoed.beam_position.beam_center import BeamCenterCalculator
 from autoed.utility.misc_functions import replace_dir, is_file_fully_written
-from autoed.metadata import Metadata
-from autoed.process.plot_spots import plot_spots_from_dataset
+from autoed.metadata import Metadata, MetadataCache
+from autoed.events import event_bus, CONVERTED, CONVERSION_FAILED
+from autoed.utility.logger_pool import dataset_loggers
+from autoed.timing import span, timed
+
+# Seconds after processing during which new triggers are ignored
+REPROCESS_WAIT_TIME = 300
 
 
 class SinglaDataset:                    # pylint: disable=R0902
@@ -78,23 +80,18 @@ class SinglaDataset:                    # pylint: disable=R0902
 
     def set_logger(self, clear=True):
 
-        self.logger = logging.getLogger(self.base)
-        self.logger.setLevel(logging.DEBUG)
+        dataset_loggers.max_open = global_config.max_open_dataset_logs
+        dataset_loggers.use_queue = global_config.queue_dataset_logs
 
         if clear:          # Clear the log file if it exists
+            dataset_loggers.release(self.base)
             with open(self.autoed_log_file, 'w'):
                 pass
 
-        file_handler = logging.FileHandler(self.autoed_log_file)
-
-        fmt = '%(asctime)s.%(msecs)03d %(levelname)s - %(message)s'
-        formatter = logging.Formatter(fmt, datefmt='%d-%m-%Y %H:%M:%S')
-        file_handler.setFormatter(formatter)
-
-        file_handler.setLevel(logging.DEBUG)
-
-        self.logger.addHandler(file_handler)
+        self.logger = dataset_loggers.get_logger(self.base,
+                                                 self.autoed_log_file)
 
+    @timed('files_present')
     def all_files_present(self):
         """Checks if all files for the current dataset are present"""
 
@@ -139,6 +136,16 @@ class SinglaDataset:                    # pylint: disable=R0902
                 self.logger.info('Master file size test failed: %d %s'
                                  % (s1, self.master_file))
 
+            if (global_config.use_metadata_cache and
+                    MetadataCache(self).is_valid()):
+                # The metadata files did not change since the last run
+                msg = 'Metadata files unchanged since the last run. '
+                msg += 'Not waiting for log, mdoc, and Patch files.'
+                self.logger.info(msg)
+                if con1 and con_data:
+                    self.present_lock = True
+                return con1 and con_data
+
             self.logger.info('Waiting for log file: %s'
                              % self.log_file)
             con2, s2, t2 = is_file_fully_written(self.log_file)
@@ -195,7 +202,7 @@ class SinglaDataset:                    # pylint: disable=R0902
         reprocess it again.
         """
         time_diff = time.time() - self.last_processed_time
-        if time_diff > 300:
+        if time_diff > REPROCESS_WAIT_TIME:
             self.processed = False
         else:
             msg = 'Detected trigger file, but dataset processed recently.'
@@ -204,6 +211,10 @@ class SinglaDataset:                    # pylint: disable=R0902
 
     def compute_beam_center(self):
 
+        # h5py, hdf5plugin and matplotlib are imported only when needed
+        from autoed.beam_position.beam_center import BeamCenterCalculator
+        from autoed.beam_position.plot import deferred_plots
+
         if len(self.data_files) > 0:
 
             calc = BeamCenterCalculator(self.data_files[0])
@@ -218,11 +229,15 @@ class SinglaDataset:                    # pylint: disable=R0902
                 return
 
             ed_root = global_config.ed_root_dir
+            deferred_plots.max_pending = global_config.max_deferred_plots
             try:
-                x, y = calc.center_from_mixed(every=50,
-                                              plot_file=self.beam_figure,
-                                              title=self.beam_figure,
-                                              ed_root_dir=ed_root)
+                x, y = calc.center_from_mixed(
+                    every=50,
+                    plot_file=self.beam_figure,
+                    title=self.beam_figure,
+                    ed_root_dir=ed_root,
+                    defer_plot=global_config.defer_beam_plots,
+                    logger=self.logger)
             except Exception:
                 full_traceback = traceback.format_exc()
                 msg = "Failed to compute the beam center.\n"
@@ -247,6 +262,18 @@ class SinglaDataset:                    # pylint: disable=R0902
 
     def fetch_metadata(self):
 
+        use_cache = global_config.use_metadata_cache
+        cache = MetadataCache(self)
+
+        if use_cache:
+            metadata = cache.load()
+            if metadata is not None:
+                msg = 'Metadata files unchanged since the last run. '
+                msg += f"Using cached metadata from {cache.file}"
+                self.logger.info(msg)
+                self.metadata = metadata
+                return True
+
         metadata = Metadata()
         new_files_exist = (os.path.exists(self.master_file) and
                            os.path.exists(self.json_file))
@@ -265,6 +292,10 @@ class SinglaDataset:                    # pylint: disable=R0902
                 self.logger.error('Failed to fetch metadata from txt files')
                 return False
 
+        if use_cache:
+            source = 'json' if success_json else 'txt'
+            cache.save(metadata, source)
+
         self.metadata = metadata
         return True
 
@@ -273,36 +304,141 @@ class SinglaDataset:                    # pylint: disable=R0902
         if not self.processed:
             self.processed = True
 
+            with span('process', dataset=self.base) as process_span:
+                success = self._process(global_config)
+            msg = f"Processing stages of {self.dataset_name}: "
+            msg += process_span.format_children()
+            self.logger.info(msg)
+            return success
+        return False
+
+    def _process(self, global_config):
+
+        from autoed.convert import generate_nexus_file
+        from autoed.process.pipeline import run_processing_pipelines
+        from autoed.process.plot_spots import plot_spots_from_dataset
+
+        with span('plot_spots'):
             plot_spots_from_dataset(self)
 
-            if not self.beam_center:
-                msg = f"Computing the beam center for {self.dataset_name}"
-                self.logger.info(msg)
+        if not self.beam_center:
+            msg = f"Computing the beam center for {self.dataset_name}"
+            self.logger.info(msg)
 
-                # Will write the default if it fails to compute
+            # Will write the default if it fails to compute
+            with span('beam_center'):
                 self.compute_beam_center()
 
-                msg = f"Beam center for {self.dataset_name}"
-                msg += ' = (%.2f, %.2f) ' % self.beam_center
-                self.logger.info(msg)
+            msg = f"Beam center for {self.dataset_name}"
+            msg += ' = (%.2f, %.2f) ' % self.beam_center
+            self.logger.info(msg)
 
+        with span('metadata'):
             success_metadata = self.fetch_metadata()
-            if not success_metadata:
-                msg = 'Failed to fetch metadata from JSON and TXT.\n'
-                msg += 'No conversion/processing'
-                self.logger.error(msg)
-                return False
-            else:
-                success = generate_nexus_file(self)
-                if success:
-                    os.makedirs(self.output_path, exist_ok=True)
-                    run_processing_pipelines(self, global_config.local)
-                    self.last_processed_time = time.time()
+        if not success_metadata:
+            msg = 'Failed to fetch metadata from JSON and TXT.\n'
+            msg += 'No conversion/processing'
+            self.logger.error(msg)
+            event_bus.publish(CONVERSION_FAILED, dataset=self.base,
+                              reason='metadata')
+            return False
 
-                    return True
-                else:
-                    msg = 'Failed to generate nexus file'
-                    self.logger.error(msg)
-                    self.last_processed_time = time.time()
-                    return False
+        with span('nexgen'):
+            success = generate_nexus_file(self)
+        event_type = CONVERTED if success else CONVERSION_FAILED
+        event_bus.publish(event_type, dataset=self.base)
+        if success:
+            os.makedirs(self.output_path, exist_ok=True)
+            with span('pipelines'):
+                run_processing_pipelines(self, global_config.local)
+            self.last_processed_time = time.time()
+            return True
+
+        msg = 'Failed to generate nexus file'
+        self.logger.error(msg)
+        self.last_processed_time = time.time()
         return False
+
+
+class DatasetRecord:
+    """What a watcher remembers about a dataset between triggers"""
+
+    __slots__ = ('base', 'last_processed_time', 'beam_center')
+
+    def __init__(self, base, last_processed_time=0, beam_center=None):
+        self.base = base
+        self.last_processed_time = last_processed_time
+        self.beam_center = beam_center
+
+
+class DatasetStateStore:
+    """
+    A bounded table of the datasets seen by a watcher
+
+    Only a small record is kept for each dataset (when it was processed and
+    its beam center), not the dataset object with its logger and metadata.
+    A dataset object is created again from its record for every trigger
+    (`restore`) and put back into the table afterwards (`save`).
+
+    Parameters
+    ----------
+    max_records : int
+        Maximum number of records. The least recently used records are
+        forgotten first, except for datasets processed within the last
+        `REPROCESS_WAIT_TIME` seconds (needed to ignore repeated triggers).
+        A forgotten dataset is handled as a new one when triggered again.
+    """
+
+    def __init__(self, max_records=10000):
+
+        self.max_records = max_records
+        self.records = OrderedDict()    # Basename -> DatasetRecord
+
+    def __contains__(self, basename):
+        return basename in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def restore(self, basename):
+        """
+        Create the dataset object for a known dataset
+
+        The dataset log file is appended to (not cleared).
+        """
+
+        record = self.records[basename]
+        self.records.move_to_end(basename)
+
+        dataset = SinglaDataset.from_basename(basename, make_out_path=False)
+        os.makedirs(dataset.output_path, exist_ok=True)
+        dataset.set_logger(clear=False)
+        dataset.last_processed_time = record.last_processed_time
+        dataset.processed = record.last_processed_time > 0
+        dataset.beam_center = record.beam_center
+        return dataset
+
+    def save(self, dataset):
+        """Update the record of a dataset, and release its log file"""
+
+        self.records[dataset.base] = DatasetRecord(
+            dataset.base, dataset.last_processed_time, dataset.beam_center)
+        self.records.move_to_end(dataset.base)
+        dataset_loggers.release(dataset.base)
+        self._evict()
+
+    def _evict(self, now=None):
+
+        excess = len(self.records) - max(self.max_records, 0)
+        if excess <= 0:
+            return
+
+        now = time.time() if now is None else now
+        evicted = []
+        for basename, record in self.records.items():
+            if len(evicted) == excess:
+                break
+            if now - record.last_processed_time > REPROCESS_WAIT_TIME:
+                evicted.append(basename)
+        for basename in evicted:
+            del self.records[basename]
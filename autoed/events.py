@@ -0,0 +1,170 @@
+"""A simple event bus for AutoED processing events"""
+import json
+import os
+import threading
+import time
+
+from autoed.constants import autoed_events_var
+
+DATASET_DETECTED = 'dataset_detected'
+FILES_COMPLETE = 'files_complete'
+CONVERTED = 'converted'
+CONVERSION_FAILED = 'conversion_failed'
+PIPELINE_SUBMITTED = 'pipeline_submitted'
+PIPELINE_DONE = 'pipeline_done'
+
+MAX_EVENTS_FILE_SIZE = 10 * 1024**2    # Rotate the events file after 10 MB
+
+
+class EventBus:
+    """Passes processing events to all subscribed callbacks"""
+
+    def __init__(self):
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, callback):
+        """Call `callback(event)` for every published event"""
+        with self.lock:
+            if callback not in self.subscribers:
+                self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def publish(self, event_type, **data):
+        """
+        Publish an event
+
+        Parameters
+        ----------
+        event_type : str
+            One of the event types defined in this module.
+        data :
+            JSON serializable event details (e.g. the dataset name).
+
+        Returns
+        -------
+        event : dict
+            The published event.
+        """
+
+        event = {'type': event_type, 'time': time.time(), 'pid': os.getpid()}
+        event.update(data)
+
+        with self.lock:
+            subscribers = list(self.subscribers)
+
+        # A failing subscriber must not stop the processing
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception:
+                pass
+        return event
+
+
+class EventFileWriter:
+    """
+    Subscriber that appends events to a JSON lines file
+
+    The file is shared by the watcher and the processes it starts (e.g.
+    autoed_add_to_database), and read by the AutoED server.
+    """
+
+    def __init__(self, filename, max_size=MAX_EVENTS_FILE_SIZE):
+        self.filename = filename
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+
+        line = json.dumps(event, default=str) + '\n'
+        with self.lock:
+            try:
+                if os.path.getsize(self.filename) > self.max_size:
+                    os.replace(self.filename, self.filename + '.1')
+            except OSError:
+                pass
+            # A single write of a line in append mode, so lines from
+            # different processes are not mixed
+            with open(self.filename, 'a', encoding='utf-8') as file:
+                file.write(line)
+
+
+def read_events(filename, position=0):
+    """
+    Read the events written to an events file after `position`
+
+    Parameters
+    ----------
+    filename : str
+        The events file.
+    position : int
+        File offset returned by the previous call (0 to read all events).
+
+    Returns
+    -------
+    events : list of dict
+        The new (complete) events.
+    position : int
+        The offset to use in the next call.
+    """
+
+    try:
+        size = os.path.getsize(filename)
+    except OSError:
+        return [], 0
+
+    if size < position:     # The file was rotated
+        position = 0
+
+    with open(filename, 'rb') as file:
+        file.seek(position)
+        data = file.read()
+
+    # Keep an incomplete last line for the next call
+    end = data.rfind(b'\n') + 1
+    events = []
+    for line in data[:end].splitlines():
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            continue
+    return events, position + end
+
+
+def log_events_to_file(filename=None):
+    """
+    Write all events published in this process to an events file
+
+    Parameters
+    ----------
+    filename : str, optional
+        The events file. By default, the file set in the environment
+        variable AUTOED_EVENTS_FILE (set by the watcher for the processes it
+        starts). Nothing is done if neither is set.
+    """
+
+    global _file_writer
+
+    filename = filename or os.getenv(autoed_events_var)
+    if not filename:
+        return
+
+    with _writer_lock:
+        if _file_writer is not None:
+            if _file_writer.filename == filename:
+                return
+            event_bus.unsubscribe(_file_writer)
+        _file_writer = EventFileWriter(filename)
+        event_bus.subscribe(_file_writer)
+
+
+_file_writer = None
+_writer_lock = threading.Lock()
+
+# A Singleton object used to publish events
+event_bus = EventBus()
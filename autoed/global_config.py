@@ -1,7 +1,10 @@
 """ Contains global configuration dictionary """
+import copy
 import json
 import os
+import threading
 from autoed.constants import (autoed_config_var, autoed_config_file)
+from autoed.utility.profiling import profiled
 
 default_global_config = {}
 default_global_config['inotify'] = False
@@ -17,10 +20,28 @@ default_global_config['ed_root_dir'] = 'ED'
 default_global_config['processed_dir'] = 'processed'  # !CHANGE IN dataset
 default_global_config['report_wait_time_sec'] = 600
 default_global_config['slurm_user'] = 'gda2'
+default_global_config['slurm_api_url'] = \
+    'https://slurm-rest.diamond.ac.uk:8443/slurm/v0.0.42'
 default_global_config['run_multiplex'] = True
 default_global_config['multiplex_pipeline'] = 'default'
 default_global_config['multiplex_indexing_percent_threshold'] = 75
 default_global_config['multiplex_run_on_every_nth'] = 5
+default_global_config['multiplex_incremental'] = False
+default_global_config['multiplex_full_merge_factor'] = 2.0
+default_global_config['multiplex_full_merge_interval_sec'] = 3600
+default_global_config['multiplex_run_timeout_sec'] = 10800
+default_global_config['use_metadata_cache'] = True
+default_global_config['nexgen_in_process'] = False
+default_global_config['defer_beam_plots'] = True
+default_global_config['max_deferred_plots'] = 8
+default_global_config['reload_config'] = True
+default_global_config['server_max_jobs'] = 2
+default_global_config['max_open_dataset_logs'] = 64
+default_global_config['queue_dataset_logs'] = True
+default_global_config['max_known_datasets'] = 10000
+default_global_config['timing_summary_interval_sec'] = 600
+default_global_config['metrics_port'] = 0
+default_global_config['trigger_quiet_time_sec'] = 2.
 
 
 run_pipelines = {'default': True,
@@ -124,6 +145,20 @@ class GlobalConfig(dict):
         for key, value in default_global_config.items():
             self[key] = value
 
+        # Internal state (kept out of the configuration dictionary)
+        object.__setattr__(self, '_lock', threading.RLock())
+        object.__setattr__(self, '_version', 0)
+        object.__setattr__(self, '_config_file', None)
+        object.__setattr__(self, '_file_signature', None)
+        object.__setattr__(self, '_file_values', {})
+        object.__setattr__(self, '_commandline_keys', set())
+        object.__setattr__(self, '_local_config_loaded', False)
+
+    @property
+    def version(self):
+        """Incremented every time the configuration is reloaded"""
+        return self._version
+
     def save_to_json(self, filename):
         """ Saves the configuration dictionary to JSON file """
         dict_entries = {key: value for key, value in self.items()}
@@ -148,6 +183,7 @@ class GlobalConfig(dict):
         config_file = os.getenv(autoed_config_var)
         log = ""
         bfr = 31*" "
+        object.__setattr__(self, '_local_config_loaded', True)
 
         if not config_file:
             log = "Local configuration file not set up.\n"
@@ -158,9 +194,11 @@ class GlobalConfig(dict):
             if not os.path.isfile(config_file):
                 log = f"Configuration file not found: '{config_file}'.\n"
                 log += bfr + "Using the default configuration."
+                self._watch_config_file(config_file, None, {})
                 return log
             else:
 
+                signature = _file_signature(config_file)
                 with open(config_file, 'r') as f:
                     local_config_data = json.load(f)
 
@@ -182,6 +220,117 @@ class GlobalConfig(dict):
                             log += f"{local_value}"
                             log += f"  (old value: {value})"
                             self[key] = local_value
+
+                self._watch_config_file(config_file, signature,
+                                        local_config_data)
+        return log
+
+    def load_local_config(self):
+        """
+        Overwrite the defaults from the local configuration file, unless
+        this was already done in this process.
+
+        Command line tools call this before using the configuration, so
+        the file is not read when only importing AutoED modules.
+
+        Returns
+        -------
+        log : string
+            Same as `overwrite_from_local_config` (empty if already loaded).
+        """
+
+        if self._local_config_loaded:
+            return ''
+        return self.overwrite_from_local_config()
+
+    def _watch_config_file(self, config_file, signature, values):
+        """Remember the loaded config file, so changes can be reloaded"""
+
+        object.__setattr__(self, '_config_file', config_file)
+        object.__setattr__(self, '_file_signature', signature)
+        object.__setattr__(self, '_file_values', values)
+
+    def reload_if_changed(self, validate=None):
+        """
+        Reload the local configuration file if it changed since last loaded.
+
+        Only the parameters whose value changed in the file are updated.
+        Parameters set on the command line, or changed at runtime and not
+        in the file, keep their values. The new values are applied all at
+        once (or not at all), so readers never see half of a reload.
+
+        Parameters
+        ----------
+        validate : callable, optional
+            Called with the new configuration (a dict) before it is applied.
+            If it raises an exception, the reload is rejected.
+
+        Returns
+        -------
+        log : string
+            Used to write a log message (empty if nothing was reloaded).
+        """
+
+        config_file = self._config_file
+        if not config_file:
+            return ''
+
+        signature = _file_signature(config_file)
+        if signature is None or signature == self._file_signature:
+            return ''
+
+        bfr = 31*" "
+        try:
+            with open(config_file, 'r') as f:
+                file_values = json.load(f)
+            if not isinstance(file_values, dict):
+                raise ValueError('Not a JSON object')
+        except (OSError, ValueError) as e:
+            # Do not try this version of the file again
+            object.__setattr__(self, '_file_signature', signature)
+            log = f"Failed to reload configuration file '{config_file}'.\n"
+            log += bfr + f"{e}\n"
+            log += bfr + "Keeping the current configuration."
+            return log
+
+        changes = {}
+        old_values = self._file_values
+        for key, value in self.items():
+            if key in self._commandline_keys:
+                continue
+            new_value = file_values.get(key, _MISSING)
+            if new_value == old_values.get(key, _MISSING):
+                continue
+            if new_value is _MISSING:   # Removed from the file
+                new_value = copy.deepcopy(default_global_config.get(key))
+            if new_value != value:
+                changes[key] = new_value
+
+        if changes and validate is not None:
+            candidate = dict(self)
+            candidate.update(changes)
+            try:
+                validate(candidate)
+            except Exception as e:
+                object.__setattr__(self, '_file_signature', signature)
+                log = "Rejected the changes in the configuration file "
+                log += f"'{config_file}':\n" + bfr + f"{e}\n"
+                log += bfr + "Keeping the current configuration."
+                return log
+
+        with self._lock:
+            self.update(changes)
+            if changes:
+                object.__setattr__(self, '_version', self._version + 1)
+            self._watch_config_file(config_file, signature, file_values)
+
+        if not changes:
+            return ''
+
+        log = f"Reloaded configuration file '{config_file}' "
+        log += f"(version {self._version}):"
+        for key, value in changes.items():
+            log += '\n' + bfr + f"   {key}: {value}"
         return log
 
     def print_to_log(self, logger):
@@ -211,6 +360,7 @@ class GlobalConfig(dict):
                     log += '\n' + bfr + f"  {key}: {args_dict[key]}  "
                     log += f"(old value: {value})"
                     self[key] = args_dict[key]
+                    self._commandline_keys.add(key)
 
         if self['test']:
             # For 'dummy' run we want to run with default arguments
@@ -243,10 +393,23 @@ class GlobalConfig(dict):
             raise AttributeError(msg)
 
 
+_MISSING = object()
+
+
+def _file_signature(filename):
+    """Modification time and size of a file (None if it does not exist)"""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
 # A Singleton object to keep the global configuration
 global_config = GlobalConfig()
 
 
+@profiled
 def save_default():
     """Used on the commandline as 'autoed_generate_config' """
 
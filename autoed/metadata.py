@@ -1,8 +1,10 @@
 """Everything related to reading metadata files"""
 from __future__ import annotations
+import os
 import re
 import json
 
+from autoed.constants import metadata_cache_file
 
 from autoed.utility.misc_functions import (
     electron_wavelength, scrap, get_detector_distance,
@@ -177,6 +179,105 @@ class Metadata(dict):
             raise AttributeError(msg)
 
 
+class MetadataCache:
+    """
+    Metadata of a dataset saved next to its processed output
+
+    The cache stores the metadata together with the modification time and
+    size of every source file it was read from. As long as none of the
+    source files changed, reprocessing the dataset can use the cached
+    metadata. It does not have to wait for the files to be fully written
+    or parse them again.
+    """
+
+    version = 1
+
+    def __init__(self, dataset):
+
+        self.dataset = dataset
+        self.file = os.path.join(dataset.output_path, metadata_cache_file)
+
+    def source_files(self, source):
+        """Files the metadata is read from ('json' or 'txt' source)"""
+
+        d = self.dataset
+        if source == 'json':
+            return [d.json_file]
+        return [d.mdoc_file, d.log_file, d.patch_file]
+
+    def load(self):
+        """
+        Return the cached Metadata, or None if the cache is missing or stale
+        """
+
+        try:
+            with open(self.file, 'r') as cache_file:
+                data = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+
+        if data.get('version') != self.version:
+            return None
+
+        source = data.get('source')
+        if source not in ('json', 'txt'):
+            return None
+
+        # JSON metadata takes priority over the textual one
+        if source == 'txt' and os.path.exists(self.dataset.json_file):
+            return None
+
+        files = data.get('files', {})
+        if sorted(files) != sorted(self.source_files(source)):
+            return None
+
+        for filename, signature in files.items():
+            if file_signature(filename) != signature:
+                return None
+
+        metadata = Metadata()
+        metadata.update(data['metadata'])
+        return metadata
+
+    def is_valid(self):
+        """True if the cached metadata matches the source files"""
+        return self.load() is not None
+
+    def save(self, metadata, source):
+        """Save the metadata read from the given source ('json' or 'txt')"""
+
+        files = {}
+        for filename in self.source_files(source):
+            files[filename] = file_signature(filename)
+
+        data = {'version': self.version,
+                'source': source,
+                'files': files,
+                'metadata': dict(metadata)}
+
+        temp_file = self.file + f".{os.getpid()}.tmp"
+        try:
+            with open(temp_file, 'w') as cache_file:
+                json.dump(data, cache_file, indent=2)
+            os.replace(temp_file, self.file)
+        except (OSError, TypeError, ValueError):
+            # The cache is only an optimization
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            return False
+        return True
+
+
+def file_signature(filename):
+    """Return [mtime_ns, size] of a file, or None if it does not exist"""
+
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
 def get_angle_increment_old(dataset):
     """Scrap old data format and get the angle increment"""
 
@@ -0,0 +1,375 @@
+"""Processing metrics in the Prometheus text format"""
+import logging
+import math
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from autoed.constants import events_file, timings_file
+from autoed.events import (read_events, DATASET_DETECTED, FILES_COMPLETE,
+                           CONVERTED, CONVERSION_FAILED, PIPELINE_SUBMITTED,
+                           PIPELINE_DONE)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds (in seconds) of the duration histogram buckets
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_value(value):
+
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values):
+
+    if not names:
+        return ''
+    labels = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', r'\\').replace('"', r'\"')
+        value = value.replace('\n', r'\n')
+        labels.append(f'{name}="{value}"')
+    return '{' + ','.join(labels) + '}'
+
+
+class Metric:
+    """
+    A metric with optional labels
+
+    Parameters
+    ----------
+    name : str
+        Name of the metric (e.g. 'autoed_datasets_detected_total').
+    documentation : str
+        The HELP text.
+    labelnames : tuple of str
+        Names of the labels. Their values are given as keyword arguments
+        when the metric is updated.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}     # Label values -> value
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+
+        if set(labels) != set(self.labelnames):
+            msg = f"Metric {self.name} has the labels {self.labelnames}, "
+            msg += f"not {tuple(labels)}"
+            raise ValueError(msg)
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def get(self, **labels):
+        with self.lock:
+            return self.values.get(self._key(labels), 0)
+
+    def clear(self):
+        with self.lock:
+            self.values = {}
+
+    def samples(self):
+        """Yield (name suffix, label names, label values, value)"""
+
+        with self.lock:
+            values = dict(self.values)
+        for key, value in values.items():
+            yield '', self.labelnames, key, value
+
+    def render(self):
+
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.type}"]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}"
+                         f"{_format_labels(names, values)} "
+                         f"{_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """A value that only goes up (e.g. the number of processed datasets)"""
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError('Counters can only be increased')
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down (e.g. the length of a queue)"""
+
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    """Counts of observed values (e.g. durations) in cumulative buckets"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key,
+                                            ([0] * len(self.buckets), 0.))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self.values[key] = (counts, total + value)
+
+    def get(self, **labels):
+        """The number of observed values"""
+
+        with self.lock:
+            counts, _ = self.values.get(self._key(labels), ([0], 0.))
+        return sum(counts)
+
+    def samples(self):
+
+        with self.lock:
+            values = {key: (list(counts), total)
+                      for key, (counts, total) in self.values.items()}
+        names = self.labelnames + ('le',)
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield ('_bucket', names, key + (_format_value(bound),),
+                       cumulative)
+            yield '_sum', self.labelnames, key, total
+            yield '_count', self.labelnames, key, cumulative
+
+
+class MetricsRegistry:
+    """
+    The metrics of a process
+
+    Collectors (callables without arguments) are run before the metrics are
+    rendered, e.g. to set gauges or to read new events from a file.
+    """
+
+    def __init__(self):
+        self.metrics = {}     # Name -> Metric
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = cls(name, documentation, labelnames, **kwargs)
+                self.metrics[name] = metric
+            elif not isinstance(metric, cls):
+                msg = f"Metric {name} is already a {metric.type}"
+                raise ValueError(msg)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DURATION_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation,
+                                   labelnames, buckets=buckets)
+
+    def add_collector(self, collector):
+        with self.lock:
+            if collector not in self.collectors:
+                self.collectors.append(collector)
+
+    def render(self):
+        """All metrics in the Prometheus text format"""
+
+        with self.lock:
+            collectors = list(self.collectors)
+            metrics = list(self.metrics.values())
+
+        # A failing collector must not hide the other metrics
+        for collector in collectors:
+            try:
+                collector()
+            except Exception:
+                logging.getLogger(__name__).exception('Metrics collector')
+
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+class WatcherMetrics:
+    """
+    Metrics of watchers, read from the files they write
+
+    The events file and the timings file of a watched directory are shared
+    by the watcher and the processes it starts (e.g. autoed_add_to_database,
+    which reports finished pipelines), so both the watcher and the AutoED
+    server get complete metrics by following these files. Each call of
+    `update` reads the lines written since the previous call.
+    """
+
+    def __init__(self, registry):
+
+        labels = ('watcher',)
+        self.detected = registry.counter(
+            'autoed_datasets_detected_total', 'Datasets detected', labels)
+        self.complete = registry.counter(
+            'autoed_datasets_complete_total',
+            'Datasets with all files present', labels)
+        self.processed = registry.counter(
+            'autoed_datasets_processed_total',
+            'Datasets converted to NeXus (pipelines started)', labels)
+        self.failed = registry.counter(
+            'autoed_datasets_failed_total',
+            'Datasets that could not be converted', labels)
+        self.submitted = registry.counter(
+            'autoed_pipelines_submitted_total', 'Pipelines submitted',
+            labels + ('pipeline',))
+        self.done = registry.counter(
+            'autoed_pipelines_done_total',
+            'Pipelines finished and added to the database',
+            labels + ('pipeline',))
+        self.outstanding = registry.gauge(
+            'autoed_pipelines_outstanding',
+            'Pipelines submitted and not added to the database yet', labels)
+        self.database_latency = registry.histogram(
+            'autoed_database_update_seconds',
+            'Time from the end of a pipeline to its database update',
+            labels)
+        self.stage_duration = registry.histogram(
+            'autoed_stage_duration_seconds',
+            'Duration of the dataset processing stages',
+            labels + ('stage', 'status'))
+
+        self.positions = {}     # File name -> offset of the next line
+        self.lock = threading.Lock()
+
+    def add_event(self, event, watcher):
+
+        event_type = event.get('type')
+        if event_type == DATASET_DETECTED:
+            self.detected.inc(watcher=watcher)
+        elif event_type == FILES_COMPLETE:
+            self.complete.inc(watcher=watcher)
+        elif event_type == CONVERTED:
+            self.processed.inc(watcher=watcher)
+        elif event_type == CONVERSION_FAILED:
+            self.failed.inc(watcher=watcher)
+        elif event_type == PIPELINE_SUBMITTED:
+            pipeline = event.get('pipeline', '')
+            self.submitted.inc(watcher=watcher, pipeline=pipeline)
+            self.outstanding.inc(watcher=watcher)
+        elif event_type == PIPELINE_DONE:
+            pipeline = event.get('pipeline', '')
+            self.done.inc(watcher=watcher, pipeline=pipeline)
+            # Events written before a restart may have no submission
+            if self.outstanding.get(watcher=watcher) > 0:
+                self.outstanding.inc(-1, watcher=watcher)
+            latency = event.get('database_latency')
+            if latency is not None:
+                self.database_latency.observe(latency, watcher=watcher)
+
+    def add_timing(self, record, watcher):
+
+        self.stage_duration.observe(record['duration'], watcher=watcher,
+                                    stage=record['stage'],
+                                    status=record['status'])
+
+    def update(self, watch_paths):
+        """Read the new events and timings of the watched directories"""
+
+        with self.lock:
+            for watch_path in watch_paths:
+                # Zero values, so rates can be computed from the start
+                for metric in (self.detected, self.complete, self.processed,
+                               self.failed, self.outstanding):
+                    metric.inc(0, watcher=watch_path)
+                for filename, add in (
+                        (os.path.join(watch_path, events_file),
+                         self.add_event),
+                        (os.path.join(watch_path, timings_file),
+                         self.add_timing)):
+                    position = self.positions.get(filename, 0)
+                    records, position = read_events(filename, position)
+                    self.positions[filename] = position
+                    for record in records:
+                        try:
+                            add(record, watch_path)
+                        except (KeyError, TypeError, ValueError):
+                            continue
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    registry = None
+
+    def do_GET(self):
+
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port, host='127.0.0.1', registry=None):
+    """
+    Serve the metrics at http://host:port/metrics in a background thread
+
+    Returns
+    -------
+    server : ThreadingHTTPServer
+        The server (call `shutdown` to stop it).
+    """
+
+    handler = type('MetricsRequestHandler', (_MetricsRequestHandler,),
+                   {'registry': registry or metrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever,
+                              name='autoed-metrics', daemon=True)
+    thread.start()
+    return server
+
+
+# A Singleton object with the metrics of a process
+metrics = MetricsRegistry()
@@ -1,21 +1,28 @@
 """AutoED multiplex processing"""
 import argparse
+import fcntl
 import json
 import glob
 import os
+import re
 from collections import namedtuple
 import subprocess
 import shutil
+import time
 from datetime import datetime
 
 from autoed.constants import (multiplex_dir, multiplex_output_dir,
                               report_dir, report_data_dir,
-                              database_json_file, multiplex_default_sample)
+                              database_json_file, multiplex_default_sample,
+                              multiplex_merged_dir, multiplex_manifest_file,
+                              multiplex_state_file, multiplex_lock_file,
+                              PROCESS_DONE_TRIGGER)
 from autoed.dataset import SinglaDataset
 from autoed.global_config import global_config
 from autoed.utility.filesystem import clear_dir
 from autoed.process.slurm import run_slurm_job
 import autoed
+from autoed.utility.profiling import profiled
 
 # The assumption of the file structure is the following
 # /../../ED/SAMPLE_DIRS/CRYSTAL_DIR/SWEEP_DIR/DATA_master.h5
@@ -36,6 +43,7 @@ MultiplexInfo = namedtuple(
      ])
 
 
+@profiled
 def main():
     """Find all integration results and process them with multiplex"""
 
@@ -49,14 +57,21 @@ def main():
                         default=False,
                         help='Run multiplex locally')
 
+    msg = 'Wait for the multiplex run of the sample, then run the request '
+    msg += 'made during the run (if any)'
+    parser.add_argument('--pending', action='store_true',
+                        default=False, help=msg)
+
     args = parser.parse_args()
 
+    global_config.load_local_config()
     dataset = MultiplexDataset(master_file=args.master_file,
                                local=args.local)
 
-    success = dataset.copy_files()
-    if success and dataset.run_condition():
-        dataset.run()
+    if args.pending:
+        dataset.submit_pending()
+    else:
+        dataset.submit()
 
 
 class MultiplexDataset:
@@ -109,6 +124,171 @@ class MultiplexDataset:
 
         return False
 
+    @property
+    def sample_path(self):
+        """Directory where the multiplex files of the sample are kept"""
+        return os.path.join(self.info.multiplex_dir_path,
+                            self.info.sample_dirs)
+
+    @property
+    def output_path(self):
+        """Directory where xia2.multiplex runs"""
+        return os.path.join(self.sample_path, multiplex_output_dir)
+
+    def submit(self):
+        """
+        Copy the dataset files and run multiplex if the counter says so
+
+        Several processes (one per finished dataset) can call this at the
+        same time. The counter and the pending request are kept in a
+        per-sample state file, which is only accessed while holding the
+        sample lock. Only one multiplex run per sample is in flight. If a
+        run is already in flight, the request is recorded as pending and
+        this call returns. The process that finishes the in-flight run then
+        runs multiplex once more for all pending requests, since a new run
+        merges all the data anyway.
+
+        Returns
+        -------
+        success : boolean
+            True if this request started a multiplex run.
+        """
+
+        if not self.info:
+            return False
+
+        with SampleLock(self.sample_path):
+            if not self.copy_files():
+                return False
+
+            state = MultiplexState(self.sample_path)
+            if not self.run_condition(state):
+                state.save()
+                return False
+
+            if not self.start_run(state):
+                return False
+
+        self.run_until_done()
+        return True
+
+    def submit_pending(self, poll_interval=10):
+        """
+        Wait for the multiplex run in flight, then run the pending request
+
+        Runs in the process started by `submit_pending_watch` when a SLURM
+        run is submitted. The wait ends when the job has written its
+        trigger file (.done), or after `multiplex_run_timeout_sec` (e.g. if
+        the job was killed).
+
+        Returns
+        -------
+        success : boolean
+            True if a pending request was started.
+        """
+
+        if not self.info:
+            return False
+
+        timeout = global_config['multiplex_run_timeout_sec']
+        while True:
+            with SampleLock(self.sample_path):
+                state = MultiplexState(self.sample_path)
+                if not state.run_in_flight(self.output_path, timeout):
+                    break
+            time.sleep(poll_interval)
+
+        done_file = os.path.join(self.output_path, PROCESS_DONE_TRIGGER)
+        if state.running and not os.path.exists(done_file):
+            msg = "Multiplex run did not finish within "
+            msg += f"{timeout} seconds"
+            write_to_log(self.info, msg)
+
+        if not self.take_pending():
+            return False
+
+        self.run_until_done()
+        return True
+
+    def submit_pending_watch(self):
+        """
+        Start a process that runs the pending request after the SLURM run
+
+        Like the report watch of the pipelines, it runs on this host, so
+        the SLURM job does not need AutoED or its configuration.
+        """
+
+        cmds = ['autoed_multiplex', '--pending', self.master_file]
+        try:
+            subprocess.Popen(cmds, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.DEVNULL,
+                             start_new_session=True)
+        except OSError as e:
+            msg = f"Error: cannot watch the multiplex run ({e}). Requests "
+            msg += "made during the run are left pending."
+            write_to_log(self.info, msg)
+
+    def start_run(self, state):
+        """
+        Mark a run as started, or the request as pending if one is in flight
+
+        Use only while holding the `SampleLock` of the sample.
+
+        Returns
+        -------
+        started : boolean
+            False if the request was left pending.
+        """
+
+        timeout = global_config['multiplex_run_timeout_sec']
+        if state.run_in_flight(self.output_path, timeout):
+            state.pending = True
+            state.save()
+            write_to_log(self.info, "Multiplex run in flight. "
+                                    "Request left pending.")
+            return False
+
+        state.start_run()
+        done_file = os.path.join(self.output_path, PROCESS_DONE_TRIGGER)
+        if os.path.exists(done_file):
+            os.remove(done_file)
+        state.save()
+        return True
+
+    def take_pending(self):
+        """Start a run if a request is pending (and no run is in flight)"""
+
+        with SampleLock(self.sample_path):
+            state = MultiplexState(self.sample_path)
+            if not state.pending:
+                return False
+            if not self.start_run(state):
+                return False
+
+        write_to_log(self.info, "Running the pending multiplex request")
+        return True
+
+    def run_until_done(self):
+        """
+        Run multiplex, and again as long as requests came in meanwhile
+
+        SLURM runs are only submitted here. A separate process waits for
+        the job and then runs the pending request (see `submit_pending`).
+        """
+
+        while True:
+            try:
+                self.run()
+            finally:
+                if self.local:     # Local runs are finished at this point
+                    with SampleLock(self.sample_path):
+                        state = MultiplexState(self.sample_path)
+                        state.running = False
+                        state.save()
+
+            if not (self.local and self.take_pending()):
+                return
+
     def run(self):
         """Run multiplex for the given sample"""
 
@@ -117,33 +297,99 @@ class MultiplexDataset:
 
         data_path = os.path.join(self.info.multiplex_dir_path,
                                  self.info.sample_dirs)
+
+        if global_config['multiplex_incremental']:
+            cmd = self.incremental_command(data_path, path)
+            if not cmd:
+                return
+        else:
+            cmd = multiplex_command(gather_multiplex_inputs(data_path))
+
         write_to_log(self.info, "Cleaning directory")
         clear_dir(path, skip_list=['multiplex.log'])
         write_to_log(self.info, "Running multiplex")
         write_to_log(self.info, f"Local set to {self.local}")
 
-        cmd = f'xia2.multiplex $(find {data_path} -name *expt | sort -V) '
-        cmd += f'$(find {data_path} -name *refl | sort -V)'
-
         if self.local:
             subprocess.run(cmd, shell=True, stdout=subprocess.PIPE,
                            stderr=subprocess.PIPE, cwd=path, env=os.environ,
                            check=False)
+            if global_config['multiplex_incremental']:
+                manifest = MultiplexManifest(data_path)
+                if manifest.promote(path):
+                    manifest.save()
+        else:
+            multiplex_with_slurm(self.info, cmd)
+            self.submit_pending_watch()
+
+    def incremental_command(self, data_path, output_path):
+        """
+        Build the multiplex command for the incremental mode
+
+        The result of the last finished multiplex run is kept (together with
+        a manifest of its inputs). New datasets are merged against that
+        result, and a full merge of all datasets is done only when the
+        `MultiplexManifest.needs_full_merge` policy asks for it.
+
+        Returns
+        -------
+        cmd : string or None
+            The xia2.multiplex command, or None if there is nothing to do.
+        """
+
+        manifest = MultiplexManifest(data_path)
+        if manifest.promote(output_path):
+            write_to_log(self.info, "Kept the result of the last multiplex run")
+
+        all_expts = gather_multiplex_inputs(data_path)
+
+        factor = global_config['multiplex_full_merge_factor']
+        interval = global_config['multiplex_full_merge_interval_sec']
+
+        if manifest.needs_full_merge(len(all_expts), factor, interval):
+            write_to_log(self.info, f"Full merge of {len(all_expts)} datasets")
+            expts = all_expts
+            manifest.set_pending(all_expts, full=True)
         else:
-            multiplex_with_slurm(self.info)
+            merged = set(manifest.merged_inputs)
+            new_expts = [f for f in all_expts if f not in merged]
+            if not new_expts:
+                write_to_log(self.info, "No new datasets to merge")
+                manifest.save()
+                return None
+
+            msg = f"Merging {len(new_expts)} new datasets into the result "
+            msg += f"of {len(merged)} datasets"
+            write_to_log(self.info, msg)
+            expts = [manifest.merged_expt] + new_expts
+            manifest.set_pending(manifest.merged_inputs + new_expts,
+                                 full=False)
 
-    def run_condition(self):
+        manifest.save()
+
+        return multiplex_command(expts)
+
+    def run_condition(self, state=None):
         """
         Counts the number of expt files in the sample directory and
         checks if it is a multiple of 'multiplex_run_on_every_nth'
+
+        If a `MultiplexState` is given, the condition is true when the count
+        has reached a new multiple since the last run. That way a multiple
+        is not skipped when several datasets are added at the same time.
+        The count is then also stored in the state.
         """
 
-        out_path = os.path.join(self.info.multiplex_dir_path,
-                                self.info.sample_dirs)
+        out_path = self.sample_path
 
         n = sum(1 for f in os.listdir(out_path) if f.endswith('.expt'))
+        every_nth = global_config['multiplex_run_on_every_nth']
 
-        condition = n % global_config['multiplex_run_on_every_nth'] == 0
+        if state is None:
+            condition = n % every_nth == 0
+        else:
+            condition = n // every_nth > state.last_run_count // every_nth
+            state.count = n
 
         msg = f"There are N = {n} files. Run condition: {condition}"
         write_to_log(self.info, msg)
@@ -151,6 +397,233 @@ class MultiplexDataset:
         return condition
 
 
+class SampleLock:
+    """An exclusive (inter-process) lock for a multiplex sample directory"""
+
+    def __init__(self, sample_path):
+        self.lock_file = os.path.join(sample_path, multiplex_lock_file)
+        self._file = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.lock_file), exist_ok=True)
+        self._file = open(self.lock_file, 'a', encoding='utf-8')
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+
+class MultiplexState:
+    """
+    Multiplex run counter and pending request of a sample
+
+    Use only while holding the `SampleLock` of the sample.
+    """
+
+    keys = ['count', 'last_run_count', 'running', 'run_start_time',
+            'pending']
+
+    def __init__(self, sample_path):
+
+        self.file = os.path.join(sample_path, multiplex_state_file)
+
+        self.count = 0                # Number of datasets in the sample
+        self.last_run_count = 0       # Number of datasets in the last run
+        self.running = False          # A multiplex run is in flight
+        self.run_start_time = 0
+        self.pending = False          # A request came in during the run
+
+        load_json_state(self, self.file, self.keys)
+
+    def save(self):
+        save_json_state(self, self.file, self.keys)
+
+    def run_in_flight(self, output_path, timeout):
+        """
+        Check if the last multiplex run is still going
+
+        A run is finished if its trigger file (.done) exists, or if it
+        has been running for longer than `timeout` seconds.
+        """
+
+        if not self.running:
+            return False
+
+        done_file = os.path.join(output_path, PROCESS_DONE_TRIGGER)
+        if os.path.exists(done_file):
+            return False
+
+        return time.time() - self.run_start_time < timeout
+
+    def start_run(self):
+        """Mark a run as started (it covers all pending requests)"""
+
+        self.pending = False
+        self.running = True
+        self.run_start_time = time.time()
+        self.last_run_count = self.count
+
+
+def load_json_state(obj, filename, keys):
+    """Set the attributes `keys` of `obj` from a JSON file (if it exists)"""
+
+    if os.path.exists(filename):
+        with open(filename, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        for key in keys:
+            if key in data:
+                setattr(obj, key, data[key])
+
+
+def save_json_state(obj, filename, keys):
+    """Atomically write the attributes `keys` of `obj` to a JSON file"""
+
+    data = {key: getattr(obj, key) for key in keys}
+
+    temp_file = filename + f".{os.getpid()}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as file:
+        json.dump(data, file, indent=2)
+    os.replace(temp_file, filename)
+
+
+class MultiplexManifest:
+    """
+    Keeps the last merged multiplex result of a sample and its inputs
+
+    The manifest is a JSON file in the sample directory. When a multiplex
+    run is submitted, its inputs are stored as pending. Once the run has
+    finished (its scaled.expt and scaled.refl exist), the result is copied
+    to the merged directory and the pending inputs become merged inputs.
+    """
+
+    keys = ['merged_inputs', 'last_full_merge_time', 'last_full_merge_count',
+            'pending_inputs', 'pending_full', 'pending_time']
+
+    def __init__(self, sample_path):
+
+        self.file = os.path.join(sample_path, multiplex_manifest_file)
+        self.merged_path = os.path.join(sample_path, multiplex_merged_dir)
+        self.merged_expt = os.path.join(self.merged_path, 'merged.expt')
+        self.merged_refl = os.path.join(self.merged_path, 'merged.refl')
+
+        self.merged_inputs = []           # expt files in the merged result
+        self.last_full_merge_time = 0
+        self.last_full_merge_count = 0
+        self.pending_inputs = None        # expt files of the submitted run
+        self.pending_full = False
+        self.pending_time = 0
+
+        load_json_state(self, self.file, self.keys)
+
+    def save(self):
+        """Write the manifest (atomically, it is shared by processes)"""
+        save_json_state(self, self.file, self.keys)
+
+    def has_merged_result(self):
+        """True if there is a finished merged result to merge against"""
+
+        return (len(self.merged_inputs) > 0 and
+                os.path.exists(self.merged_expt) and
+                os.path.exists(self.merged_refl))
+
+    def promote(self, output_path):
+        """
+        Keep the result of the pending run if it has finished
+
+        Returns
+        -------
+        promoted : boolean
+            True if the pending run finished and its result was kept.
+        """
+
+        if self.pending_inputs is None:
+            return False
+
+        scaled_expt = os.path.join(output_path, 'scaled.expt')
+        scaled_refl = os.path.join(output_path, 'scaled.refl')
+        if not (os.path.exists(scaled_expt) and os.path.exists(scaled_refl)):
+            return False
+
+        os.makedirs(self.merged_path, exist_ok=True)
+        shutil.copy(scaled_expt, self.merged_expt)
+        shutil.copy(scaled_refl, self.merged_refl)
+
+        self.merged_inputs = self.pending_inputs
+        if self.pending_full:
+            self.last_full_merge_time = self.pending_time
+            self.last_full_merge_count = len(self.pending_inputs)
+
+        self.pending_inputs = None
+        self.pending_full = False
+        return True
+
+    def set_pending(self, inputs, full):
+        """Record the inputs of a submitted multiplex run"""
+
+        self.pending_inputs = list(inputs)
+        self.pending_full = full
+        self.pending_time = time.time()
+
+    def needs_full_merge(self, n_datasets, factor, interval):
+        """
+        Back-off policy for full merges
+
+        A full merge is needed if there is no merged result yet, if the
+        number of datasets grew by `factor` since the last full merge, or if
+        the last full merge is older than `interval` seconds. With a factor
+        of 2, full merges happen at N, 2N, 4N, ... datasets, so their total
+        cost grows linearly (not quadratically) with the session length.
+        """
+
+        if not self.has_merged_result():
+            return True
+        if n_datasets >= factor * self.last_full_merge_count:
+            return True
+        if time.time() - self.last_full_merge_time > interval:
+            return True
+        return False
+
+
+def gather_multiplex_inputs(data_path):
+    """
+    Return all expt files (with a matching refl file) copied for multiplex
+
+    Files produced by AutoED multiplex runs (output and merged directories)
+    are skipped. The list is sorted like `sort -V`.
+    """
+
+    skip_dirs = (multiplex_output_dir, multiplex_merged_dir)
+    expt_files = []
+
+    for root, dirs, files in os.walk(data_path):
+        dirs[:] = [d for d in dirs if d not in skip_dirs]
+        for file in files:
+            if file.endswith('.expt'):
+                expt_file = os.path.join(root, file)
+                refl_file = os.path.splitext(expt_file)[0] + '.refl'
+                if os.path.exists(refl_file):
+                    expt_files.append(expt_file)
+
+    return sorted(expt_files, key=natural_sort_key)
+
+
+def multiplex_command(expt_files):
+    """The xia2.multiplex command for expt files and their refl files"""
+
+    refl_files = [os.path.splitext(f)[0] + '.refl' for f in expt_files]
+    return 'xia2.multiplex ' + ' '.join(expt_files + refl_files)
+
+
+def natural_sort_key(string):
+    """Sort key that orders numbers inside strings numerically"""
+
+    return [int(part) if part.isdigit() else part
+            for part in re.split(r'(\d+)', string)]
+
+
 def print_info(info: MultiplexInfo) -> None:
     """Prints the MultiplexInfo data"""
 
@@ -266,7 +739,7 @@ def write_to_log(info: MultiplexInfo, message):
         file.write(f"{date_and_time} - {message}\n")
 
 
-def multiplex_with_slurm(info):
+def multiplex_with_slurm(info, cmd=None):
     """Creates a template slurm submission script to run multiplex"""
 
     slurm_template = 'data/relion_slurm_cpu.json'
@@ -281,8 +754,9 @@ def multiplex_with_slurm(info):
     data_path = os.path.join(info.multiplex_dir_path,
                              info.sample_dirs)
 
-    cmd = f'xia2.multiplex $(find {data_path} -name *expt | sort -V) '
-    cmd += f'$(find {data_path} -name *refl | sort -V)\n'
+    if cmd is None:
+        cmd = multiplex_command(gather_multiplex_inputs(data_path))
+    cmd += '\n'
 
     data['job']['current_working_directory'] = path
     # data['job']['environment']['USER'] = os.getenv('USER')
@@ -298,6 +772,7 @@ def multiplex_with_slurm(info):
     script += "module load dials\n"
     script += cmd
     script += "echo \"$(date '+%Y-%m-%d %H:%M:%S.%3N'):\" job finished;\n"
+    script += f"touch {PROCESS_DONE_TRIGGER};\n"
 
     data['script'] = script
 
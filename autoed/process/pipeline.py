@@ -10,24 +10,27 @@ from autoed.global_config import global_config
 from autoed.utility.filesystem import clear_dir
 from autoed.constants import PROCESS_DONE_TRIGGER
 from autoed.process.slurm import run_slurm_job
+from autoed.process.pipeline_registry import get_pipeline_registry
+from autoed.events import event_bus, PIPELINE_SUBMITTED
 
 
 class Pipeline(ABC):
     """An abstract processing pipeline class"""
 
     @abstractmethod
-    def __init__(self, dataset, pipeline_dict):
+    def __init__(self, dataset, template):
         """
         A pipeline to process diffraction data
 
         dataset : SinglaDataset
-        pipeline_dict : dictionary
-            A dictionary that defines all the pipeline details
+        template : PipelineTemplate
+            The compiled pipeline definition (from the pipeline registry)
         """
 
         self.dataset = dataset
-        self.info = pipeline_dict
-        self.method = pipeline_dict['pipeline_name']
+        self.template = template
+        self.info = template.info
+        self.method = template.name
         self.run_condition = False     # By default, pipeline will not run
 
         self.out_dir = os.path.join(dataset.output_path, self.method)
@@ -60,34 +63,19 @@ class Pipeline(ABC):
                           'processed_dir': self.out_dir,
                           'unit_cell': unit_cell}
 
-        script = self.info['script']
-
-        run_condition = self.info['run_condition']
-
-        if isinstance(run_condition, bool):
-            self.run_condition = run_condition
-        else:
-            try:
-                eval_out = eval(run_condition)
-                if isinstance(eval_out, bool):
-                    self.run_condition = eval_out
-            except Exception:
-                full_traceback = traceback.format_exc()
-                msg = "Failed to parse the run condition in the pipeline"
-                msg += f" '{self.method}'"
-                self.dataset.logger.error(msg)
-                self.run_condition = False
+        try:
+            self.run_condition = self.template.evaluate_condition(m, g)
+        except Exception:
+            full_traceback = traceback.format_exc()
+            msg = "Failed to evaluate the run condition in the pipeline"
+            msg += f" '{self.method}'\n"
+            msg += f"{full_traceback}\n"
+            self.dataset.logger.error(msg)
+            self.run_condition = False
 
         if self.run_condition:
-            cmd = ''
-            for line in script:
-                if line[-2:] == '%%':  # Concatenate without space
-                    cmd += line[:-2]
-                else:
-                    line += " "
-                    cmd += line
             try:
-                new_cmd = cmd.format(**variables_dict)
+                new_cmd = self.template.format_script(variables_dict)
             except Exception:
                 full_traceback = traceback.format_exc()
                 msg = f"Failed to parse the pipeline '{self.method}' script\n"
@@ -168,6 +156,8 @@ class LocalPipeline(Pipeline):
             self.dataset.logger.info(msg)
 
             self.submit_report_watch()
+            event_bus.publish(PIPELINE_SUBMITTED, dataset=self.dataset.base,
+                              pipeline=self.method, local=True)
 
             p = subprocess.run('bash ' + self.bash_file,
                                shell=True, stdout=subprocess.PIPE,
@@ -245,6 +235,8 @@ class SlurmPipeline(Pipeline):
                 return 0
 
             self.submit_report_watch()
+            event_bus.publish(PIPELINE_SUBMITTED, dataset=self.dataset.base,
+                              pipeline=self.method, local=False)
             msg = f"Data processed with pipeline '{self.method}'"
             self.dataset.logger.info(msg)
             return 1
@@ -267,21 +259,14 @@ def run_processing_pipelines(dataset, local):
     """Run only pipelines set in the global config file"""
 
     pipelines = []
-    running_pipelines = global_config.run_pipelines
+    registry = get_pipeline_registry()
 
     # Only run those pipelines that apear in the global config file
-    for name, run_pipeline in running_pipelines.items():
-        if run_pipeline:
-
-            # Search if the pipeline is defined in the global parameters
-            for pipeline in global_config.defined_pipelines:
-
-                if pipeline['pipeline_name'] == name:
-
-                    if local:
-                        pipelines.append(LocalPipeline(dataset, pipeline))
-                    else:
-                        pipelines.append(SlurmPipeline(dataset, pipeline))
+    for template in registry.enabled(global_config.run_pipelines):
+        if local:
+            pipelines.append(LocalPipeline(dataset, template))
+        else:
+            pipelines.append(SlurmPipeline(dataset, template))
 
     for pipeline in pipelines:
         if pipeline.run_condition:
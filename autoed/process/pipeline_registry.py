@@ -0,0 +1,246 @@
+""" Compiled processing pipeline definitions, indexed by pipeline name """
+import ast
+import copy
+import re
+import string
+import threading
+
+from autoed.global_config import global_config
+
+# Variables that can be used in the pipeline 'script' template
+SCRIPT_VARIABLES = ('m', 'g', 'imported_file', 'nexus_file', 'refl_file',
+                    'processed_dir', 'unit_cell')
+
+# Variables and functions that can be used in the pipeline 'run_condition'
+CONDITION_VARIABLES = ('m', 'g')
+CONDITION_FUNCTIONS = {'len': len, 'abs': abs, 'min': min, 'max': max,
+                       'any': any, 'all': all}
+
+_ALLOWED_NODES = (ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp,
+                  ast.Not, ast.USub, ast.UAdd, ast.Compare, ast.Eq, ast.NotEq,
+                  ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Is, ast.IsNot, ast.In,
+                  ast.NotIn, ast.Name, ast.Load, ast.Attribute, ast.Constant,
+                  ast.Subscript, ast.Tuple, ast.List, ast.Call, ast.IfExp)
+
+_FIELD_ROOT = re.compile(r'[^.\[]*')
+
+
+class PipelineDefinitionError(ValueError):
+    """Raised when a pipeline in 'defined_pipelines' is not valid"""
+
+
+def compile_condition(condition):
+    """
+    Compile a pipeline run condition (a Python expression) once
+
+    Only a small subset of Python is accepted: boolean operations,
+    comparisons, constants, the variables `m` and `g` (with attribute and
+    item access) and a few builtin functions (e.g. `len`). Anything else
+    (e.g. imports, lambdas or private attributes) is rejected.
+
+    Parameters
+    ----------
+    condition : str
+        The run condition, e.g. '(m.unit_cell is not None)'.
+
+    Returns
+    -------
+    code : code object
+        The compiled condition, to be evaluated by `evaluate_condition`.
+
+    Raises
+    ------
+    PipelineDefinitionError
+        If the condition is not a valid (allowed) expression.
+    """
+
+    try:
+        tree = ast.parse(condition.strip(), mode='eval')
+    except SyntaxError as e:
+        raise PipelineDefinitionError(f"Invalid syntax: {e.msg}") from e
+
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            msg = f"'{type(node).__name__}' is not allowed"
+            raise PipelineDefinitionError(msg)
+        if isinstance(node, ast.Name):
+            allowed = CONDITION_VARIABLES + tuple(CONDITION_FUNCTIONS)
+            if node.id not in allowed:
+                raise PipelineDefinitionError(f"Unknown name '{node.id}'")
+        elif isinstance(node, ast.Attribute) and node.attr.startswith('_'):
+            msg = f"Private attribute '{node.attr}' is not allowed"
+            raise PipelineDefinitionError(msg)
+        elif isinstance(node, ast.Call):
+            if not (isinstance(node.func, ast.Name) and
+                    node.func.id in CONDITION_FUNCTIONS):
+                msg = 'Only the functions '
+                msg += ', '.join(CONDITION_FUNCTIONS) + ' can be called'
+                raise PipelineDefinitionError(msg)
+
+    return compile(tree, '<run_condition>', 'eval')
+
+
+def compile_script(script):
+    """
+    Concatenate the pipeline script lines into a single template string
+
+    Lines are joined with spaces, except lines ending with '%%' which are
+    joined without one. The template fields are checked to use only the
+    known script variables.
+
+    Raises
+    ------
+    PipelineDefinitionError
+        If the template is malformed or uses unknown variables.
+    """
+
+    if isinstance(script, str) or not all(isinstance(line, str)
+                                          for line in script):
+        raise PipelineDefinitionError("'script' must be a list of strings")
+
+    template = ''
+    for line in script:
+        if line[-2:] == '%%':  # Concatenate without space
+            template += line[:-2]
+        else:
+            template += line + " "
+
+    try:
+        fields = [field for _, field, _, _ in
+                  string.Formatter().parse(template) if field is not None]
+    except ValueError as e:
+        raise PipelineDefinitionError(f"Invalid script: {e}") from e
+
+    for field in fields:
+        root = _FIELD_ROOT.match(field).group()
+        if root not in SCRIPT_VARIABLES:
+            msg = f"Unknown script variable '{{{field}}}'"
+            raise PipelineDefinitionError(msg)
+        if '._' in field:
+            msg = f"Private attribute in script variable '{{{field}}}'"
+            raise PipelineDefinitionError(msg)
+
+    return template
+
+
+class PipelineTemplate:
+    """A pipeline definition with its script and run condition compiled"""
+
+    def __init__(self, pipeline_dict):
+
+        for key in ('pipeline_name', 'type', 'run_condition', 'script'):
+            if key not in pipeline_dict:
+                raise PipelineDefinitionError(f"Missing field '{key}'")
+
+        self.info = pipeline_dict
+        self.name = pipeline_dict['pipeline_name']
+        self.type = pipeline_dict['type']
+        self.script = compile_script(pipeline_dict['script'])
+
+        run_condition = pipeline_dict['run_condition']
+        if isinstance(run_condition, bool):
+            self.condition = run_condition
+        elif isinstance(run_condition, str):
+            self.condition = compile_condition(run_condition)
+        else:
+            msg = "'run_condition' must be a boolean or a string"
+            raise PipelineDefinitionError(msg)
+
+    def evaluate_condition(self, m, g):
+        """
+        Evaluate the run condition for a dataset
+
+        Returns
+        -------
+        run : boolean
+            False unless the condition evaluates to True (a boolean).
+        """
+
+        if isinstance(self.condition, bool):
+            return self.condition
+
+        namespace = {'__builtins__': {}, **CONDITION_FUNCTIONS}
+        out = eval(self.condition, namespace, {'m': m, 'g': g})
+        return out if isinstance(out, bool) else False
+
+    def format_script(self, variables_dict):
+        """Fill in the script template with the dataset variables"""
+
+        return self.script.format(**variables_dict)
+
+
+class PipelineRegistry:
+    """
+    All defined pipelines, compiled once and indexed by name
+
+    Parameters
+    ----------
+    defined_pipelines : list of dict
+        The 'defined_pipelines' from the global configuration.
+
+    Raises
+    ------
+    PipelineDefinitionError
+        If any of the pipelines is not valid (the message lists all of them).
+    """
+
+    def __init__(self, defined_pipelines):
+
+        self.pipelines = {}
+        errors = []
+
+        for i, pipeline_dict in enumerate(defined_pipelines):
+            name = pipeline_dict.get('pipeline_name', f"#{i}")
+            try:
+                template = PipelineTemplate(pipeline_dict)
+            except PipelineDefinitionError as e:
+                errors.append(f"Pipeline '{name}': {e}")
+                continue
+            if template.name in self.pipelines:
+                errors.append(f"Pipeline '{name}' is defined more than once")
+                continue
+            self.pipelines[template.name] = template
+
+        if errors:
+            msg = "Invalid pipeline definitions in the configuration:\n"
+            msg += "\n".join(errors)
+            raise PipelineDefinitionError(msg)
+
+    def __contains__(self, name):
+        return name in self.pipelines
+
+    def __getitem__(self, name):
+        return self.pipelines[name]
+
+    def get(self, name, default=None):
+        return self.pipelines.get(name, default)
+
+    def enabled(self, run_pipelines):
+        """Return the defined pipelines switched on in `run_pipelines`"""
+
+        return [self.pipelines[name] for name, run in run_pipelines.items()
+                if run and name in self.pipelines]
+
+
+_registry = None
+_registry_source = None
+_registry_lock = threading.Lock()
+
+
+def get_pipeline_registry():
+    """
+    Return the registry for the current 'defined_pipelines' configuration
+
+    The pipelines are compiled on the first call and again only when the
+    'defined_pipelines' configuration changes.
+    """
+
+    global _registry, _registry_source
+
+    defined_pipelines = global_config.defined_pipelines
+
+    with _registry_lock:
+        if _registry is None or defined_pipelines != _registry_source:
+            _registry = PipelineRegistry(defined_pipelines)
+            _registry_source = copy.deepcopy(defined_pipelines)
+        return _registry
@@ -7,6 +7,7 @@ import json
 import argparse
 from matplotlib.colors import LogNorm
 import subprocess
+from autoed.utility.profiling import profiled
 
 description = """
  ===========================================
@@ -63,6 +64,7 @@ epilog = """
 CUT_OFF_INTENSITY = 80   # Color cut-off intensity
 
 
+@profiled
 def main():
     """ Used as autoed_plot_spots command """
 
@@ -4,9 +4,9 @@ import argparse
 from autoed.dataset import SinglaDataset
 from autoed.utility.filesystem import gather_master_files
 from autoed.global_config import global_config
+from autoed.utility.profiling import profiled
 
-global_config.overwrite_from_local_config()
-
+@profiled
 def main():
 
     msg = 'Script for automatic processing of existing Singla data'
@@ -27,12 +27,32 @@ def main():
         sys.exit(1)
 
 
-def process_dir(dir_name, force=False):
+def process_dir(dir_name, force=False, progress=None, cancelled=None):
     """The function to search a directory recursively,
     convert all unprocessed files to nexgen and process
     them with xia2
+
+    Parameters
+    ----------
+    dir_name : str
+        The directory to process.
+    force : boolean, optional
+        Process datasets even if the nexgen file already exists.
+    progress : callable, optional
+        Called as `progress(basename, status)` when the status of a dataset
+        changes ('pending', 'processing', 'processed', 'failed' or
+        'skipped').
+    cancelled : callable, optional
+        Checked before each dataset. If it returns True, the remaining
+        datasets are not processed.
     """
 
+    global_config.load_local_config()
+
+    def report(basename, status):
+        if progress is not None:
+            progress(basename, status)
+
     dir_path = os.path.abspath(dir_name)
 
     if not os.path.exists(dir_path):
@@ -44,6 +64,12 @@ def process_dir(dir_name, force=False):
     # Search for any master files
     master_files = gather_master_files(dir_path)
     for master_file in master_files:
+        report(master_file[:-10], 'pending')
+
+    for master_file in master_files:
+        if cancelled is not None and cancelled():
+            return
+
         basename = master_file[:-10]
         dataset = SinglaDataset.from_basename(basename)
 
@@ -51,18 +77,18 @@ def process_dir(dir_name, force=False):
 
         if dataset.all_files_present():
 
-            if force:
+            if force or not os.path.exists(dataset.nexgen_file):
                 dataset.set_logger()
                 print('Processing ', dataset.base)
-                dataset.process(global_config)
+                report(basename, 'processing')
+                success = dataset.process(global_config)
+                report(basename, 'processed' if success else 'failed')
             else:
-                if not os.path.exists(dataset.nexgen_file):
-                    dataset.set_logger()
-                    print('Processing ', dataset.base)
-                    dataset.process(global_config)
-                else:
-                    print('Ignoring. Nexgen file exist in ',
-                          dataset.base)
+                print('Ignoring. Nexgen file exist in ',
+                      dataset.base)
+                report(basename, 'skipped')
+        else:
+            report(basename, 'skipped')
 
 
 if __name__ == '__main__':
@@ -4,10 +4,10 @@ import os
 import argparse
 
 from autoed.global_config import global_config
-
-global_config.overwrite_from_local_config()
+from autoed.utility.profiling import profiled
 
 
+@profiled
 def main():
     """Defines autoed_slurm command"""
 
@@ -26,6 +26,8 @@ def run_slurm_job(slurm_file):
 
     slurm_file = os.path.abspath(slurm_file)
     slurm_dir = os.path.dirname(slurm_file)
+
+    global_config.load_local_config()
     user = global_config['slurm_user']
 
     if 'SLURM_JWT' not in os.environ:
@@ -35,8 +37,7 @@ def run_slurm_job(slurm_file):
     cmd += f'curl -s -H X-SLURM-USER-NAME:{user} -H '
     cmd += 'X-SLURM-USER-TOKEN:${SLURM_JWT} '
     cmd += '-H "Content-Type: application/json" '
-    cmd += '-X POST https://slurm-rest.diamond.ac.uk:'
-    cmd += '8443/slurm/v0.0.42/job/submit '
+    cmd += f"-X POST {global_config['slurm_api_url']}/job/submit "
     cmd += '-d@' + slurm_file
 
     p = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE,
@@ -7,8 +7,10 @@ import autoed
 from autoed.report.json_database import JsonDatabase
 from autoed.report.parser import Xia2OutputParser
 from autoed.constants import report_data_dir
+from autoed.utility.profiling import profiled
 
 
+@profiled
 def add_to_database():
     """
     A function that checks if processing finished and adds the result to
@@ -21,6 +23,7 @@ def add_to_database():
     import sys
     from autoed.global_config import global_config
     from autoed.process.multiplex import MultiplexDataset
+    from autoed.events import event_bus, log_events_to_file, PIPELINE_DONE
 
     msg = 'Wait until the trigger file (.done) '
     msg += 'and then add dataset/pipeline to AutoED database.'
@@ -41,6 +44,7 @@ def add_to_database():
 
     args = parser.parse_args()
 
+    global_config.load_local_config()
     args.master_file = os.path.abspath(args.master_file)
 
     dataset = SinglaDataset.from_master_file(args.master_file,
@@ -55,6 +59,12 @@ def add_to_database():
         time.sleep(10)
         if os.path.exists(trigger_file):
             update_database(dataset, args.pipeline_name)
+            # From the end of the pipeline (the trigger file) to the update
+            latency = time.time() - os.path.getmtime(trigger_file)
+            log_events_to_file()
+            event_bus.publish(PIPELINE_DONE, dataset=dataset.base,
+                              pipeline=args.pipeline_name,
+                              database_latency=latency)
 
             cond = args.pipeline_name == global_config['multiplex_pipeline']
             if (args.multiplex and cond):
@@ -62,9 +72,7 @@ def add_to_database():
                                         master_file=args.master_file,
                                         local=args.local)
 
-                success = multiplex_dataset.copy_files()
-                if success and multiplex_dataset.run_condition():
-                    multiplex_dataset.run()
+                multiplex_dataset.submit()
 
             sys.exit()
 
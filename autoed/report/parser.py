@@ -7,6 +7,14 @@ from autoed.report.json_database import JsonDatabase
 from autoed.utility.filesystem import find_files_in_directory
 import re
 import os
+from collections import deque
+
+XIA2_NORMAL_STATUS = 'Status: normal termination'
+XIA2_ERROR_STATUS = 'Error:'
+XIA2_ERROR_NOT_PARSED = 'Error not parsed correctely.'
+DIALS_UNIT_CELL_MARKER = 'Unit cell (with estimated std devs):'
+XDS_UNIT_CELL_MARKER = 'Unit cell:'
+DIALS_REFINED_MARKER = 'Saving refined experiments to'
 
 
 class Xia2OutputParser:
@@ -46,15 +54,17 @@ class Xia2OutputParser:
                                  status='no_data',
                                  tooltip='No xia2 output file')
 
-        if is_xia2_output_ok(xia2_file):
+        summary = scan_xia2_txt_file(xia2_file)
+
+        if summary.normal_termination:
 
-            values = parse_xia2_txt_file(xia2_file)
+            values = summary.values()
             n_tot, n_indexed = parse_xia2_indexed_stats(xia2_file)
 
             if not n_tot:
                 n_tot, n_indexed = parse_xds_indexed_stats(xia2_file)
 
-            if len(values) != 7:
+            if values is None or len(values) != 7:
                 return PipelineEntry(title=pipeline,
                                      status='parse_error',
                                      tooltip='Failed to parse xia2 output')
@@ -77,7 +87,7 @@ class Xia2OutputParser:
                                  tooltip=tooltip)
 
         # Catch with which error it failed
-        error_msg = parse_xia2_error(xia2_file)
+        error_msg = summary.error or XIA2_ERROR_NOT_PARSED
 
         return PipelineEntry(title=pipeline,
                              status='process_error',
@@ -87,52 +97,140 @@ class Xia2OutputParser:
         pass
 
 
-def is_xia2_output_ok(xia2_file):
-    """Checks if xia2 processing completed normally"""
+class Xia2Summary:
+    """
+    Everything the report needs from a xia2.txt file, collected by
+    `scan_xia2_txt_file` in a single read
+
+    Attributes
+    ----------
+    normal_termination : boolean
+        True if xia2 reported 'Status: normal termination'.
+    error : str
+        The first line with 'Error:' (None if there is none).
+    unit_cell_lines : tuple of str
+        The line before the last unit cell marker (the space group), and
+        the two lines after it (cell lengths and angles). None if no unit
+        cell was found.
+    """
+
+    def __init__(self):
+
+        self.normal_termination = False
+        self.error = None
+        self.unit_cell_lines = None
+
+    def values(self):
+        """Unit cell lengths and angles, followed by the space group"""
+
+        if self.unit_cell_lines is None:
+            return None
+
+        space_group_str, vectors_str, angles_str = self.unit_cell_lines
+        vectors = extract_floats(vectors_str.strip())
+        angles = extract_floats(angles_str.strip())
+        space_group = extract_space_group(space_group_str.strip())
+        vectors.extend(angles)
+        vectors.extend([space_group])
+
+        return vectors
+
+
+def scan_xia2_txt_file(xia2_file):
+    """
+    Read a xia2.txt file once and collect the status, error and unit cell
+
+    The file is streamed line by line. For the unit cell only the last
+    occurrence of the marker is kept (with its neighbouring lines), so the
+    memory used does not depend on the size of the file. The unit cell
+    from the DIALS pipelines ('Unit cell (with estimated std devs):') is
+    preferred over the one from the XDS pipeline ('Unit cell:').
+
+    Returns
+    -------
+    summary : Xia2Summary
+    """
+
+    summary = Xia2Summary()
+    # Last marker found: [line before, line after, second line after]
+    last_cell = {DIALS_UNIT_CELL_MARKER: None, XDS_UNIT_CELL_MARKER: None}
+    pending = []    # Unit cells still waiting for the lines after the marker
+    previous = None
 
-    normal_status = "Status: normal termination"
     with open(xia2_file, 'r') as file:
         for line in file:
-            if normal_status in line:
-                return True
-    return False
+
+            for cell in pending:
+                cell.append(line)
+            pending = [cell for cell in pending if len(cell) < 3]
+
+            if not summary.normal_termination and XIA2_NORMAL_STATUS in line:
+                summary.normal_termination = True
+            if summary.error is None and XIA2_ERROR_STATUS in line:
+                summary.error = line
+
+            if DIALS_UNIT_CELL_MARKER in line:
+                marker = DIALS_UNIT_CELL_MARKER
+            elif XDS_UNIT_CELL_MARKER in line:
+                marker = XDS_UNIT_CELL_MARKER
+            else:
+                marker = None
+
+            # A marker in the first line has no space group line before it
+            if marker and previous is not None:
+                cell = [previous]
+                last_cell[marker] = cell
+                pending.append(cell)
+
+            previous = line
+
+    for marker in (DIALS_UNIT_CELL_MARKER, XDS_UNIT_CELL_MARKER):
+        cell = last_cell[marker]
+        if cell is not None:
+            # Missing lines at the end of the file are taken as empty
+            cell += [''] * (3 - len(cell))
+            summary.unit_cell_lines = tuple(cell)
+            break
+
+    return summary
+
+
+def is_xia2_output_ok(xia2_file):
+    """Checks if xia2 processing completed normally"""
+
+    return scan_xia2_txt_file(xia2_file).normal_termination
 
 
 def parse_xia2_error(xia2_file):
     """Get the error line from the xia2 output file"""
 
-    error_status = "Error:"
-    with open(xia2_file, 'r') as file:
-        for line in file:
-            if error_status in line:
-                return line
-    return 'Error not parsed correctely.'
+    error = scan_xia2_txt_file(xia2_file).error
+    return error if error is not None else XIA2_ERROR_NOT_PARSED
 
 
 def parse_dials_indexed_stats(dials_index_file):
     """Returns the total number of spots, and the number of indexed"""
 
+    # The statistics table ends two lines before the first marker. The
+    # file is streamed and only the last lines are kept.
+    recent_lines = deque(maxlen=3)
     with open(dials_index_file, 'r') as file:
-        lines = file.readlines()
-
-    search_str = 'Saving refined experiments to'
-
-    found = False
-    for index, line in enumerate(lines):
-        if search_str in line:
-            found = True
-            break
+        for line in file:
+            if DIALS_REFINED_MARKER in line:
+                break
+            recent_lines.append(line)
+        else:
+            return None
 
-    if not found:
+    if len(recent_lines) < 2:
         return None
-
-    stat_line = lines[index - 2]
+    stat_line = recent_lines[-2]
 
     vals = stat_line.split("|")
     try:
         indexed = int(vals[2])
         unindexed = int(vals[3])
-    except ValueError:
+    except (ValueError, IndexError):
         return None
 
     return indexed + unindexed, indexed
@@ -144,20 +242,67 @@ def parse_xds_indexed_stats(xia2_file):
     output_path = os.path.join(xia2_path, xia2_dials_report_path)
     spots_file = os.path.join(output_path, "SPOT.XDS")
 
-    print("XIS", spots_file)
     if os.path.exists(spots_file):
-        with open(spots_file, "r") as file:
-            lines = file.readlines()
-        ntot = len(lines)
-        unindexed = 0
-        for line in lines:
-            if " 0 0 0" in line:
-                unindexed += 1
-        indexed = ntot - unindexed
-        return ntot, indexed
+        return count_xds_indexed_spots(spots_file)
     return None, None
 
 
+def count_xds_indexed_spots(spots_file):
+    """
+    Count all spots and the indexed spots in a SPOT.XDS file
+
+    Each line of SPOT.XDS holds the spot position and intensity, followed
+    by the Miller indices once the spots were indexed (0 0 0 for spots
+    that were not indexed). Only the Miller index columns are loaded, by
+    the NumPy text reader, and the zero rows are counted on the array.
+
+    Returns
+    -------
+    ntot : int
+        The number of spots.
+    indexed : int
+        The number of spots with non-zero Miller indices.
+    """
+
+    import numpy as np
+
+    with open(spots_file, 'r') as file:
+        first_line = file.readline()
+    n_columns = len(first_line.split())
+    if n_columns == 0:
+        return 0, 0
+    if n_columns < 7:       # Not indexed yet, no Miller indices
+        with open(spots_file, 'rb') as file:
+            ntot = sum(1 for line in file if line.strip())
+        return ntot, ntot
+
+    try:
+        hkl = np.loadtxt(spots_file, usecols=(4, 5, 6), dtype=np.int32,
+                         comments=None, ndmin=2)
+    except ValueError:
+        # Lines with a different number of columns
+        return _count_xds_indexed_spots_by_line(spots_file)
+
+    ntot = len(hkl)
+    unindexed = np.count_nonzero(np.all(hkl == 0, axis=1))
+    return ntot, ntot - int(unindexed)
+
+
+def _count_xds_indexed_spots_by_line(spots_file):
+
+    ntot = 0
+    indexed = 0
+    with open(spots_file, 'r') as file:
+        for line in file:
+            columns = line.split()
+            if not columns:
+                continue
+            ntot += 1
+            if any(float(value) != 0 for value in columns[4:7]):
+                indexed += 1
+    return ntot, indexed
+
+
 def parse_xia2_indexed_stats(xia2_file):
 
     dials_index_file = find_xia2_dials_indexed_log_file(xia2_file)
@@ -224,36 +369,7 @@ def find_xia2_dials_indexed_log_file(xia2_file):
 def parse_xia2_txt_file(xia2_file):
     """Get data on unit cell and space group"""
 
-    with open(xia2_file, 'r') as file:
-        lines = file.readlines()
-
-    match_index = None
-    match_uc_str = 'Unit cell (with estimated std devs):'
-
-    for i, line in enumerate(lines):     # Find the last occurence
-        if match_uc_str in line:
-            match_index = i
-
-    if not match_index:                  # Parse output from xds pipeline
-        match_uc_str_xds = 'Unit cell:'
-        for i, line in enumerate(lines):     # Find the last occurence
-            if match_uc_str_xds in line:
-                match_index = i
-
-    if not match_index:
-        return None
-
-    vectors_str = lines[match_index + 1].strip()
-    angles_str = lines[match_index + 2].strip()
-    space_group_str = lines[match_index - 1].strip()
-
-    vectors = extract_floats(vectors_str)
-    angles = extract_floats(angles_str)
-    space_group = extract_space_group(space_group_str)
-    vectors.extend(angles)
-    vectors.extend([space_group])
-
-    return vectors
+    return scan_xia2_txt_file(xia2_file).values()
 
 
 def extract_space_group(string):
@@ -7,8 +7,10 @@ from autoed.report.misc import generate_report_files
 from autoed.report.txt_report import generate_txt_report
 from autoed.global_config import global_config
 import argparse
+from autoed.utility.profiling import profiled
 
 
+@profiled
 def run():
     """Generates the HTML report"""
     msg = 'Generates an HTML report for the given directory'
@@ -45,6 +47,7 @@ def generate_json_database(path_to_watched_dir, report_path):
     and then parses them into a single json file
     """
 
+    global_config.load_local_config()
     datasets = gather_datasets(path_to_watched_dir)
     report_data_path = os.path.join(report_path, report_data_dir)
     database = JsonDatabase(report_data_path)
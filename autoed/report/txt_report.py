@@ -1,8 +1,10 @@
 import json
 import argparse
 import os
+from autoed.utility.profiling import profiled
 
 
+@profiled
 def main():
 
     msg = 'Generate a txt report file from the JSON database'
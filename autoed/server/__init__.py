@@ -1,9 +1,11 @@
 import argparse
-
-import uvicorn
+from autoed.utility.profiling import profiled
 
 
+@profiled
 def run():
+    import uvicorn
+
     parser = argparse.ArgumentParser(description="Start the AutoED server")
     parser.add_argument(
         "--host",
@@ -1,24 +1,43 @@
+import asyncio
 import atexit
+import json
 import os
+import time
+from threading import Thread
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
-from threading import Thread
+from typing import Optional
 
-from autoed.autoed import AutoedDaemon, kill_process_and_children
+from autoed.autoed import AutoedDaemon
+from autoed.constants import events_file
+from autoed.events import read_events
+from autoed.global_config import global_config
+from autoed.metrics import CONTENT_TYPE, WatcherMetrics, metrics
 from autoed.server.auth import validate_token
-from autoed.process.process_static import process_dir
+from autoed.server.jobs import JobManager, QUEUED, RUNNING, DONE, FAILED, CANCELLED
+from autoed.supervisor import WatcherSupervisor
 
 autoed_daemon = AutoedDaemon()
 with open(autoed_daemon.lock_file, 'w') as f:
     print('Starting autoed daemon')
     f.write("")
 
+# The server owns the watchers (and answers the 'autoed' command line tool)
+supervisor = WatcherSupervisor(
+    autoed_daemon.socket_file, autoed_daemon.dirs_file, allow_shutdown=False
+)
+Thread(name="autoed-supervisor", target=supervisor.serve, daemon=True).start()
+
+global_config.load_local_config()
+job_manager = JobManager(max_workers=global_config.server_max_jobs)
+
 def shutdown():
-    for indir in autoed_daemon.directories:
-        pid = autoed_daemon.pids[indir]
-        kill_process_and_children(int(pid))
+    job_manager.shutdown()
+    supervisor.running = False
+    supervisor.stop_all()
     if os.path.exists(autoed_daemon.lock_file):
         os.remove(autoed_daemon.lock_file)
     if os.path.exists(autoed_daemon.dirs_file):
@@ -39,7 +58,9 @@ class Watcher(BaseModel):
 @router.get("/watchers")
 async def get_watchers() -> list[Watcher]:
     return [
-        {"path": d, "pid": autoed_daemon.pids[d]} for d in autoed_daemon.directories
+        {"path": w["path"], "pid": w["pid"]}
+        for w in supervisor.list()
+        if w["pid"] is not None
     ]
 
 
@@ -49,7 +70,10 @@ class PID(BaseModel):
 
 @router.get("/watchers/{path:path}/pid")
 async def get_watcher_pid(path: str) -> PID:
-    return {"pid": autoed_daemon.pids[f"{path}"]}
+    watcher = supervisor.find(path=path)
+    if watcher is None:
+        raise HTTPException(status_code=404, detail=f"{path} is not watched")
+    return {"pid": watcher.pid}
 
 
 class WatcherSetup(BaseModel):
@@ -62,31 +86,156 @@ class WatcherSetup(BaseModel):
 
 @router.post("/watcher")
 async def start_watcher(watcher_setup: WatcherSetup):
-    autoed_daemon.watch(
-        dirname=watcher_setup.path,
-        use_inotify=watcher_setup.inotify,
-        sleep_time=watcher_setup.sleep_time,
-        log_dir=watcher_setup.log_dir,
-        local=not watcher_setup.slurm,
-    )
+    try:
+        supervisor.watch(
+            watcher_setup.path,
+            use_inotify=watcher_setup.inotify,
+            sleep_time=watcher_setup.sleep_time,
+            log_dir=watcher_setup.log_dir,
+            local=not watcher_setup.slurm,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.delete("/watchers/{pid}")
-async def stop_watcher(pid: str):
-    if pid in autoed_daemon.pids.values():
-        kill_process_and_children(int(pid))
-        for d, _pid in autoed_daemon.pids.items():
-            if _pid == pid:
-                del autoed_daemon.pids[d]
-                autoed_daemon.directories.remove(d)
-                break
+async def stop_watcher(pid: int):
+    try:
+        supervisor.kill(pid=pid)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
 class ProcessSetup(BaseModel):
     path: str
     slurm: bool = True
     force: bool = True
 
+class JobStatus(BaseModel):
+    id: str
+    path: str
+    force: bool
+    status: str
+    error: Optional[str] = None
+    created_time: float
+    start_time: Optional[float] = None
+    end_time: Optional[float] = None
+    n_datasets: int
+    n_finished: int
+    datasets: dict[str, str]
+
+
+class JobSubmitted(JobStatus):
+    created: bool
+
+
 @router.post("/process")
-async def process(process_setup: ProcessSetup):
-    processing_thread = Thread(name=f"proccesor-{process_setup.path}", target=process_dir, kwargs={"dir_name": process_setup.path, "force": process_setup.force})
-    processing_thread.start()
+async def process(process_setup: ProcessSetup) -> JobSubmitted:
+    job, created = job_manager.submit(process_setup.path, force=process_setup.force)
+    return {**job.to_dict(), "created": created}
+
+
+@router.get("/jobs")
+async def get_jobs() -> list[JobStatus]:
+    return [job.to_dict() for job in job_manager.list()]
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str) -> JobStatus:
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job with id {job_id}")
+    return job.to_dict()
+
+
+@router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str) -> JobStatus:
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job with id {job_id}")
+    return job.to_dict()
+
+
+async def event_stream(request: Request, path: Optional[str], poll_interval: float):
+    """Tail the events files of the watched directories as server-sent events"""
+
+    positions = {}
+    last_sent = time.time()
+
+    def events_files():
+        dirs = [path] if path else [w["path"] for w in supervisor.list()]
+        return [os.path.join(os.path.abspath(d), events_file) for d in dirs]
+
+    # Only stream events written after the client connected
+    for filename in events_files():
+        try:
+            positions[filename] = os.path.getsize(filename)
+        except OSError:
+            positions[filename] = 0
+
+    while not await request.is_disconnected():
+        for filename in events_files():
+            events, positions[filename] = read_events(
+                filename, positions.get(filename, 0)
+            )
+            for event in events:
+                last_sent = time.time()
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+        if time.time() - last_sent > 15:
+            last_sent = time.time()
+            yield ": keep-alive\n\n"
+
+        await asyncio.sleep(poll_interval)
+
+
+@router.get("/events")
+async def stream_events(
+    request: Request, path: Optional[str] = None, poll_interval: float = 0.5
+):
+    """Push processing events (dataset detected, converted, pipeline done...)"""
+    return StreamingResponse(
+        event_stream(request, path, max(poll_interval, 0.1)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+watcher_metrics = WatcherMetrics(metrics)
+watchers_gauge = metrics.gauge(
+    "autoed_watchers", "Watchers run by the server", ("status",)
+)
+restarts_gauge = metrics.gauge(
+    "autoed_watcher_restarts", "Restarts of a watcher", ("watcher",)
+)
+jobs_gauge = metrics.gauge(
+    "autoed_server_jobs", "Processing jobs known to the server", ("status",)
+)
+
+
+def collect_server_metrics():
+    watchers = supervisor.list()
+    watcher_metrics.update([w["path"] for w in watchers])
+
+    watchers_gauge.clear()
+    for status in ("running", "restarting", "stopped"):
+        watchers_gauge.set(
+            sum(w["status"] == status for w in watchers), status=status
+        )
+    restarts_gauge.clear()
+    for w in watchers:
+        restarts_gauge.set(w["restarts"], watcher=w["path"])
+
+    jobs = job_manager.list()
+    jobs_gauge.clear()
+    for status in (QUEUED, RUNNING, DONE, FAILED, CANCELLED):
+        jobs_gauge.set(sum(j.status == status for j in jobs), status=status)
+
+
+metrics.add_collector(collect_server_metrics)
+
+
+# Not async: reading the events files would block the event loop
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Metrics of the server and its watchers in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
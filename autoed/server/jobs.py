@@ -0,0 +1,181 @@
+"""Background processing jobs started through the server API"""
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from autoed.process.process_static import process_dir
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+
+class Job:
+    """A request to (re)process all datasets in a directory"""
+
+    def __init__(self, path, force=True):
+
+        self.id = uuid.uuid4().hex
+        self.path = path
+        self.force = force
+        self.status = QUEUED
+        self.error = None
+        self.created_time = time.time()
+        self.start_time = None
+        self.end_time = None
+        self.datasets = OrderedDict()  # Dataset basename -> status
+        self.cancel_event = threading.Event()
+
+    @property
+    def active(self):
+        return self.status in ACTIVE_STATES
+
+    def update_dataset(self, basename, status):
+        """Progress callback passed to `process_dir`"""
+        self.datasets[basename] = status
+
+    def to_dict(self):
+        """Job status (e.g. for the JSON response)"""
+
+        datasets = dict(self.datasets)
+        finished = ("processed", "failed", "skipped")
+        return {
+            "id": self.id,
+            "path": self.path,
+            "force": self.force,
+            "status": self.status,
+            "error": self.error,
+            "created_time": self.created_time,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "n_datasets": len(datasets),
+            "n_finished": sum(s in finished for s in datasets.values()),
+            "datasets": datasets,
+        }
+
+
+class JobManager:
+    """
+    Runs processing jobs in a bounded pool of worker threads
+
+    Parameters
+    ----------
+    max_workers : int
+        Maximal number of jobs processed at the same time. Other jobs wait
+        in the queue.
+    max_finished : int
+        Number of finished jobs to keep (the oldest are forgotten).
+    """
+
+    def __init__(self, max_workers=2, max_finished=100):
+
+        self.max_finished = max_finished
+        self.jobs = OrderedDict()  # Job id -> Job
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="autoed-job"
+        )
+
+    def submit(self, path, force=True):
+        """
+        Queue a job to process a directory
+
+        If a job for the same directory is already queued or running, no new
+        job is created.
+
+        Returns
+        -------
+        job : Job
+            The new job, or the active job for the same directory.
+        created : boolean
+            False if an existing job was returned.
+        """
+
+        path = os.path.abspath(path)
+
+        with self.lock:
+            for job in self.jobs.values():
+                if job.path == path and job.active:
+                    return job, False
+
+            job = Job(path, force)
+            self.jobs[job.id] = job
+            self._forget_finished()
+
+        self.executor.submit(self._run, job)
+        return job, True
+
+    def get(self, job_id):
+        """Return the job with the given id (None if unknown)"""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        """Return all known jobs, the oldest first"""
+        with self.lock:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id):
+        """
+        Cancel a job
+
+        A queued job will not start. A running job stops before processing
+        the next dataset (the current dataset is finished).
+
+        Returns
+        -------
+        job : Job
+            The job, or None if there is no job with this id.
+        """
+
+        job = self.get(job_id)
+        if job is not None and job.active:
+            job.cancel_event.set()
+        return job
+
+    def shutdown(self):
+        """Cancel all jobs and stop the workers"""
+
+        with self.lock:
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            job.cancel_event.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job):
+
+        if job.cancel_event.is_set():
+            job.status = CANCELLED
+            job.end_time = time.time()
+            return
+
+        job.status = RUNNING
+        job.start_time = time.time()
+        try:
+            process_dir(
+                job.path,
+                force=job.force,
+                progress=job.update_dataset,
+                cancelled=job.cancel_event.is_set,
+            )
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}\n{traceback.format_exc()}"
+            job.status = FAILED
+        else:
+            job.status = CANCELLED if job.cancel_event.is_set() else DONE
+        job.end_time = time.time()
+
+    def _forget_finished(self):
+        """Keep at most `max_finished` finished jobs (lock must be held)"""
+
+        finished = [job_id for job_id, job in self.jobs.items() if not job.active]
+        for job_id in finished[: max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job_id]
@@ -0,0 +1,522 @@
+"""A supervisor that owns the AutoED watcher processes"""
+import json
+import logging
+import os
+import socket
+import subprocess
+import threading
+import time
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+MAX_REQUEST_SIZE = 64 * 1024
+WATCH_COMMAND = 'autoed_watch'
+
+
+class _AdoptedProcess:
+    """
+    A watcher left running by a previous supervisor (e.g. after a crash)
+
+    It is not a child of this process, so its exit code is unknown (-1).
+    """
+
+    def __init__(self, process):
+        self.process = process
+        self.pid = process.pid
+        self.returncode = None
+
+    def poll(self):
+
+        if self.returncode is None:
+            try:
+                running = (self.process.is_running() and
+                           self.process.status() != psutil.STATUS_ZOMBIE)
+            except psutil.NoSuchProcess:
+                running = False
+            if not running:
+                self.returncode = -1
+        return self.returncode
+
+
+class WatcherProcess:
+    """An autoed_watch process started (and restarted) by the supervisor"""
+
+    def __init__(self, path, use_inotify=False, sleep_time=None,
+                 log_dir=None, dummy=False, local=False, test=False):
+
+        self.path = path
+        self.use_inotify = use_inotify
+        self.sleep_time = sleep_time
+        self.log_dir = os.path.abspath(log_dir) if log_dir else None
+        self.dummy = dummy
+        self.local = local
+        self.test = test
+
+        self.process = None
+        self.start_time = None
+        self.restarts = 0          # Restarts since the watcher was stable
+        self.restart_time = None   # When to restart a crashed watcher
+        self.exit_code = None
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else None
+
+    @classmethod
+    def from_command(cls, command):
+        """
+        The watcher started with `command` (see `command`)
+
+        Returns None if `command` is not an autoed_watch command.
+        """
+
+        names = [os.path.basename(arg) for arg in command[:2]]
+        if WATCH_COMMAND not in names or len(command) < 2:
+            return None
+        args = command[names.index(WATCH_COMMAND) + 1:]
+
+        options = {'use_inotify': '-i' in args, 'local': '--local' in args,
+                   'dummy': '--dummy' in args, 'test': '--test' in args}
+        try:
+            if '-t' in args:
+                options['sleep_time'] = float(args[args.index('-t') + 1])
+            if '--log-dir' in args:
+                options['log_dir'] = args[args.index('--log-dir') + 1]
+        except (IndexError, ValueError):
+            return None
+        return cls(args[-1], **options)
+
+    def adopt(self, process):
+        """Look after a running watcher process (a psutil.Process)"""
+
+        self.process = _AdoptedProcess(process)
+        self.start_time = process.create_time()
+        self.restart_time = None
+        self.exit_code = None
+
+    def command(self):
+        """The autoed_watch command (a list of arguments, no shell)"""
+
+        command = [WATCH_COMMAND]
+        if self.use_inotify:
+            command.append('-i')
+        if self.sleep_time:
+            command += ['-t', '%.1f' % self.sleep_time]
+        if self.local:
+            command.append('--local')
+        if self.dummy:
+            command.append('--dummy')
+        if self.test:
+            command.append('--test')
+        if self.log_dir:
+            command += ['--log-dir', self.log_dir]
+        command.append(self.path)
+        return command
+
+    def start(self):
+        self.process = subprocess.Popen(self.command(),
+                                        stdin=subprocess.DEVNULL,
+                                        start_new_session=True)
+        self.start_time = time.time()
+        self.restart_time = None
+        self.exit_code = None
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self):
+        if self.is_running():
+            kill_process_and_children(self.process.pid)
+        if self.process is not None:
+            self.process.poll()    # Reap the process
+
+    def to_dict(self):
+
+        if self.is_running():
+            status = 'running'
+        elif self.restart_time is not None:
+            status = 'restarting'
+        else:
+            status = 'stopped'
+
+        return {'path': self.path, 'pid': self.pid, 'status': status,
+                'restarts': self.restarts, 'start_time': self.start_time,
+                'exit_code': self.exit_code}
+
+
+class WatcherSupervisor:
+    """
+    Owns the watcher processes, restarts them when they crash and answers
+    requests (watch, list, kill, restart, shutdown) over a local socket
+
+    Parameters
+    ----------
+    socket_file : str, optional
+        The Unix socket to listen on. Without it, the supervisor is only
+        used through its methods.
+    dirs_file : str, optional
+        A file updated with 'PID PATH' lines of the running watchers.
+    min_delay, max_delay : float
+        A crashed watcher is restarted after `min_delay` seconds. The delay
+        doubles after each crash, up to `max_delay`.
+    stable_time : float
+        A watcher that ran at least `stable_time` seconds before crashing is
+        restarted after `min_delay` again.
+    allow_shutdown : boolean
+        Whether the 'shutdown' request (stop all watchers and stop serving)
+        is accepted. The AutoED server refuses it, as it owns the
+        supervisor and has to be stopped itself.
+    """
+
+    def __init__(self, socket_file=None, dirs_file=None, min_delay=1.,
+                 max_delay=300., stable_time=600., allow_shutdown=True):
+
+        self.socket_file = socket_file
+        self.dirs_file = dirs_file
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.stable_time = stable_time
+        self.allow_shutdown = allow_shutdown
+
+        self.watchers = {}   # Path -> WatcherProcess
+        self.lock = threading.RLock()
+        self.running = False
+
+    # -- Watcher management -------------------------------------------------
+
+    def watch(self, dirname, **options):
+        """
+        Start watching a directory
+
+        Raises
+        ------
+        ValueError
+            If the directory does not exist or is already watched (directly,
+            through a parent directory, or through its subdirectories).
+        """
+
+        path = os.path.abspath(dirname)
+
+        with self.lock:
+            if not os.path.exists(path):
+                raise ValueError(f"No path found: {path}")
+            if path in self.watchers:
+                raise ValueError(f"Directory {path} already watched.")
+            for watched in self.watchers:
+                if path.startswith(watched + os.sep):
+                    msg = f"Can not watch {path}. "
+                    msg += "Already watching its parent directory."
+                    raise ValueError(msg)
+                if watched.startswith(path + os.sep):
+                    msg = f"Can not watch {path}. "
+                    msg += "Already watching its subdirectories."
+                    raise ValueError(msg)
+
+            watcher = WatcherProcess(path, **options)
+            try:
+                watcher.start()
+            except OSError as e:
+                raise ValueError(f"Could not start the watcher: {e}") from e
+            self.watchers[path] = watcher
+            self._save_dirs()
+
+        logger.info(f"Watching {path} (PID {watcher.pid})")
+        return watcher
+
+    def find(self, pid=None, path=None):
+        """Return the watcher with the given PID or path (or None)"""
+
+        with self.lock:
+            if path is not None:
+                return self.watchers.get(os.path.abspath(path))
+            for watcher in self.watchers.values():
+                if watcher.pid == pid:
+                    return watcher
+        return None
+
+    def kill(self, pid=None, path=None):
+        """
+        Stop a watcher and forget it
+
+        Raises
+        ------
+        ValueError
+            If no watcher has this PID (or path).
+        """
+
+        with self.lock:
+            watcher = self.find(pid=pid, path=path)
+            if watcher is None:
+                raise ValueError('The provided PID is not being watched.')
+            del self.watchers[watcher.path]
+            self._save_dirs()
+
+        watcher.stop()
+        logger.info(f"Stopped watching {watcher.path} (PID {watcher.pid})")
+        return watcher
+
+    def restart(self):
+        """Restart all watchers"""
+
+        # Under the lock, so check_watchers does not start them meanwhile
+        with self.lock:
+            watchers = list(self.watchers.values())
+            for watcher in watchers:
+                watcher.stop()
+                watcher.start()
+                watcher.restarts = 0
+            self._save_dirs()
+        return watchers
+
+    def stop_all(self):
+        """Stop all watchers"""
+
+        with self.lock:
+            watchers = list(self.watchers.values())
+            self.watchers.clear()
+            self._save_dirs()
+        for watcher in watchers:
+            watcher.stop()
+
+    def list(self):
+        with self.lock:
+            return [watcher.to_dict() for watcher in self.watchers.values()]
+
+    def check_watchers(self, now=None):
+        """Restart crashed watchers (with back-off)"""
+
+        now = time.time() if now is None else now
+
+        with self.lock:
+            changed = False
+            for watcher in self.watchers.values():
+                if watcher.is_running():
+                    continue
+
+                if watcher.restart_time is None:
+                    # The watcher has just exited
+                    watcher.exit_code = watcher.process.returncode
+                    if now - watcher.start_time >= self.stable_time:
+                        watcher.restarts = 0
+                    delay = min(self.min_delay * 2**watcher.restarts,
+                                self.max_delay)
+                    watcher.restart_time = now + delay
+                    msg = f"Watcher for {watcher.path} exited with code "
+                    msg += f"{watcher.exit_code}. Restarting in {delay:.0f} s."
+                    logger.warning(msg)
+
+                elif now >= watcher.restart_time:
+                    watcher.restarts += 1
+                    watcher.start()
+                    changed = True
+                    msg = f"Restarted watcher for {watcher.path} "
+                    msg += f"(PID {watcher.pid})"
+                    logger.info(msg)
+
+            if changed:
+                self._save_dirs()
+
+    def adopt_watchers(self):
+        """
+        Look after the watchers listed in `dirs_file` that still run
+
+        The watchers run in their own sessions, so they survive a crash or
+        a restart of the supervisor. Without this, they would be unknown to
+        the new supervisor, and watching their directories again would start
+        duplicates.
+
+        Returns
+        -------
+        adopted : list of WatcherProcess
+        """
+
+        if not self.dirs_file or not os.path.exists(self.dirs_file):
+            return []
+
+        with open(self.dirs_file) as f:
+            lines = f.read().splitlines()
+
+        adopted = []
+        with self.lock:
+            for line in lines:
+                pid, _, path = line.strip().partition(' ')
+                if not pid.isdigit() or path in self.watchers:
+                    continue
+                try:
+                    process = psutil.Process(int(pid))
+                    watcher = WatcherProcess.from_command(process.cmdline())
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    watcher = None
+                # The PID may have been reused by another process
+                if watcher is None or watcher.path != path:
+                    msg = f"Watcher for {path} (PID {pid}) is not running"
+                    logger.warning(msg)
+                    continue
+                watcher.adopt(process)
+                self.watchers[path] = watcher
+                adopted.append(watcher)
+                logger.info(f"Adopted watcher for {path} (PID {pid})")
+            self._save_dirs()
+        return adopted
+
+    def _save_dirs(self):
+
+        if not self.dirs_file:
+            return
+        with open(self.dirs_file, 'w') as f:
+            for watcher in self.watchers.values():
+                f.write(f"{watcher.pid} {watcher.path}\n")
+
+    # -- Requests over the local socket -------------------------------------
+
+    def handle_request(self, request):
+        """Run a request (a dict) and return the response (a dict)"""
+
+        command = request.get('command')
+        try:
+            if command == 'ping':
+                return {'ok': True}
+            if command == 'list':
+                return {'ok': True, 'watchers': self.list()}
+            if command == 'watch':
+                options = request.get('options', {})
+                watcher = self.watch(request['path'], **options)
+                return {'ok': True, 'watcher': watcher.to_dict()}
+            if command == 'kill':
+                watcher = self.kill(pid=request.get('pid'),
+                                    path=request.get('path'))
+                return {'ok': True, 'watcher': watcher.to_dict()}
+            if command == 'restart':
+                watchers = self.restart()
+                return {'ok': True,
+                        'watchers': [w.to_dict() for w in watchers]}
+            if command == 'shutdown':
+                if not self.allow_shutdown:
+                    msg = 'The watchers belong to the AutoED server. '
+                    msg += 'Stop the server to stop them.'
+                    return {'ok': False, 'error': msg}
+                self.stop_all()
+                self.running = False
+                return {'ok': True}
+        except (ValueError, KeyError, TypeError) as e:
+            return {'ok': False, 'error': str(e)}
+        return {'ok': False, 'error': f"Unknown command: {command}"}
+
+    def serve(self, poll_interval=1.):
+        """
+        Answer requests and look after the watchers until shut down
+
+        If another supervisor already answers on the socket, only the
+        watchers are looked after.
+        """
+
+        server = self._bind() if self.socket_file else None
+        if server is not None or not self.socket_file:
+            # Otherwise, the watchers belong to the supervisor answering
+            self.adopt_watchers()
+        self.running = True
+        try:
+            while self.running:
+                if server is not None:
+                    server.settimeout(poll_interval)
+                    try:
+                        connection, _ = server.accept()
+                    except socket.timeout:
+                        connection = None
+                    if connection is not None:
+                        with connection:
+                            self._answer(connection)
+                else:
+                    time.sleep(poll_interval)
+                self.check_watchers()
+        finally:
+            if server is not None:
+                server.close()
+                if os.path.exists(self.socket_file):
+                    os.remove(self.socket_file)
+
+    def _bind(self):
+
+        if os.path.exists(self.socket_file):
+            try:
+                send_command(self.socket_file, 'ping', timeout=2)
+            except ConnectionError:
+                os.remove(self.socket_file)    # Left over from a crash
+            else:
+                msg = f"Another supervisor is listening on {self.socket_file}"
+                logger.warning(msg)
+                return None
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            server.bind(self.socket_file)
+        finally:
+            os.umask(old_umask)
+        server.listen()
+        return server
+
+    def _answer(self, connection):
+
+        connection.settimeout(10)
+        try:
+            request = json.loads(_receive_line(connection))
+            response = self.handle_request(request)
+        except (OSError, ValueError) as e:
+            response = {'ok': False, 'error': f"Invalid request: {e}"}
+        try:
+            connection.sendall(json.dumps(response).encode() + b'\n')
+        except OSError:
+            pass
+
+
+def _receive_line(connection):
+
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = connection.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+        if len(data) > MAX_REQUEST_SIZE:
+            raise ValueError('Request too large')
+    return data.decode()
+
+
+def send_command(socket_file, command, timeout=10, **kwargs):
+    """
+    Send a request to the supervisor and return its response
+
+    Raises
+    ------
+    ConnectionError
+        If no supervisor answers on the socket.
+    """
+
+    request = dict(kwargs, command=command)
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(socket_file)
+            client.sendall(json.dumps(request).encode() + b'\n')
+            return json.loads(_receive_line(client))
+    except (OSError, ValueError) as e:
+        msg = f"No AutoED supervisor answering on {socket_file}: {e}"
+        raise ConnectionError(msg) from e
+
+
+def kill_process_and_children(pid):
+    try:
+        parent = psutil.Process(pid)
+        children = parent.children(recursive=True)
+        for child in children:
+            child.terminate()
+        psutil.wait_procs(children, timeout=5)
+        parent.terminate()
+        parent.wait(5)
+    except psutil.NoSuchProcess:
+        pass
+    except psutil.TimeoutExpired:
+        pass
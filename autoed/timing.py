@@ -0,0 +1,222 @@
+"""Timing of the dataset processing stages (spans)"""
+import contextvars
+import functools
+import os
+import threading
+import time
+
+from autoed.events import EventFileWriter
+
+# The innermost open span in the current thread (nested spans inherit its
+# fields, e.g. the dataset name)
+_current_span = contextvars.ContextVar('autoed_span', default=None)
+
+
+@functools.lru_cache(maxsize=None)
+def _process(pid):
+
+    import psutil
+    return psutil.Process(pid)
+
+
+def _bytes_read():
+    """Bytes read by this process so far (None if not available)"""
+
+    try:
+        counters = _process(os.getpid()).io_counters()
+    except (ImportError, AttributeError, OSError):
+        return None
+    return getattr(counters, 'read_chars', counters.read_bytes)
+
+
+class StageStats:
+    """Aggregated durations of one stage"""
+
+    __slots__ = ('count', 'errors', 'total', 'max', 'bytes_read')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.
+        self.max = 0.
+        self.bytes_read = 0
+
+    def add(self, record):
+        self.count += 1
+        self.errors += record['status'] != 'ok'
+        self.total += record['duration']
+        self.max = max(self.max, record['duration'])
+        self.bytes_read += record.get('bytes_read') or 0
+
+    def to_dict(self):
+        mean = self.total / self.count if self.count else 0.
+        return {'count': self.count, 'errors': self.errors,
+                'total': self.total, 'mean': mean, 'max': self.max,
+                'bytes_read': self.bytes_read}
+
+
+class TimingRecorder:
+    """
+    Collects the records of finished spans
+
+    Every record is passed to the subscribed callbacks (e.g. an
+    `EventFileWriter` writing JSON lines) and added to per-stage statistics.
+    """
+
+    def __init__(self):
+        self.subscribers = []
+        self.stats = {}     # Stage -> StageStats
+        self.lock = threading.Lock()
+
+    def subscribe(self, callback):
+        with self.lock:
+            if callback not in self.subscribers:
+                self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def record(self, record):
+
+        with self.lock:
+            self.stats.setdefault(record['stage'], StageStats()).add(record)
+            subscribers = list(self.subscribers)
+
+        # Timing must never stop the processing
+        for callback in subscribers:
+            try:
+                callback(record)
+            except Exception:
+                pass
+
+    def summary(self):
+        """Per-stage statistics, as a dict: stage -> dict"""
+
+        with self.lock:
+            return {stage: stats.to_dict()
+                    for stage, stats in self.stats.items()}
+
+    def format_summary(self):
+        """The statistics as a table (for the log file)"""
+
+        summary = self.summary()
+        if not summary:
+            return ''
+
+        msg = f"{'stage':<16} {'count':>6} {'errors':>6} {'total [s]':>10} "
+        msg += f"{'mean [s]':>9} {'max [s]':>9} {'read [MB]':>10}"
+        for stage, s in sorted(summary.items(),
+                               key=lambda item: -item[1]['total']):
+            msg += f"\n{stage:<16} {s['count']:>6} {s['errors']:>6} "
+            msg += f"{s['total']:>10.2f} {s['mean']:>9.2f} {s['max']:>9.2f} "
+            msg += f"{s['bytes_read'] / 1024**2:>10.1f}"
+        return msg
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+
+class Span:
+    """
+    Times a block of code, as a context manager
+
+    When the block ends, a record is passed to the recorder::
+
+        {'stage': ..., 'start': ..., 'duration': ..., 'bytes_read': ...,
+         'status': 'ok' or 'error', 'pid': ..., **fields}
+
+    where the fields are those given to the span and to the spans around it
+    (e.g. the dataset). The bytes read are counted for the whole process
+    (other threads included, subprocesses excluded). The durations of the
+    spans nested directly in this one are kept in `children`.
+    """
+
+    def __init__(self, stage, recorder=None, **fields):
+        self.stage = stage
+        self.recorder = recorder
+        self.fields = fields
+        self.children = {}      # Stage -> duration of direct child spans
+        self.duration = None
+        self._parent = None
+        self._token = None
+
+    def __enter__(self):
+
+        self._parent = _current_span.get()
+        if self._parent is not None:
+            self.fields = {**self._parent.fields, **self.fields}
+        self._token = _current_span.set(self)
+        self._start = time.time()
+        self._start_counter = time.perf_counter()
+        self._start_bytes = _bytes_read()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+
+        self.duration = time.perf_counter() - self._start_counter
+        _current_span.reset(self._token)
+
+        end_bytes = _bytes_read()
+        bytes_read = None
+        if self._start_bytes is not None and end_bytes is not None:
+            bytes_read = end_bytes - self._start_bytes
+
+        if self._parent is not None:
+            children = self._parent.children
+            children[self.stage] = children.get(self.stage, 0.) + \
+                self.duration
+
+        record = {'stage': self.stage, 'start': self._start,
+                  'duration': self.duration, 'bytes_read': bytes_read,
+                  'status': 'ok' if exc_type is None else 'error',
+                  'pid': os.getpid()}
+        record.update(self.fields)
+        (self.recorder or timings).record(record)
+        return False
+
+    def format_children(self):
+        """Durations of the nested stages, e.g. 'nexgen 1.20 s, ...'"""
+
+        return ', '.join(f"{stage} {duration:.2f} s"
+                         for stage, duration in self.children.items())
+
+
+def span(stage, **fields):
+    """Time a block of code (see `Span`)"""
+    return Span(stage, **fields)
+
+
+def timed(stage):
+    """Decorator timing every call of a function as a span"""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with Span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def log_timings_to_file(filename):
+    """Append all span records of this process to a JSON lines file"""
+
+    global _file_writer
+
+    with _writer_lock:
+        if _file_writer is not None:
+            if _file_writer.filename == filename:
+                return
+            timings.unsubscribe(_file_writer)
+        _file_writer = EventFileWriter(filename)
+        timings.subscribe(_file_writer)
+
+
+_file_writer = None
+_writer_lock = threading.Lock()
+
+# A Singleton object collecting the span records of a process
+timings = TimingRecorder()
@@ -0,0 +1,248 @@
+"""Dataset loggers that share a bounded number of open log files"""
+import atexit
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = '%(asctime)s.%(msecs)03d %(levelname)s - %(message)s'
+LOG_DATE_FORMAT = '%d-%m-%Y %H:%M:%S'
+
+
+class _PooledFileHandler(logging.FileHandler):
+    """A file handler whose file is opened only while it is in the pool"""
+
+    def __init__(self, filename, pool):
+        super().__init__(filename, mode='a', delay=True)
+        self.pool = pool
+        self.setFormatter(logging.Formatter(LOG_FORMAT,
+                                            datefmt=LOG_DATE_FORMAT))
+        self.setLevel(logging.DEBUG)
+
+    def handle(self, record):
+        # Before taking the handler lock, as other files may be closed
+        self.pool.touch(self)
+        return super().handle(record)
+
+    def close_file(self):
+        """Close the file (it is opened again by the next record)"""
+
+        self.acquire()
+        try:
+            if self.stream is not None:
+                self.flush()
+                self.stream.close()
+                self.stream = None
+        finally:
+            self.release()
+
+
+class _DatasetQueueHandler(QueueHandler):
+    """Passes the records of a dataset logger to the pool's listener"""
+
+    def __init__(self, pool, file_handler):
+        super().__init__(pool.queue)
+        self.pool = pool
+        self.file_handler = file_handler
+
+    def enqueue(self, record):
+        record.autoed_handler = self.file_handler
+        if self.pool.listening:
+            self.queue.put_nowait(record)
+        else:
+            # E.g. records logged at exit, after the listener stopped
+            self.file_handler.handle(record)
+
+
+class _RecordRouter:
+    """Writes records from the queue with the handler they were queued for"""
+
+    def handle(self, record):
+        record.autoed_handler.handle(record)
+
+
+class DatasetLoggerPool:
+    """
+    Loggers for the datasets (one log file per dataset)
+
+    Every dataset logger has a single file handler, however often its
+    logger is set up. At most `max_open` log files are open at the same
+    time: when another file is written, the least recently used file is
+    closed (and opened again when its dataset logs something). With
+    `use_queue`, records are put on a queue and written to the files by a
+    listener thread, so the processing threads do not wait for file I/O.
+
+    The loggers are not registered with the logging module (which would
+    keep them forever): a released logger is forgotten. Work that logs
+    after the dataset is done with (e.g. a deferred figure) holds the
+    logger (`hold`, `drop`), so it is only released afterwards.
+
+    Parameters
+    ----------
+    max_open : int
+        Maximum number of open log files.
+    use_queue : boolean
+        Write the log files in a background thread.
+    """
+
+    def __init__(self, max_open=64, use_queue=True):
+
+        self.max_open = max_open
+        self.use_queue = use_queue
+        self.open_handlers = OrderedDict()   # Handler -> None, LRU first
+        self.handlers = {}                   # Logger name -> file handler
+        self.loggers = {}                    # Logger name -> logger
+        self.holds = {}                      # Logger name -> hold count
+        self.pending_release = set()         # Released while held
+        self.lock = threading.RLock()
+        self.queue = queue.Queue()
+        self.listener = None
+
+    @property
+    def listening(self):
+        return self.listener is not None
+
+    def get_logger(self, name, log_file):
+        """
+        Return the logger `name`, writing to `log_file`
+
+        Calling this again for the same logger does not add handlers. If the
+        log file changed, the old file handler is replaced.
+        """
+
+        with self.lock:
+            file_handler = self.handlers.get(name)
+            self.pending_release.discard(name)
+        if file_handler is not None:
+            if file_handler.baseFilename == os.path.abspath(log_file):
+                return self.loggers[name]
+            self._release(name)
+
+        with self.lock:
+            if name in self.handlers:     # Set up by another thread
+                return self.loggers[name]
+            logger = self._new_logger(name)
+            file_handler = _PooledFileHandler(log_file, self)
+            self.handlers[name] = file_handler
+            if self.use_queue:
+                self._start_listener()
+                handler = _DatasetQueueHandler(self, file_handler)
+            else:
+                handler = file_handler
+            logger.addHandler(handler)
+            self.loggers[name] = logger
+
+        return logger
+
+    @staticmethod
+    def _new_logger(name):
+
+        # Like logging.getLogger, without keeping the logger in the manager
+        logger = logging.Logger(name, logging.DEBUG)
+        logger.parent = logging.root
+        return logger
+
+    def hold(self, name):
+        """
+        Keep the logger `name` until `drop` is called (even if released)
+
+        Returns
+        -------
+        held : boolean
+            False if the pool has no such logger (nothing to drop).
+        """
+
+        with self.lock:
+            if name not in self.handlers:
+                return False
+            self.holds[name] = self.holds.get(name, 0) + 1
+            return True
+
+    def drop(self, name):
+        """End a `hold`, releasing the logger if it was released meanwhile"""
+
+        with self.lock:
+            count = self.holds.get(name, 0) - 1
+            if count > 0:
+                self.holds[name] = count
+                return
+            self.holds.pop(name, None)
+            if name not in self.pending_release:
+                return
+            self.pending_release.discard(name)
+        self._release(name)
+
+    def release(self, name):
+        """
+        Remove the handlers of a logger and close its log file
+
+        A held logger is released when its last hold is dropped.
+        """
+
+        with self.lock:
+            if self.holds.get(name):
+                self.pending_release.add(name)
+                return
+        self._release(name)
+
+    def _release(self, name):
+
+        with self.lock:
+            file_handler = self.handlers.pop(name, None)
+            logger = self.loggers.pop(name, None)
+            if file_handler is None:
+                return
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+
+        self.flush()
+        with self.lock:
+            self.open_handlers.pop(file_handler, None)
+        file_handler.close()
+
+    def touch(self, file_handler):
+        """Mark a log file as used, closing the least recently used ones"""
+
+        idle = []
+        with self.lock:
+            self.open_handlers[file_handler] = None
+            self.open_handlers.move_to_end(file_handler)
+            while len(self.open_handlers) > max(1, self.max_open):
+                idle.append(self.open_handlers.popitem(last=False)[0])
+        for handler in idle:
+            handler.close_file()
+
+    def open_files(self):
+        """Number of log files open at the moment"""
+
+        with self.lock:
+            return sum(handler.stream is not None
+                       for handler in self.open_handlers)
+
+    def flush(self):
+        """Wait until all queued records are written"""
+
+        if self.listening:
+            self.queue.join()
+
+    def stop(self):
+        """Write the queued records and stop the listener thread"""
+
+        with self.lock:
+            listener = self.listener
+            self.listener = None
+        if listener is not None:
+            listener.stop()
+
+    def _start_listener(self):
+
+        if self.listener is None:
+            self.listener = QueueListener(self.queue, _RecordRouter())
+            self.listener.start()
+            atexit.register(self.stop)
+
+
+# A Singleton object shared by all datasets in a process
+dataset_loggers = DatasetLoggerPool()
@@ -0,0 +1,89 @@
+"""Process-wide access to the Singla detector pixel mask"""
+from collections import namedtuple
+from functools import lru_cache
+import hashlib
+import os
+
+import numpy as np
+
+import autoed
+
+SINGLA_MASK_FILE = 'data/singla_mask.npz'
+
+SinglaMask = namedtuple(
+    'SinglaMask',
+    ['mask',             # The original (integer) pixel mask
+     'bool_mask',        # True for every masked pixel
+     'flat_indices',     # Indices of masked pixels in the flattened image
+     'checksum'          # SHA-1 of the mask values (independent of dtype)
+     ])
+
+
+@lru_cache(maxsize=None)
+def get_singla_mask():
+    """
+    Load the Singla pixel mask once per process and return it.
+
+    The mask file is decompressed only on the first call. All later calls
+    return the same object. The arrays are read-only, so consumers that
+    need to modify the mask must make their own copy.
+
+    Returns
+    -------
+    singla_mask : SinglaMask
+        The integer mask, its boolean form, the flat indices of all masked
+        pixels and a checksum of the mask values.
+    """
+
+    mask_path = os.path.join(autoed.__path__[0], SINGLA_MASK_FILE)
+    with np.load(mask_path) as mask_data:
+        mask = mask_data['mask']
+
+    bool_mask = mask > 0
+    flat_indices = np.flatnonzero(bool_mask)
+    checksum = mask_checksum(mask)
+
+    for array in (mask, bool_mask, flat_indices):
+        array.setflags(write=False)
+
+    return SinglaMask(mask=mask, bool_mask=bool_mask,
+                      flat_indices=flat_indices, checksum=checksum)
+
+
+def mask_checksum(mask):
+    """SHA-1 (hex) of the mask values, the same for any integer dtype"""
+
+    values = np.ascontiguousarray(mask, dtype='<i4')
+    return hashlib.sha1(values.tobytes()).hexdigest()
+
+
+def apply_singla_mask(image, value=0):
+    """
+    Set all masked pixels of a 2D image to `value` (in place).
+
+    Parameters
+    ----------
+    image : 2D numpy.ndarray
+        A Singla image (or a stack average) with the same shape as the mask.
+    value : float, optional
+        The value written into the masked pixels. Default is 0.
+
+    Returns
+    -------
+    image : 2D numpy.ndarray
+        The same (modified) image.
+    """
+
+    singla_mask = get_singla_mask()
+
+    if image.shape != singla_mask.mask.shape:
+        msg = f"Image shape {image.shape} does not match the Singla mask "
+        msg += f"shape {singla_mask.mask.shape}"
+        raise ValueError(msg)
+
+    if image.flags.c_contiguous:
+        image.reshape(-1)[singla_mask.flat_indices] = value
+    else:
+        image[singla_mask.bool_mask] = value
+
+    return image
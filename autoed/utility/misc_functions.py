@@ -1,17 +1,65 @@
 """ Miscellaneous function used in other parts of the code """
 from __future__ import annotations
-from typing import Union
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Mapping, Union
 import re
-import h5py
 import os
-import numpy as np
 import time
 
 
-import autoed
+basic_type = Union[float, int, str]
 
+DETECTOR_DISTANCE_PATTERN = re.compile(r'detector.starts=(\d+(\.\d*)?)')
 
-basic_type = Union[float, int, str]
+
+def parse_text_file(input_file: str) -> Mapping[str, str]:
+    """
+    Read a textual metadata file (e.g. log or mdoc) with lines of the form
+    `var_name = value` and return all its variables.
+
+    The file is read in a single pass, and the result is cached for as long
+    as the file's modification time and size do not change. Looking up
+    many variables in the same file therefore costs one read.
+
+    Parameters
+    ----------
+    input_file : str
+        Full path of the textual file.
+
+    Returns
+    -------
+    variables : Mapping[str, str]
+        A read-only mapping of variable names to their (string) values.
+        Only the first line for each variable is kept.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the file does not exist.
+    """
+
+    stat = os.stat(input_file)
+    return _parse_text_file(input_file, stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=64)
+def _parse_text_file(input_file, mtime_ns, size):
+    """Single-pass tokenizer behind `parse_text_file` (cached per version)"""
+
+    variables = {}
+    with open(input_file, 'r') as file:
+        for line in file:
+            name, separator, _ = line.partition('=')
+            if not separator:
+                continue
+            name = name.rstrip()
+            if name and name not in variables:
+                # The value is everything after the last '=' in the line
+                value = line.strip().rsplit('=', 1)[1]
+                variables[name] = value.lstrip()
+
+    return MappingProxyType(variables)
 
 
 def scrap(input_file: str,
@@ -23,6 +71,9 @@ def scrap(input_file: str,
     Read the `input_file` and return a value of the first line that matches a
     pattern `var_name = value`
 
+    The file is parsed once with `parse_text_file`, so repeated calls for
+    the same file do not read it again.
+
     Parameters
     ----------
     input_file : str
@@ -46,9 +97,6 @@ def scrap(input_file: str,
         `default_value`.
     """
 
-    pattern = variable_name + r'\s*=\s*(.*)'
-    match_line = None
-
     success = True
 
     try:
@@ -56,16 +104,10 @@ def scrap(input_file: str,
         if default_type not in (str, float, int):
             raise TypeError
 
-        with open(input_file, 'r') as file:
-            for line in file:
-                if re.match(pattern, line):
-                    match_line = line.strip()
-                    break
-        pattern = r'.*\s*=\s*(.*)$'
-        value = re.search(pattern, match_line).group(1)
+        value = parse_text_file(input_file)[variable_name]
         value = default_type(value)
 
-    except (FileNotFoundError, ValueError, TypeError):
+    except (FileNotFoundError, KeyError, ValueError, TypeError):
 
         success = False
         value = default_value
@@ -76,41 +118,106 @@ def scrap(input_file: str,
 def get_detector_distance(path):
     """Read detector distance from PatchMaster.sh"""
 
-    pattern = r'detector.starts=(\d+(\.\d*)?)'
     distance = None
     with open(path, 'r') as file:
         for line in file:
-            ln_match = re.search(pattern, line.strip())
+            ln_match = DETECTOR_DISTANCE_PATTERN.search(line.strip())
             if ln_match:
                 distance = float(ln_match.group(1))
                 break
     return distance
 
 
-def overwrite_mask(filename):
+PIXEL_MASK_PATH = '/entry/instrument/detector/detectorSpecific/pixel_mask'
+MASK_CHECKSUM_ATTR = 'autoed_mask_sha1'
 
-    """Given a HDF5 file, overwrite the pixel mask"""
 
-    while True:
-        try:
-            with h5py.File(filename, 'r+') as file:
+def overwrite_mask(filename, timeout=60, max_interval=8):
+    """
+    Make the pixel mask in a HDF5 (master) file equal to the Singla mask.
 
-                src = '/entry/instrument/detector/detectorSpecific/'
-                src += 'pixel_mask'
-                pixel_mask = file[src]
+    Nothing is written if the checksum stored with the mask (by a previous
+    call) matches the Singla mask. Otherwise the stored mask is compared
+    chunk by chunk, only the differing chunks are written, and the checksum
+    is stored. Opening the file is retried (e.g. while it is still being
+    written) with a doubling interval, up to `max_interval` seconds.
 
-                mask_path = 'data/singla_mask.npz'
-                mask_path = os.path.join(autoed.__path__[0], mask_path)
-                data = np.load(mask_path)
-                mask = data['mask']
-                pixel_mask[...] = mask
-                break
+    Parameters
+    ----------
+    filename : str
+        Path to the HDF5 file.
+    timeout : float, optional
+        Give up if the file can not be opened within `timeout` seconds.
+    max_interval : float, optional
+        Maximal time between two attempts to open the file.
 
-        except OSError:
-            time.sleep(1)
+    Returns
+    -------
+    n_written : int or None
+        The number of chunks written (0 if the mask was up to date), or None
+        if the file has no pixel mask.
+
+    Raises
+    ------
+    TimeoutError
+        If the file could not be opened for writing within `timeout`.
+    ValueError
+        If the shape of the pixel mask is not the Singla mask shape (the
+        file is not changed).
+    """
 
-        except KeyError:
-            break
+    import h5py
+
+    deadline = time.monotonic() + timeout
+    interval = 0.25
+
+    while True:
+        try:
+            with h5py.File(filename, 'r+') as file:
+                if PIXEL_MASK_PATH not in file:
+                    return None
+                return _sync_pixel_mask(file[PIXEL_MASK_PATH])
+
+        except OSError as e:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                msg = f"Could not open {filename} to overwrite the mask: {e}"
+                raise TimeoutError(msg) from e
+            time.sleep(min(interval, remaining))
+            interval = min(2 * interval, max_interval)
+
+
+def _sync_pixel_mask(pixel_mask):
+    """Write the chunks of `pixel_mask` that differ from the Singla mask"""
+
+    import numpy as np
+    from autoed.utility.mask import get_singla_mask
+
+    singla_mask = get_singla_mask()
+    mask = singla_mask.mask
+
+    if pixel_mask.attrs.get(MASK_CHECKSUM_ATTR) == singla_mask.checksum:
+        return 0
+
+    if pixel_mask.shape != mask.shape:
+        msg = f"Pixel mask shape {pixel_mask.shape} does not match the "
+        msg += f"Singla mask shape {mask.shape}"
+        raise ValueError(msg)
+
+    if pixel_mask.chunks:
+        blocks = pixel_mask.iter_chunks()
+    else:
+        rows = 64
+        blocks = (np.s_[i:i + rows] for i in range(0, mask.shape[0], rows))
+
+    n_written = 0
+    for block in blocks:
+        if not np.array_equal(pixel_mask[block], mask[block]):
+            pixel_mask[block] = mask[block]
+            n_written += 1
+
+    pixel_mask.attrs[MASK_CHECKSUM_ATTR] = singla_mask.checksum
+    return n_written
 
 
 def electron_wavelength(energy_kev):
@@ -0,0 +1,169 @@
+"""Profiling of the AutoED command line tools"""
+import functools
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from autoed.constants import autoed_profile_var
+
+PROFILE_FLAG = '--profile'
+
+# Number of functions in the text summary written next to the profile
+SUMMARY_LINES = 40
+
+
+def profiling_requested(argv=None):
+    """
+    Whether to profile this run
+
+    Profiling is requested with the command line flag --profile (removed
+    from `argv`, so the tool does not see it), or with the environment
+    variable AUTOED_PROFILE set to a value other than '', '0' or 'false'.
+    The environment variable is inherited by the processes a tool starts
+    (e.g. the watcher starts autoed_plot_spots).
+    """
+
+    argv = sys.argv if argv is None else argv
+    if PROFILE_FLAG in argv[1:]:
+        while PROFILE_FLAG in argv[1:]:
+            argv.remove(PROFILE_FLAG)
+        return True
+
+    value = os.getenv(autoed_profile_var, '').strip().lower()
+    return value not in ('', '0', 'false', 'no')
+
+
+class Profiler:
+    """
+    cProfile of all threads of a process
+
+    cProfile only follows the thread it was enabled in, so every thread
+    started while profiling gets a profiler of its own (with Python 3.12+,
+    one profiler already follows all threads). The profiles are merged when
+    the run ends.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.profiles = []
+        self.lock = threading.Lock()
+        self.start_time = None
+
+    def _new_profile(self):
+
+        import cProfile
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:      # The running profiler follows this thread
+            return
+        with self.lock:
+            self.profiles.append(profile)
+
+    def _profile_thread(self, frame, event, arg):
+        # Called once in every new thread, then replaced by cProfile
+        sys.setprofile(None)
+        self._new_profile()
+
+    def start(self):
+        self.start_time = time.time()
+        self._new_profile()
+        threading.setprofile(self._profile_thread)
+
+    def stop(self, log_dir=None):
+        """
+        Write the merged profile and a text summary
+
+        Returns
+        -------
+        filename : str or None
+            The profile, which can be read with `python -m pstats` or
+            visualised with e.g. snakeviz.
+        """
+
+        import pstats
+
+        threading.setprofile(None)
+        with self.lock:
+            profiles = list(self.profiles)
+        for profile in profiles:
+            profile.disable()
+        if not profiles:        # Another profiler was running
+            return None
+
+        log_dir = log_dir or os.getcwd()
+        start = time.strftime('%Y%m%d_%H%M%S',
+                              time.localtime(self.start_time))
+        filename = f"autoed_profile_{self.name}_{socket.gethostname()}_"
+        filename += f"{os.getpid()}_{start}.prof"
+        filename = os.path.join(log_dir, filename)
+
+        stats = pstats.Stats(*profiles, stream=None)
+        stats.dump_stats(filename)
+
+        with open(os.path.splitext(filename)[0] + '.txt', 'w') as file:
+            file.write(f"{' '.join(sys.argv)}\n")
+            file.write(f"Run time: {time.time() - self.start_time:.1f} s\n")
+            stats.stream = file
+            stats.sort_stats('cumulative').print_stats(SUMMARY_LINES)
+        return filename
+
+
+def _profile_dir():
+    """
+    Where to write the profile
+
+    AUTOED_PROFILE can be a directory (e.g. shared by all the processes
+    started by a watcher), otherwise the log directory of the configuration
+    is used, if it exists.
+    """
+
+    from autoed.global_config import global_config
+
+    for directory in (os.getenv(autoed_profile_var, ''),
+                      global_config.get('log_dir')):
+        if directory and os.path.isdir(directory):
+            return directory
+    return None
+
+
+def profiled(function):
+    """
+    Decorator for the console script entry points
+
+    If profiling is requested (see `profiling_requested`), the run is
+    profiled and the profile is written (see `_profile_dir`, by default
+    the current directory) when the tool exits, also when it is stopped
+    with SIGTERM (e.g. a watcher stopped by the daemon).
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+
+        if not profiling_requested():
+            return function(*args, **kwargs)
+
+        name = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+        profiler = Profiler(name or function.__name__)
+
+        def terminate(signum, frame):
+            sys.exit(128 + signum)
+
+        if threading.current_thread() is threading.main_thread() and \
+                signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, terminate)
+
+        profiler.start()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            filename = profiler.stop(_profile_dir())
+            if filename:
+                print(f"AutoED profile saved in '{filename}'",
+                      file=sys.stderr)
+
+    return wrapper
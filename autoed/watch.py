@@ -1,16 +1,26 @@
 import time
+import threading
 import autoed
 import os
 import re
 from watchdog.observers import Observer
 from watchdog.observers.polling import PollingObserver
 from watchdog.events import FileSystemEventHandler
-from autoed.dataset import SinglaDataset
+from autoed.dataset import SinglaDataset, DatasetStateStore
 from autoed.process.process_static import gather_master_files
 from autoed.global_config import global_config
+from autoed.constants import events_file, autoed_events_var, timings_file
+from autoed.events import (event_bus, log_events_to_file, DATASET_DETECTED,
+                           FILES_COMPLETE)
+from autoed.timing import span, timings, log_timings_to_file
+from autoed.metrics import WatcherMetrics, metrics, serve_metrics
+from autoed.process.pipeline_registry import (get_pipeline_registry,
+                                              PipelineDefinitionError,
+                                              PipelineRegistry)
 import logging
 import argparse
 from autoed import __version__
+from autoed.utility.profiling import profiled
 
 
 """
@@ -22,7 +32,11 @@ Run with:
 autoed_watch directory_name
 """
 
+# Longest wait (in seconds) before evaluating a burst of trigger events
+TRIGGER_MAX_DELAY = 30
 
+
+@profiled
 def main():
 
     # By default, all the arguments are set to None, so we can test which
@@ -57,6 +71,10 @@ def main():
     parser.add_argument('--log-dir', type=str, default=None,
                         help=msg)
 
+    msg = 'Serve the watcher metrics at http://127.0.0.1:PORT/metrics.'
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help=msg)
+
     parser.add_argument('dirname', nargs='?', default=None,
                         help='Name of the directory to watch')
 
@@ -97,6 +115,20 @@ def main():
 
     global_config.print_to_log(watch_logger)
 
+    # Processing events are written next to the status file. Processes
+    # started by the watcher find the file through the environment.
+    events_path = os.path.join(watch_path, events_file)
+    os.environ[autoed_events_var] = events_path
+    log_events_to_file(events_path)
+    log_timings_to_file(os.path.join(watch_path, timings_file))
+
+    # Reject malformed pipelines now, rather than for every dataset
+    try:
+        get_pipeline_registry()
+    except PipelineDefinitionError as e:
+        watch_logger.error(str(e))
+        raise
+
     event_handler = DirectoryHandler(watch_path,
                                      processing_script,
                                      watch_logger,
@@ -110,10 +142,35 @@ def main():
     observer.schedule(event_handler, watch_path, recursive=True)
     observer.start()
 
+    if global_config.metrics_port:
+        serve_watch_metrics(watch_path, event_handler, observer,
+                            global_config.metrics_port, watch_logger)
+
+    def validate(config):
+        PipelineRegistry(config['defined_pipelines'])
+
+    def log_timings():
+        summary = timings.format_summary()
+        if summary:
+            watch_logger.info('Time spent in the processing stages:\n'
+                              + summary)
+
+    last_summary = time.time()
     try:
         while True:
             time.sleep(global_config.sleep_time)
 
+            if time.time() - last_summary >= \
+                    global_config.timing_summary_interval_sec:
+                log_timings()
+                last_summary = time.time()
+
+            # Apply changes in the local config file without a restart
+            if global_config.reload_config:
+                log_str = global_config.reload_if_changed(validate)
+                if log_str:
+                    watch_logger.info(log_str)
+
     except KeyboardInterrupt as e:
         watch_logger.exception(str(e))
         observer.stop()
@@ -121,6 +178,88 @@ def main():
         watch_logger.exception(str(e))
         observer.stop()
     observer.join()
+    log_timings()
+
+
+class TriggerDebouncer:
+    """
+    Coalesces trigger events per directory
+
+    A trigger file is usually created and then modified (or touched several
+    times), and every event would walk the directory and check all its
+    datasets. Here, the events of a directory are merged until none came for
+    `quiet_time` seconds (or at most `max_delay` seconds after the first
+    one), and then the directory is evaluated once. Directories inside
+    another ready directory are dropped, as the parent is searched
+    recursively. With a `quiet_time` of 0, a directory is ready as soon as
+    it is added. `quiet_time` can be changed while the debouncer runs.
+
+    Parameters
+    ----------
+    quiet_time : float
+        Seconds without events before a directory is evaluated.
+    max_delay : float
+        Longest wait after the first event of a burst (at least
+        `quiet_time`).
+    """
+
+    def __init__(self, quiet_time=2., max_delay=TRIGGER_MAX_DELAY):
+        self.quiet_time = quiet_time
+        self.max_delay = max_delay
+        self.pending = {}     # Directory -> (first event time, last event)
+        self.condition = threading.Condition()
+
+    def add(self, directory, now=None):
+        """
+        Record a trigger event
+
+        Returns
+        -------
+        new : boolean
+            True for the first event of a burst.
+        """
+
+        now = time.time() if now is None else now
+        with self.condition:
+            new = directory not in self.pending
+            first, _ = self.pending.get(directory, (now, now))
+            self.pending[directory] = (first, now)
+            self.condition.notify()
+        return new
+
+    def _due(self, directory):
+        first, last = self.pending[directory]
+        max_delay = max(self.max_delay, self.quiet_time)
+        return min(last + self.quiet_time, first + max_delay)
+
+    def pop_ready(self, now=None):
+        """Remove and return the directories ready to be evaluated"""
+
+        now = time.time() if now is None else now
+        with self.condition:
+            ready = [d for d in self.pending if self._due(d) <= now]
+            for directory in ready:
+                del self.pending[directory]
+
+        parents = [d.rstrip(os.path.sep) + os.path.sep for d in ready]
+        return [d for d in ready
+                if not any(d.startswith(p) for p in parents)]
+
+    def wait_ready(self):
+        """Block until some directories are ready, and return them"""
+
+        while True:
+            with self.condition:
+                if self.pending:
+                    due = min(self._due(d) for d in self.pending)
+                    timeout = max(due - time.time(), 0)
+                else:
+                    timeout = None
+                if timeout is None or timeout > 0:
+                    self.condition.wait(timeout)
+            ready = self.pop_ready()
+            if ready:
+                return ready
 
 
 class DirectoryHandler(FileSystemEventHandler):
@@ -141,15 +280,19 @@ class DirectoryHandler(FileSystemEventHandler):
 
         self.watch_path = watch_path
         self.status_file = os.path.join(watch_path, '.autoed_status.txt')
-        self.dataset_names = set()
-        self.datasets = dict()
-        self.queue = dict()
+        self.datasets = DatasetStateStore(global_config.max_known_datasets)
         self.logger = logger
         self.global_config = global_config
 
         self.script = script
-        self.last_triggered = 0
-        self.last_detected = dict()
+
+        # Bursts of trigger events in a directory are evaluated once. All
+        # directories are processed in this thread (also without a quiet
+        # time), as the dataset table is not shared between threads.
+        self.triggers = TriggerDebouncer(
+            global_config.trigger_quiet_time_sec)
+        threading.Thread(target=self.run_triggers,
+                         name='autoed-triggers', daemon=True).start()
 
     def on_created(self, event):
 
@@ -161,68 +304,19 @@ class DirectoryHandler(FileSystemEventHandler):
                 trigger_file = self.global_config.trigger_file
                 if re.match(rf".*\{trigger_file}$", event.src_path):
 
-                    info('Detected trigger file: %s' % event.src_path)
-
-                    dataset = None
-                    basename = None
-
                     # Process only events that happened in ED directory
                     ed_root = global_config['ed_root_dir']
                     if ed_root in event.src_path.split(os.path.sep):
 
                         dir_name = os.path.dirname(event.src_path)
 
-                        master_files = gather_master_files(dir_name)
-
-                        for master_file in master_files:
-                            basename = master_file[:-10]
-
-                            if (basename not in self.dataset_names):
-                                self.dataset_names.add(basename)
-                                dataset = SinglaDataset.from_basename(basename)
-                                msg = 'AutoED global log file at '
-                                msg += f"'{global_config.log_dir}'."
-                                dataset.logger.info(msg)
-                                dataset.search_and_update_data_files()
-
-                                # We do not want to run processing scripts
-                                # if either this is a test, or a dummy run
-                                run_dummy = (self.global_config.test or
-                                             self.global_config.dummy)
-                                dataset.dummy = run_dummy
-                                self.datasets[dataset.base] = dataset
-                            else:
-                                dataset = self.datasets[basename]
-
-                            dataset.update_processed()
-                            msg = 'Found dataset: %s'
-                            info(msg % dataset.base)
-
-                            if not dataset.processed:
-                                if dataset.all_files_present():
-                                    msg = 'All files present: %s'
-                                    info(msg % dataset.base)
-                                    info('Processing: %s' % dataset.base)
-                                    gc = self.global_config
-                                    success = dataset.process(gc)
-                                    base = dataset.base
-                                    if success:
-                                        ms = f"Processed: {base}"
-                                        info(ms)
-                                    else:
-                                        ms = f"Failed to process: {base}"
-                                        info(ms)
-                                else:
-                                    msg = 'Not all files present, ignoring: %s'
-                                    info(msg % dataset.base)
-                            else:
-                                msg = 'Ignoring trigger. '
-                                msg += 'Data processed recently: %s %s '
-                                t1 = dataset.last_processed_time
-                                st = time.strftime('%Y-%m-%d %H:%M:%S',
-                                                   time.localtime(t1))
-                                info(msg % (st, dataset.base))
+                        # The quiet time can be changed by a config reload
+                        self.triggers.quiet_time = max(
+                            self.global_config.trigger_quiet_time_sec, 0)
+                        if self.triggers.add(dir_name):
+                            info('Detected trigger file: %s' % event.src_path)
                     else:
+                        info('Detected trigger file: %s' % event.src_path)
                         msg = 'Ignoring trigger, no ED directory: %s'
                         self.logger.info(msg % event.src_path)
         except Exception as e:
@@ -231,6 +325,109 @@ class DirectoryHandler(FileSystemEventHandler):
     def on_modified(self, event):
         self.on_created(event)
 
+    def run_triggers(self):
+        """Process the directories once their triggers are quiet"""
+
+        while True:
+            for dir_name in self.triggers.wait_ready():
+                try:
+                    self.process_directory(dir_name)
+                except Exception as e:
+                    self.logger.exception(str(e))
+
+    def process_directory(self, dir_name):
+        """Handle all datasets in a triggered directory (recursively)"""
+
+        master_files = gather_master_files(dir_name)
+
+        for master_file in master_files:
+            basename = master_file[:-10]
+            self.handle_dataset(basename)
+
+    def handle_dataset(self, basename):
+        """Process a triggered dataset, unless it was processed recently"""
+
+        with span('trigger', dataset=basename):
+            self._handle_dataset(basename)
+
+    def _handle_dataset(self, basename):
+
+        info = self.logger.info
+
+        if basename not in self.datasets:
+            dataset = SinglaDataset.from_basename(basename)
+            msg = 'AutoED global log file at '
+            msg += f"'{global_config.log_dir}'."
+            dataset.logger.info(msg)
+            event_bus.publish(DATASET_DETECTED, dataset=dataset.base)
+        else:
+            dataset = self.datasets.restore(basename)
+
+        try:
+            dataset.search_and_update_data_files()
+
+            # We do not want to run processing scripts
+            # if either this is a test, or a dummy run
+            dataset.dummy = (self.global_config.test or
+                             self.global_config.dummy)
+
+            dataset.update_processed()
+            info('Found dataset: %s' % dataset.base)
+
+            if not dataset.processed:
+                if dataset.all_files_present():
+                    info('All files present: %s' % dataset.base)
+                    event_bus.publish(FILES_COMPLETE, dataset=dataset.base)
+                    info('Processing: %s' % dataset.base)
+                    success = dataset.process(self.global_config)
+                    if success:
+                        info(f"Processed: {dataset.base}")
+                    else:
+                        info(f"Failed to process: {dataset.base}")
+                else:
+                    msg = 'Not all files present, ignoring: %s'
+                    info(msg % dataset.base)
+            else:
+                msg = 'Ignoring trigger. '
+                msg += 'Data processed recently: %s %s '
+                t1 = dataset.last_processed_time
+                st = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t1))
+                info(msg % (st, dataset.base))
+        finally:
+            self.datasets.save(dataset)
+
+
+def serve_watch_metrics(watch_path, handler, observer, port, logger):
+    """Serve the metrics of this watcher on a local port"""
+
+    from autoed.beam_position.plot import deferred_plots
+    from autoed.utility.logger_pool import dataset_loggers
+
+    watcher_metrics = WatcherMetrics(metrics)
+    queue_depth = metrics.gauge('autoed_queue_depth',
+                                'Items waiting in the watcher queues',
+                                ('watcher', 'queue'))
+    known_datasets = metrics.gauge('autoed_known_datasets',
+                                   'Datasets remembered by the watcher',
+                                   ('watcher',))
+
+    def collect():
+        watcher_metrics.update([watch_path])
+        queues = {'filesystem_events': observer.event_queue.qsize(),
+                  'beam_plots': deferred_plots.pending(),
+                  'dataset_logs': dataset_loggers.queue.qsize()}
+        for name, depth in queues.items():
+            queue_depth.set(depth, watcher=watch_path, queue=name)
+        known_datasets.set(len(handler.datasets), watcher=watch_path)
+
+    metrics.add_collector(collect)
+    try:
+        serve_metrics(port)
+    except OSError as e:
+        logger.error(f"Cannot serve the metrics on port {port}: {e}")
+        return
+    logger.info(f"Metrics at http://127.0.0.1:{port}/metrics")
+
 
 def set_watch_logger(watch_path):
 
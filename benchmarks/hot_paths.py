@@ -0,0 +1,228 @@
+"""
+Benchmark the beam position and spot plot code on a synthetic sweep
+
+A Singla-shaped sweep (1062 x 1028 pixels, int32, Bitshuffle/LZ4
+compressed with hdf5plugin, one image per chunk) is written to a
+temporary directory. Each benchmark is then run several times and the
+best and median times are reported together with the peak memory
+allocated during a run (traced with tracemalloc, which includes NumPy
+arrays but not the HDF5 chunk cache).
+
+    python benchmarks/hot_paths.py [--n-images N] [--repeat N]
+                                   [--json FILE] [benchmark ...]
+
+The same seed always gives the same sweep, so results saved with --json
+can be compared between commits.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import h5py
+import hdf5plugin
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+SINGLA_SHAPE = (1062, 1028)
+BEAM_POSITION = (514.0, 531.0)
+
+
+def make_sweep(filename, n_images=100, seed=0, beam=BEAM_POSITION):
+    """
+    Write a synthetic Singla sweep
+
+    Each image has a Poisson background, a bright direct beam spot at
+    `beam` (x, y) with a diffuse halo, and a few random diffraction spots.
+
+    Returns
+    -------
+    filename : str
+        The data file, with the images in '/entry/data/data'.
+    """
+
+    rng = np.random.default_rng(seed)
+    ny, nx = SINGLA_SHAPE
+    y, x = np.mgrid[0:ny, 0:nx]
+    r2 = (x - beam[0])**2 + (y - beam[1])**2
+    profile = 2000 * np.exp(-r2 / (2 * 4.0**2)) + 40 / (1 + r2 / 2500.)
+
+    # A few background images reused for all frames (generating Poisson
+    # noise for every frame would dominate the set-up time)
+    backgrounds = [rng.poisson(profile + 1).astype(np.int32)
+                   for _ in range(4)]
+
+    with h5py.File(filename, 'w') as file:
+        data = file.create_dataset(
+            '/entry/data/data', shape=(n_images, ny, nx), dtype=np.int32,
+            chunks=(1, ny, nx),
+            **hdf5plugin.Bitshuffle(cname='lz4'))
+        for i in range(n_images):
+            image = backgrounds[i % len(backgrounds)].copy()
+            n_spots = 30
+            spots_y = rng.integers(0, ny, n_spots)
+            spots_x = rng.integers(0, nx, n_spots)
+            image[spots_y, spots_x] += rng.integers(50, 500, n_spots,
+                                                    dtype=np.int32)
+            data[i] = image
+
+    return filename
+
+
+def _image(calc, every=20):
+    """The masked stack average used by the beam position methods"""
+
+    from autoed.constants import BAD_PIXEL_THRESHOLD
+    from autoed.utility.mask import apply_singla_mask
+
+    image = calc.dataset[::every, :, :].mean(axis=0)
+    apply_singla_mask(image)
+    image[image > BAD_PIXEL_THRESHOLD] = 0
+    return image
+
+
+def setup_benchmarks(data_file, figure_path, every=20):
+    """
+    Return the benchmarks as a dict: name -> function without arguments
+    """
+
+    from autoed.beam_position.beam_center import BeamCenterCalculator
+    from autoed.beam_position.maximum_method import MaxMethodParams, find_max
+    from autoed.beam_position.midpoint_method import (MidpointMethodParams,
+                                                      position_from_midpoint)
+    from autoed.beam_position.misc import smooth
+    from autoed.constants import (MID_START, MID_STOP, MID_STEP,
+                                  SINGLA_GAP_START, SINGLA_GAP_STOP)
+
+    calc = BeamCenterCalculator(data_file)
+    image = _image(calc, every)
+    profile = image.mean(axis=0)
+    mid_params = MidpointMethodParams(
+        data_slice=(MID_START, MID_STOP, MID_STEP),
+        convolution_width=20,
+        exclude_range_x=None,
+        exclude_range_y=(SINGLA_GAP_START, SINGLA_GAP_STOP),
+        per_image=False)
+    max_params = MaxMethodParams(convolution_width=3)
+
+    def center_from_mixed():
+        calc.center_from_mixed(every=every)
+
+    def midpoint():
+        position_from_midpoint(image, mid_params)
+
+    def maximum():
+        find_max(image, max_params, axis='x')
+        find_max(image, max_params, axis='y')
+
+    def smooth_profile():
+        smooth(profile, 20)
+
+    def spots():
+        import matplotlib
+        matplotlib.use('Agg')
+        from autoed.process.plot_spots import plot_spots
+
+        args = SimpleNamespace(color_cutoff=None, color_cutoff_log=None,
+                               figure_path=figure_path)
+        images = calc.dataset
+        n_images = images.shape[0]
+        with contextlib.redirect_stdout(io.StringIO()):
+            plot_spots(images, data_file, min(10, n_images), n_images, 0,
+                       args)
+
+    return {'center_from_mixed': center_from_mixed,
+            'position_from_midpoint': midpoint,
+            'find_max': maximum,
+            'smooth': smooth_profile,
+            'plot_spots': spots}
+
+
+def run_benchmark(function, repeat=5):
+    """
+    Run `function` `repeat` times
+
+    Returns
+    -------
+    result : dict
+        Best and median time (s), and the peak traced memory (MB).
+    """
+
+    function()     # Warm up (imports, HDF5 and plugin initialisation)
+
+    times = []
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        t = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - t)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return {'best': min(times), 'median': statistics.median(times),
+            'peak_mb': peak / 1024**2}
+
+
+def main():
+
+    msg = 'Benchmark the beam position and spot plot code'
+    parser = argparse.ArgumentParser(description=msg)
+    parser.add_argument('benchmarks', nargs='*',
+                        help='Benchmarks to run (default: all)')
+    parser.add_argument('--n-images', type=int, default=100,
+                        help='Number of images in the synthetic sweep')
+    parser.add_argument('--every', type=int, default=20,
+                        help='Use every n-th image for the beam position')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of timed runs per benchmark')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the synthetic sweep')
+    parser.add_argument('--json', default=None,
+                        help='Save the results to a JSON file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='autoed_bench_') as temp_dir:
+
+        data_file = os.path.join(temp_dir, 'sample_data_000001.h5')
+        t = time.perf_counter()
+        make_sweep(data_file, args.n_images, args.seed)
+        t = time.perf_counter() - t
+        print(f"Synthetic sweep: {args.n_images} images "
+              f"({os.path.getsize(data_file) / 1024**2:.1f} MB, "
+              f"written in {t:.1f} s)")
+
+        benchmarks = setup_benchmarks(data_file, temp_dir, args.every)
+        names = args.benchmarks or list(benchmarks)
+        unknown = set(names) - set(benchmarks)
+        if unknown:
+            parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+        results = {}
+        print(f"{'benchmark':<26} {'best [ms]':>10} {'median [ms]':>12} "
+              f"{'peak [MB]':>10}")
+        for name in names:
+            result = run_benchmark(benchmarks[name], args.repeat)
+            results[name] = result
+            print(f"{name:<26} {1000 * result['best']:>10.1f} "
+                  f"{1000 * result['median']:>12.1f} "
+                  f"{result['peak_mb']:>10.1f}")
+
+    if args.json:
+        info = {'n_images': args.n_images, 'every': args.every,
+                'repeat': args.repeat, 'seed': args.seed}
+        with open(args.json, 'w') as f:
+            json.dump({'parameters': info, 'results': results}, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
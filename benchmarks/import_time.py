@@ -0,0 +1,89 @@
+"""
+Benchmark the import (start-up) time of the AutoED command line tools
+
+Each module is imported in a fresh Python process, several times, and the
+best time is reported together with the heavy packages it pulled in.
+
+    python benchmarks/import_time.py [--repeat N] [module ...]
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+# Modules behind the console scripts (see setup.py)
+ENTRY_POINT_MODULES = [
+    'autoed.watch',
+    'autoed.process.process_static',
+    'autoed.report.report_generator',
+    'autoed.report.txt_report',
+    'autoed.process.plot_spots',
+    'autoed.global_config',
+    'autoed.report.misc',
+    'autoed.process.multiplex',
+    'autoed.process.slurm',
+    'autoed.beam_position.beam_center',
+    'autoed.dataset',
+]
+
+HEAVY_PACKAGES = ['numpy', 'h5py', 'hdf5plugin', 'matplotlib', 'nexgen',
+                  'watchdog']
+
+_PROBE = """
+import json, sys, time
+t = time.perf_counter()
+import {module}
+t = time.perf_counter() - t
+heavy = [p for p in {heavy!r} if p in sys.modules]
+print(json.dumps({{'time': t, 'heavy': heavy}}))
+"""
+
+
+def time_import(module, repeat=5):
+    """
+    Import `module` in `repeat` fresh interpreters
+
+    Returns
+    -------
+    best_time : float
+        The shortest import time in seconds.
+    heavy : list of str
+        Heavy packages loaded by the import.
+    """
+
+    code = _PROBE.format(module=module, heavy=HEAVY_PACKAGES)
+    best_time = None
+    heavy = []
+    for _ in range(repeat):
+        p = subprocess.run([sys.executable, '-c', code], check=True,
+                           capture_output=True, text=True)
+        result = json.loads(p.stdout.strip().splitlines()[-1])
+        if best_time is None or result['time'] < best_time:
+            best_time = result['time']
+        heavy = result['heavy']
+    return best_time, heavy
+
+
+def main():
+
+    msg = 'Benchmark import time of AutoED command line tools'
+    parser = argparse.ArgumentParser(description=msg)
+    parser.add_argument('modules', nargs='*', default=ENTRY_POINT_MODULES,
+                        help='Modules to import (default: entry points)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of fresh imports per module')
+    args = parser.parse_args()
+
+    print(f"{'module':<36} {'time [ms]':>10}  heavy packages")
+    for module in args.modules:
+        try:
+            best_time, heavy = time_import(module, args.repeat)
+        except subprocess.CalledProcessError as e:
+            error = e.stderr.strip().splitlines()[-1]
+            print(f"{module:<36} {'failed':>10}  {error}")
+            continue
+        print(f"{module:<36} {1000 * best_time:>10.1f}  {', '.join(heavy)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,386 @@
+"""
+Load test of autoed_watch with stub nexgen, DIALS and SLURM
+
+A fake ED directory tree is created in a temporary directory and an
+autoed_watch process is started on it. Datasets (master, data and JSON
+metadata files, followed by the trigger file) are then dropped at a fixed
+rate. The external tools are replaced by stub executables (ED_nexus,
+nexgen_phil, xia2, dials.*, autoed_plot_spots, autoed_add_to_database)
+and the SLURM REST API by a local HTTP server, so only AutoED itself is
+measured.
+
+From the processing events written by the watcher (see
+`autoed.events`), the following is reported for every dataset, counted
+from the moment its trigger file was written:
+
+    detection    the watcher noticed the dataset
+    conversion   the NeXus file was generated (stub ED_nexus)
+    submission   the first processing job reached the SLURM stand-in
+
+The backlog is the number of dropped datasets not converted yet (sampled
+every 0.2 s). The sustained rate is the number of datasets converted per
+minute between the first trigger and the last conversion.
+
+    python benchmarks/watch_load.py [--rate N] [--n-datasets N]
+                                    [--sleep-time S] [--stub-delay S]
+                                    [--json FILE]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from autoed.constants import events_file  # noqa: E402
+from autoed.events import (read_events, DATASET_DETECTED,  # noqa: E402
+                           CONVERTED, CONVERSION_FAILED, PIPELINE_SUBMITTED)
+
+TEST_DATA = os.path.join(REPO_DIR, 'test', 'data', 'ED')
+MASTER_FILE = os.path.join(TEST_DATA, 'data', 'sample_master.h5')
+DATA_FILE = os.path.join(TEST_DATA, 'data', 'sample_data_000001.h5')
+METADATA_FILE = os.path.join(TEST_DATA, 'json_01', 'sample.json')
+
+# Stub executables. AUTOED_STUB_DELAY (seconds) simulates slow tools.
+STUBS = {
+    'ED_nexus': r'''#!/bin/sh
+sleep "${AUTOED_STUB_DELAY:-0}"
+while [ $# -gt 0 ]; do
+    if [ "$1" = "-m" ]; then
+        touch "${2%_master.h5}.nxs"
+    fi
+    shift
+done
+''',
+    'nexgen_phil': r'''#!/bin/sh
+# nexgen_phil get TEMPLATE -o FILE
+echo "# stub phil template" > "$4"
+''',
+    'xia2': '#!/bin/sh\nsleep "${AUTOED_STUB_DELAY:-0}"\n',
+    'dials.import': '#!/bin/sh\n',
+    'dials.find_spots': '#!/bin/sh\n',
+    'dials.index': '#!/bin/sh\n',
+    'autoed_plot_spots': '#!/bin/sh\n',
+    'autoed_add_to_database': '#!/bin/sh\n',
+}
+
+
+class SlurmStub:
+    """A local stand-in for the SLURM REST API (records job submissions)"""
+
+    def __init__(self):
+
+        self.submissions = []    # (time, working directory)
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                try:
+                    job = json.loads(self.rfile.read(length))
+                    cwd = job['job']['current_working_directory']
+                except (ValueError, KeyError):
+                    cwd = None
+                with stub.lock:
+                    stub.submissions.append((time.time(), cwd))
+                    job_id = len(stub.submissions)
+                body = json.dumps({'job_id': job_id, 'errors': []}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/slurm/v0.0.42"
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def write_stubs(bin_dir):
+
+    os.makedirs(bin_dir, exist_ok=True)
+    for name, script in STUBS.items():
+        filename = os.path.join(bin_dir, name)
+        with open(filename, 'w') as f:
+            f.write(script)
+        os.chmod(filename, 0o755)
+
+
+def drop_dataset(dataset_dir, trigger_file):
+    """Write the files of one dataset, the trigger file last"""
+
+    os.makedirs(dataset_dir)
+    shutil.copy(MASTER_FILE, os.path.join(dataset_dir, 'sample_master.h5'))
+    shutil.copy(DATA_FILE,
+                os.path.join(dataset_dir, 'sample_data_000001.h5'))
+    shutil.copy(METADATA_FILE, os.path.join(dataset_dir, 'sample.json'))
+    with open(os.path.join(dataset_dir, trigger_file), 'w'):
+        pass
+    return time.time()
+
+
+def summary(values):
+    """Median, 95th percentile and maximum of a list of latencies"""
+
+    if not values:
+        return None
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(0.95 * len(values)))]
+    return {'n': len(values), 'median': statistics.median(values),
+            'p95': p95, 'max': values[-1]}
+
+
+def run_load_test(rate, n_datasets, sleep_time=1., stub_delay=0.,
+                  inotify=False, timeout=600., keep=None):
+    """
+    Run the load test
+
+    Parameters
+    ----------
+    rate : float
+        Datasets dropped per minute.
+    n_datasets : int
+        Number of datasets to drop.
+    sleep_time : float
+        The watcher's polling interval (`sleep_time` configuration).
+    stub_delay : float
+        Time taken by each stub ED_nexus and xia2 call.
+    inotify : boolean
+        Run the watcher with inotify instead of polling.
+    timeout : float
+        Stop waiting for conversions after this many seconds.
+    keep : str, optional
+        Run in this directory (and keep it) instead of a temporary one.
+
+    Returns
+    -------
+    results : dict
+    """
+
+    root = keep or tempfile.mkdtemp(prefix='autoed_load_')
+    os.makedirs(root, exist_ok=True)
+    watch_dir = os.path.join(root, 'ED')
+    bin_dir = os.path.join(root, 'bin')
+    log_dir = os.path.join(root, 'logs')
+    os.makedirs(watch_dir)
+    os.makedirs(log_dir)
+    write_stubs(bin_dir)
+
+    slurm = SlurmStub()
+    slurm.start()
+
+    trigger_file = '.HiMarko'
+    config_file = os.path.join(root, 'autoed_config.json')
+    config = {'ed_root_dir': 'ED', 'processed_dir': 'processed',
+              'trigger_file': trigger_file, 'slurm_api_url': slurm.url,
+              'run_multiplex': False, 'overwrite_mask': False,
+              'nexgen_in_process': False}
+    with open(config_file, 'w') as f:
+        json.dump(config, f)
+
+    env = dict(os.environ)
+    env['PATH'] = bin_dir + os.pathsep + env.get('PATH', '')
+    env['PYTHONPATH'] = REPO_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    env['AUTOED_CONFIG_FILE'] = config_file
+    env['AUTOED_STUB_DELAY'] = str(stub_delay)
+    env['SLURM_JWT'] = 'stub'
+    env['MPLBACKEND'] = 'Agg'
+
+    command = [sys.executable, '-m', 'autoed.watch', '-t', str(sleep_time),
+               '--log-dir', log_dir]
+    if inotify:
+        command.append('-i')
+    command.append(watch_dir)
+    watcher = subprocess.Popen(command, env=env, cwd=root,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+
+    events_path = os.path.join(watch_dir, events_file)
+    dropped = {}        # Dataset base -> trigger time
+    events = {}         # (event type, dataset base) -> first event time
+    backlog = []        # (time, number of datasets not converted)
+    position = 0
+
+    def collect():
+        nonlocal position
+        new_events, position = read_events(events_path, position)
+        for event in new_events:
+            key = (event['type'], event.get('dataset'))
+            events.setdefault(key, event['time'])
+
+    def n_finished():
+        return sum((CONVERTED, base) in events or
+                   (CONVERSION_FAILED, base) in events for base in dropped)
+
+    try:
+        time.sleep(2)   # Let the watcher start its observer
+        interval = 60. / rate
+        next_drop = time.time()
+        index = 0
+        deadline = None
+
+        while True:
+            now = time.time()
+            if index < n_datasets and now >= next_drop:
+                dataset_dir = os.path.join(watch_dir, 'grid',
+                                           f"position_{index:04d}")
+                base = os.path.join(dataset_dir, 'sample')
+                dropped[base] = drop_dataset(dataset_dir, trigger_file)
+                index += 1
+                next_drop += interval
+                if index == n_datasets:
+                    deadline = time.time() + timeout
+
+            collect()
+            finished = n_finished()
+            backlog.append((now, len(dropped) - finished))
+
+            if index == n_datasets and finished == n_datasets:
+                break
+            if deadline is not None and now > deadline:
+                break
+            if watcher.poll() is not None:
+                break
+            time.sleep(0.2)
+
+        time.sleep(sleep_time)
+        collect()
+    finally:
+        watcher.terminate()
+        try:
+            watcher.wait(10)
+        except subprocess.TimeoutExpired:
+            watcher.kill()
+        slurm.stop()
+
+    # Latencies, counted from the trigger file
+    detection, conversion, submission = [], [], []
+    for base, t_drop in dropped.items():
+        if (DATASET_DETECTED, base) in events:
+            detection.append(events[(DATASET_DETECTED, base)] - t_drop)
+        if (CONVERTED, base) in events:
+            conversion.append(events[(CONVERTED, base)] - t_drop)
+
+        dataset_dir = os.path.dirname(base)
+        processed_dir = dataset_dir.replace(os.sep + 'ED' + os.sep,
+                                            os.sep + 'processed' + os.sep)
+        submitted = [t for t, cwd in slurm.submissions
+                     if cwd and cwd.startswith(processed_dir + os.sep)]
+        if submitted:
+            submission.append(min(submitted) - t_drop)
+
+    converted = [events[(CONVERTED, base)] for base in dropped
+                 if (CONVERTED, base) in events]
+    rate_sustained = None
+    if converted and dropped:
+        duration = max(converted) - min(dropped.values())
+        if duration > 0:
+            rate_sustained = 60. * len(converted) / duration
+
+    n_submitted_events = sum(1 for key in events
+                             if key[0] == PIPELINE_SUBMITTED)
+
+    if keep is None:
+        shutil.rmtree(root, ignore_errors=True)
+
+    return {
+        'parameters': {'rate': rate, 'n_datasets': n_datasets,
+                       'sleep_time': sleep_time, 'stub_delay': stub_delay,
+                       'inotify': inotify},
+        'n_dropped': len(dropped),
+        'n_converted': len(converted),
+        'n_failed': sum((CONVERSION_FAILED, base) in events
+                        for base in dropped),
+        'n_slurm_jobs': len(slurm.submissions),
+        'n_pipeline_events': n_submitted_events,
+        'datasets_per_minute': rate_sustained,
+        'max_backlog': max((n for _, n in backlog), default=0),
+        'detection_latency': summary(detection),
+        'conversion_latency': summary(conversion),
+        'submission_latency': summary(submission),
+        'watcher_exit_code': watcher.returncode,
+    }
+
+
+def print_results(results):
+
+    p = results['parameters']
+    print(f"Dropped {results['n_dropped']} datasets at {p['rate']:g}/min "
+          f"(sleep_time {p['sleep_time']:g} s, stub delay "
+          f"{p['stub_delay']:g} s)")
+    print(f"Converted: {results['n_converted']}, failed: "
+          f"{results['n_failed']}, SLURM jobs: {results['n_slurm_jobs']}")
+    rate = results['datasets_per_minute']
+    print("Sustained rate: " +
+          (f"{rate:.1f} datasets/min" if rate else 'n/a'))
+    print(f"Maximum backlog: {results['max_backlog']} datasets")
+    print(f"{'latency [s]':<20} {'n':>5} {'median':>8} {'p95':>8} "
+          f"{'max':>8}")
+    for name in ('detection', 'conversion', 'submission'):
+        s = results[f"{name}_latency"]
+        if s is None:
+            print(f"{name:<20} {0:>5}")
+            continue
+        print(f"{name:<20} {s['n']:>5} {s['median']:>8.2f} {s['p95']:>8.2f} "
+              f"{s['max']:>8.2f}")
+
+
+def main():
+
+    msg = 'Load test autoed_watch with stub processing tools'
+    parser = argparse.ArgumentParser(description=msg)
+    parser.add_argument('--rate', type=float, default=30,
+                        help='Datasets dropped per minute')
+    parser.add_argument('--n-datasets', type=int, default=20,
+                        help='Number of datasets to drop')
+    parser.add_argument('--sleep-time', type=float, default=1.,
+                        help="The watcher's sleep_time (polling interval)")
+    parser.add_argument('--stub-delay', type=float, default=0.,
+                        help='Seconds taken by each stub ED_nexus and xia2')
+    parser.add_argument('--inotify', action='store_true',
+                        help='Watch with inotify instead of polling')
+    parser.add_argument('--timeout', type=float, default=600.,
+                        help='Maximum wait after the last dataset (seconds)')
+    parser.add_argument('--keep', default=None,
+                        help='Run in (and keep) this directory')
+    parser.add_argument('--json', default=None,
+                        help='Save the results to a JSON file')
+    args = parser.parse_args()
+
+    results = run_load_test(args.rate, args.n_datasets, args.sleep_time,
+                            args.stub_delay, args.inotify, args.timeout,
+                            args.keep)
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -27,7 +27,7 @@ setup(
         'argcomplete',
         'watchdog==4.0.0',
         'numpy',
-        'nexgen>=0.8.5',
+        'nexgen>=0.8.5,<0.9',
         'h5py',
         'argparse',
         'python-daemon',
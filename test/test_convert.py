@@ -0,0 +1,134 @@
+import logging
+import os
+import shutil
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import h5py
+import numpy as np
+import pytest
+
+from autoed.convert import (copy_phil_template, nexgen_phil_args,
+                            overwrite_dataset_mask, relink_to_directory,
+                            write_nexus_file, PHIL_TEMPLATE)
+from autoed.utility.misc_functions import PIXEL_MASK_PATH
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data', 'ED', 'data')
+
+
+def _has_nexgen_phil():
+
+    try:
+        import freephil                                     # noqa: F401
+        from nexgen.command_line.ED_nexus import ED_phil    # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _nexus_contents(nexus_file):
+    """Links, attributes, shapes and small values of a NeXus file"""
+
+    contents = {}
+
+    def visit(group, prefix):
+        for name in group:
+            path = prefix + '/' + name
+            link = group.get(name, getlink=True)
+            if isinstance(link, (h5py.ExternalLink, h5py.SoftLink)):
+                contents[path] = (type(link).__name__,
+                                  getattr(link, 'filename', None), link.path)
+                continue
+            item = group[name]
+            attrs = {key: np.asarray(value).tolist()
+                     for key, value in item.attrs.items()}
+            if isinstance(item, h5py.Group):
+                contents[path] = ('group', attrs)
+                visit(item, path)
+            else:
+                # Large (compressed) arrays are compared by shape only
+                value = item[()].tolist() if item.size < 100 else None
+                contents[path] = ('dataset', item.shape, str(item.dtype),
+                                  attrs, value)
+
+    with h5py.File(nexus_file, 'r') as file:
+        visit(file, '')
+    return contents
+
+
+def test_relink_to_directory(tmp_path):
+
+    data_dir = str(tmp_path)
+    nexus_file = os.path.join(data_dir, 'sample.nxs')
+    data_file = os.path.join(data_dir, 'sample_data_000001.h5')
+    other_file = '/elsewhere/other.h5'
+
+    with h5py.File(nexus_file, 'w') as f:
+        group = f.create_group('entry/data')
+        group['data_000001'] = h5py.ExternalLink(data_file, 'entry/data/data')
+        f['entry/other'] = h5py.ExternalLink(other_file, 'entry/data')
+        f['entry/value'] = 1
+
+    relink_to_directory(nexus_file, data_dir)
+
+    with h5py.File(nexus_file, 'r') as f:
+        link = f['entry/data'].get('data_000001', getlink=True)
+        assert link.filename == 'sample_data_000001.h5'
+        assert link.path == 'entry/data/data'
+        link = f['entry'].get('other', getlink=True)
+        assert link.filename == other_file
+        assert f['entry/value'][()] == 1
+
+
+def test_overwrite_dataset_mask_shape_mismatch(tmp_path, caplog):
+
+    master_file = str(tmp_path / 'sample_master.h5')
+    with h5py.File(master_file, 'w') as f:
+        f.create_dataset(PIXEL_MASK_PATH, data=np.ones((10, 10), 'int8'))
+
+    logger = logging.getLogger('test_overwrite_dataset_mask')
+    dataset = SimpleNamespace(master_file=master_file, logger=logger)
+    with caplog.at_level(logging.INFO, logger=logger.name):
+        overwrite_dataset_mask(dataset)
+
+    assert 'Mask not overwritten' in caplog.text
+    assert 'does not match the Singla mask shape' in caplog.text
+    with h5py.File(master_file, 'r') as f:
+        assert np.array_equal(f[PIXEL_MASK_PATH][()], np.ones((10, 10)))
+
+
+@pytest.mark.skipif(not _has_nexgen_phil(),
+                    reason='needs nexgen < 0.9 (phil interface)')
+def test_write_nexus_file_same_as_ed_nexus(tmp_path):
+
+    metadata = SimpleNamespace(start_angle=-30, angle_increment=0.5,
+                               detector_distance=500., wavelength=0.02508)
+    nexus_files = []
+    for name in ('subprocess', 'in_process'):
+        path = str(tmp_path / name)
+        shutil.copytree(DATA_DIR, path)
+        phil_file = os.path.join(path, PHIL_TEMPLATE)
+        assert copy_phil_template(phil_file)
+        dataset = SimpleNamespace(base=os.path.join(path, 'sample'),
+                                  metadata=metadata,
+                                  beam_center=(512., 512.))
+        phil_args = nexgen_phil_args(dataset, phil_file)
+        master_file = dataset.base + '_master.h5'
+        nexus_files.append(dataset.base + '.nxs')
+
+        if name == 'subprocess':
+            # The ED_nexus command of the installed nexgen
+            main = 'from nexgen.command_line.ED_nexus import main; main()'
+            cmd = [sys.executable, '-c', main, 'singla-phil', *phil_args,
+                   '-m', master_file]
+            p = subprocess.run(cmd, cwd=path, capture_output=True, text=True)
+            assert p.returncode == 0, p.stderr
+        else:
+            write_nexus_file(master_file, nexus_files[-1], phil_file,
+                             phil_args[1:])
+            assert not any(f.startswith('.nexgen_') for f in os.listdir(path))
+
+    expected, written = (_nexus_contents(f) for f in nexus_files)
+    assert written == expected
+    assert written['/entry/data/data_000001'][1] == 'sample_data_000001.h5'
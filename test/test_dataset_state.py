@@ -0,0 +1,67 @@
+import threading
+import time
+import numpy as np
+from autoed.beam_position.plot import DeferredPlotQueue, Line2D, PlotParams
+from autoed.dataset import DatasetStateStore, SinglaDataset
+from autoed.utility.logger_pool import dataset_loggers
+
+
+def test_dataset_state_store(tmp_path):
+
+    store = DatasetStateStore(max_records=2)
+    now = time.time()
+
+    bases = [str(tmp_path / f'sample_{i}') for i in range(4)]
+    for i, base in enumerate(bases):
+        dataset = SinglaDataset.from_basename(base)
+        dataset.beam_center = (500. + i, 520.)
+        # The first dataset was processed recently, the others long ago
+        dataset.last_processed_time = now if i == 0 else now - 3600
+        store.save(dataset)
+
+    # The recently processed dataset is kept, the oldest others are not
+    assert len(store) == 2
+    assert bases[0] in store and bases[3] in store
+    assert bases[1] not in store and bases[2] not in store
+
+    dataset = store.restore(bases[0])
+    assert dataset.beam_center == (500., 520.)
+    dataset.update_processed()
+    assert dataset.processed           # Still within the reprocess window
+
+    dataset = store.restore(bases[3])
+    dataset.update_processed()
+    assert not dataset.processed
+
+    # Restoring a dataset appends to its log
+    dataset.logger.info('restored')
+    store.save(dataset)
+    dataset_loggers.flush()
+    log = (tmp_path / 'sample_3.autoed.log').read_text()
+    assert log.endswith('restored\n')
+
+
+def test_deferred_figure_logged_after_save(tmp_path, monkeypatch):
+
+    rendering = threading.Event()
+    monkeypatch.setattr('autoed.beam_position.plot.plot_profile',
+                        lambda params: rendering.wait(10))
+
+    store = DatasetStateStore()
+    dataset = SinglaDataset.from_basename(str(tmp_path / 'sample'))
+    plots = DeferredPlotQueue(max_pending=0)
+    line = Line2D(x=np.arange(10), y=np.zeros(10))
+    params = PlotParams(image=np.zeros((10, 10)), profiles_x=[line],
+                        profiles_y=[line], beam_position=(5, 5),
+                        span_xy=None, filename=str(tmp_path / 'beam.png'))
+    assert plots.submit(params, logger=dataset.logger)
+
+    # The dataset is done with before its figure is rendered
+    store.save(dataset)
+    rendering.set()
+    plots.wait()
+    dataset_loggers.flush()
+
+    log = (tmp_path / 'sample.autoed.log').read_text()
+    assert 'Rendered figure' in log
+    assert str(tmp_path / 'sample') not in dataset_loggers.handlers
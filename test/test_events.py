@@ -0,0 +1,39 @@
+from autoed.events import EventBus, EventFileWriter, read_events
+
+
+def test_event_bus_and_file(tmp_path):
+
+    filename = str(tmp_path / 'events.jsonl')
+    bus = EventBus()
+    received = []
+
+    def failing_subscriber(event):
+        raise RuntimeError('Subscriber failed')
+
+    bus.subscribe(failing_subscriber)
+    bus.subscribe(received.append)
+    bus.subscribe(EventFileWriter(filename, max_size=300))
+
+    bus.publish('converted', dataset='sample')
+    assert received[0]['type'] == 'converted'
+    assert received[0]['dataset'] == 'sample'
+
+    events, position = read_events(filename)
+    assert [e['dataset'] for e in events] == ['sample']
+
+    # An incomplete line is read in the next call
+    with open(filename, 'a') as f:
+        f.write('{"type": "pipeline_done"')
+    events, position = read_events(filename, position)
+    assert events == []
+    with open(filename, 'a') as f:
+        f.write(', "dataset": "sample"}\n')
+    events, position = read_events(filename, position)
+    assert events == [{'type': 'pipeline_done', 'dataset': 'sample'}]
+
+    # After rotation, the new file is read from the start
+    for i in range(5):
+        bus.publish('converted', dataset=f"sample_{i}")
+    events, position = read_events(filename, position)
+    assert events[-1]['dataset'] == 'sample_4'
+    assert (tmp_path / 'events.jsonl.1').exists()
@@ -0,0 +1,50 @@
+import json
+import os
+import argparse
+from autoed.constants import autoed_config_var
+from autoed.global_config import GlobalConfig
+
+
+def write_config(filename, values, mtime):
+    with open(filename, 'w') as f:
+        json.dump(values, f)
+    os.utime(filename, ns=(mtime, mtime))
+
+
+def test_reload_if_changed(tmp_path, monkeypatch):
+
+    config_file = str(tmp_path / 'autoed_config.json')
+    write_config(config_file, {'gain': 2.0, 'sleep_time': 3.0}, 10**18)
+    monkeypatch.setenv(autoed_config_var, config_file)
+
+    config = GlobalConfig()
+    config.overwrite_from_local_config()
+    config.overwrite_from_commandline(argparse.Namespace(sleep_time=5.0))
+    config.log_dir = '/some/log/dir'
+    assert config.gain == 2.0 and config.version == 0
+    assert config.reload_if_changed() == ''
+
+    # Only the values changed in the file are updated
+    write_config(config_file, {'gain': 4.0, 'sleep_time': 6.0,
+                               'multiplex_run_on_every_nth': 7}, 2 * 10**18)
+    log = config.reload_if_changed()
+    assert 'gain: 4.0' in log
+    assert config.gain == 4.0
+    assert config.multiplex_run_on_every_nth == 7
+    assert config.sleep_time == 5.0            # Set on the command line
+    assert config.log_dir == '/some/log/dir'   # Not in the file
+    assert config.version == 1
+    assert 'version' not in config
+
+    # Invalid files and rejected changes keep the current configuration
+    with open(config_file, 'w') as f:
+        f.write('{"gain": ')
+    assert 'Failed to reload' in config.reload_if_changed()
+    assert config.gain == 4.0
+
+    def validate(new_config):
+        raise ValueError('Invalid gain')
+
+    write_config(config_file, {'gain': 8.0}, 3 * 10**18)
+    assert 'Invalid gain' in config.reload_if_changed(validate)
+    assert config.gain == 4.0 and config.version == 1
@@ -0,0 +1,18 @@
+import subprocess
+import sys
+import pytest
+
+
+@pytest.mark.parametrize('module', ['autoed.dataset',
+                                    'autoed.process.multiplex',
+                                    'autoed.process.slurm',
+                                    'autoed.report.misc'])
+def test_lazy_imports(module):
+
+    code = f"import sys, {module}\n"
+    code += "heavy = ('numpy', 'h5py', 'hdf5plugin', 'matplotlib', 'nexgen')\n"
+    code += "print(','.join(p for p in heavy if p in sys.modules))"
+
+    p = subprocess.run([sys.executable, '-c', code], check=True,
+                       capture_output=True, text=True)
+    assert p.stdout.strip() == ''
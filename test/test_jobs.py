@@ -0,0 +1,57 @@
+import threading
+import time
+
+import autoed.server.jobs as jobs
+from autoed.server.jobs import JobManager
+
+
+def wait_for(condition, timeout=5):
+    start = time.time()
+    while not condition():
+        assert time.time() - start < timeout
+        time.sleep(0.01)
+
+
+def test_job_manager(tmp_path, monkeypatch):
+
+    release = threading.Event()
+
+    def fake_process_dir(path, force, progress, cancelled):
+        for name in ('a', 'b'):
+            progress(name, 'pending')
+        for name in ('a', 'b'):
+            release.wait()
+            if cancelled():
+                return
+            progress(name, 'processed')
+
+    monkeypatch.setattr(jobs, 'process_dir', fake_process_dir)
+    manager = JobManager(max_workers=1)
+
+    dir_1 = tmp_path / 'dir_1'
+    dir_2 = tmp_path / 'dir_2'
+    job_1, created = manager.submit(str(dir_1))
+    assert created
+    wait_for(lambda: job_1.status == jobs.RUNNING)
+
+    # The same directory is not processed twice
+    job, created = manager.submit(str(dir_1) + '/')
+    assert job is job_1 and not created
+
+    # Only one worker: the second job waits in the queue
+    job_2, _ = manager.submit(str(dir_2))
+    assert job_2.status == jobs.QUEUED
+
+    manager.cancel(job_2.id)
+    release.set()
+    wait_for(lambda: not job_2.active)
+
+    status = job_1.to_dict()
+    assert status['status'] == jobs.DONE
+    assert status['datasets'] == {'a': 'processed', 'b': 'processed'}
+    assert status['n_finished'] == 2
+    assert job_2.status == jobs.CANCELLED
+    assert [job.id for job in manager.list()] == [job_1.id, job_2.id]
+    assert manager.get('unknown') is None
+
+    manager.shutdown()
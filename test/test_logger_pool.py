@@ -0,0 +1,35 @@
+import logging
+from autoed.utility.logger_pool import DatasetLoggerPool
+
+
+def test_logger_pool(tmp_path):
+
+    pool = DatasetLoggerPool(max_open=2)
+    try:
+        for i in range(5):
+            for _ in range(2):    # A repeated set up adds no handler
+                logger = pool.get_logger(f'test_pool_{i}',
+                                         tmp_path / f'dataset_{i}.log')
+            assert len(logger.handlers) == 1
+            logger.info(f'dataset {i}')
+
+        pool.flush()
+        assert pool.open_files() == 2
+
+        # A closed log file is opened again
+        logger = pool.get_logger('test_pool_0', tmp_path / 'dataset_0.log')
+        logger.info('again')
+        pool.flush()
+        assert pool.open_files() == 2
+
+        lines = (tmp_path / 'dataset_0.log').read_text().splitlines()
+        assert [line.split(' - ')[1] for line in lines] == ['dataset 0',
+                                                           'again']
+
+        pool.release('test_pool_0')
+        assert logger.handlers == []
+        assert 'test_pool_0' not in logging.Logger.manager.loggerDict
+    finally:
+        pool.stop()
+        for i in range(5):
+            pool.release(f'test_pool_{i}')
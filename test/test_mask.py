@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from autoed.utility.mask import get_singla_mask, apply_singla_mask
+
+
+def test_singla_mask_is_shared_and_read_only():
+
+    mask_01 = get_singla_mask()
+    mask_02 = get_singla_mask()
+    assert mask_01 is mask_02
+
+    with pytest.raises(ValueError):
+        mask_01.mask[0, 0] = 1
+    with pytest.raises(ValueError):
+        mask_01.bool_mask[0, 0] = True
+
+
+def test_apply_singla_mask():
+
+    singla_mask = get_singla_mask()
+    image = np.ones(singla_mask.mask.shape)
+
+    expected = np.array(image)
+    expected[singla_mask.mask > 0] = 0
+
+    apply_singla_mask(image)
+    assert np.array_equal(image, expected)
+
+    # Non-contiguous images are masked through the boolean mask
+    image = np.ones(singla_mask.mask.shape[::-1]).T
+    apply_singla_mask(image)
+    assert np.array_equal(image, expected)
+
+    with pytest.raises(ValueError):
+        apply_singla_mask(np.ones((10, 10)))
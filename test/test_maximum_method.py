@@ -0,0 +1,80 @@
+import numpy as np
+from autoed.beam_position.maximum_method import (
+    MaxMethodParams, max_intensity_binning, max_intensity_binning_batch,
+    _window_sums
+)
+
+
+def reference_binning(profile_smooth, profile_max, params):
+    """The original loop-based implementation of max_intensity_binning"""
+
+    n = len(profile_max)
+    n_end = (n // params.bin_width) * params.bin_width
+    bins = np.arange(0, n_end, params.bin_step)
+
+    bin_values = []
+    bin_indices = []
+    for ibin in bins:
+        bvalue = profile_smooth[ibin:ibin + params.bin_width]
+        bin_indices.append((ibin, ibin + params.bin_width))
+        bin_values.append(bvalue.sum())
+
+    max_index = np.argmax(np.array(bin_values))
+    i1, i2 = bin_indices[max_index]
+
+    selected = np.array(profile_max)
+    selected[0:i1] = 0
+    selected[i2:] = 0
+
+    return np.argmax(selected), i1, i2
+
+
+def make_profiles(n_profiles, n=1028, seed=0):
+
+    rng = np.random.default_rng(seed)
+    x = np.arange(n)
+    centers = rng.uniform(0, n, n_profiles)
+    profiles = np.exp(-0.5 * ((x - centers[:, None]) / 40.0)**2)
+    profiles += 0.05 * rng.random((n_profiles, n))
+    profiles_max = profiles + 0.2 * rng.random((n_profiles, n))
+    return profiles, profiles_max
+
+
+def test_max_intensity_binning_matches_reference():
+
+    profiles, profiles_max = make_profiles(50)
+
+    for params in (MaxMethodParams(), MaxMethodParams(bin_width=7,
+                                                      bin_step=3)):
+        for smooth, pmax in zip(profiles, profiles_max):
+            result = max_intensity_binning(smooth, pmax, params)
+            assert result == reference_binning(smooth, pmax, params)
+
+        # All-zero profile takes the fallback path
+        zeros = np.zeros(100)
+        result = max_intensity_binning(zeros, zeros, params)
+        assert result == reference_binning(zeros, zeros, params)
+
+
+def test_max_intensity_binning_batch():
+
+    params = MaxMethodParams()
+    profiles, profiles_max = make_profiles(20, seed=1)
+
+    beam, i1, i2 = max_intensity_binning_batch(profiles, profiles_max, params)
+
+    for k, (smooth, pmax) in enumerate(zip(profiles, profiles_max)):
+        assert (beam[k], i1[k], i2[k]) == reference_binning(smooth, pmax,
+                                                            params)
+
+
+def test_window_sums():
+
+    profiles = np.random.default_rng(2).random((3, 100))
+    bins = np.arange(0, 98, 3)      # The last bins extend past the end
+
+    sums = _window_sums(profiles, bins, 7)
+
+    expected = [[p[b:b + 7].sum() for b in bins] for p in profiles]
+    assert sums.shape == (3, len(bins))
+    assert np.allclose(sums, expected)
@@ -1,10 +1,11 @@
 import pytest                             # noqa: F401
 from autoed.metadata import (
-    get_angle_increment_old, get_angle_increment_new, Metadata
+    get_angle_increment_old, get_angle_increment_new, Metadata, MetadataCache
 )
 from autoed.dataset import SinglaDataset
 import autoed
 import os
+import shutil
 
 
 @pytest.fixture(scope='session')
@@ -68,3 +69,29 @@ def test_metadata_json(datasets):
     assert abs(metadata.angle_increment - 0.15) < 0.001
     assert abs(metadata.start_angle + 17.0) < 0.1
     assert abs(metadata.detector_distance - 333.00) < 0.1
+
+
+def test_metadata_cache(tmp_path):
+
+    path = os.path.dirname(autoed.__path__[0])
+    data_path = os.path.join(path, 'test/data/ED/json_01/')
+    dataset_path = os.path.join(tmp_path, 'ED/json_01')
+    os.makedirs(dataset_path)
+    shutil.copy(os.path.join(data_path, 'sample.json'), dataset_path)
+
+    dataset = SinglaDataset(dataset_path, 'sample')
+    cache = MetadataCache(dataset)
+    assert cache.load() is None
+
+    metadata = Metadata()
+    metadata.from_json(dataset)
+    assert cache.save(metadata, 'json')
+
+    cached = cache.load()
+    assert cached == metadata
+    assert abs(cached.wavelength - 0.026) < 1.e-4
+
+    # Any change of the source file invalidates the cache
+    with open(dataset.json_file, 'a') as json_file:
+        json_file.write('\n')
+    assert cache.load() is None
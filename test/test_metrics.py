@@ -0,0 +1,66 @@
+import urllib.request
+from autoed.constants import events_file, timings_file
+from autoed.events import EventFileWriter
+from autoed.metrics import MetricsRegistry, WatcherMetrics, serve_metrics
+
+
+def test_registry_render():
+
+    registry = MetricsRegistry()
+    counter = registry.counter('test_total', 'A counter', ('kind',))
+    histogram = registry.histogram('test_seconds', 'A histogram',
+                                   buckets=(1, 10))
+    counter.inc(kind='a"b')
+    counter.inc(2, kind='a"b')
+    for value in (0.5, 5, 50):
+        histogram.observe(value)
+
+    text = registry.render()
+    assert '# TYPE test_total counter' in text
+    assert 'test_total{kind="a\\"b"} 3' in text
+    assert 'test_seconds_bucket{le="1"} 1' in text
+    assert 'test_seconds_bucket{le="10"} 2' in text
+    assert 'test_seconds_bucket{le="+Inf"} 3' in text
+    assert 'test_seconds_sum 55.5' in text
+    assert 'test_seconds_count 3' in text
+
+
+def test_watcher_metrics(tmp_path):
+
+    watcher = str(tmp_path)
+    write_event = EventFileWriter(str(tmp_path / events_file))
+    write_timing = EventFileWriter(str(tmp_path / timings_file))
+
+    registry = MetricsRegistry()
+    watcher_metrics = WatcherMetrics(registry)
+    registry.add_collector(lambda: watcher_metrics.update([watcher]))
+
+    write_event({'type': 'dataset_detected', 'dataset': 'a'})
+    write_event({'type': 'converted', 'dataset': 'a'})
+    for pipeline in ('default', 'ice'):
+        write_event({'type': 'pipeline_submitted', 'dataset': 'a',
+                     'pipeline': pipeline})
+    write_timing({'stage': 'nexgen', 'duration': 2.0, 'status': 'ok'})
+    registry.render()
+
+    assert watcher_metrics.processed.get(watcher=watcher) == 1
+    assert watcher_metrics.failed.get(watcher=watcher) == 0
+    assert watcher_metrics.outstanding.get(watcher=watcher) == 2
+    assert watcher_metrics.stage_duration.get(watcher=watcher,
+                                              stage='nexgen',
+                                              status='ok') == 1
+
+    # Only the new lines are read
+    write_event({'type': 'pipeline_done', 'dataset': 'a',
+                 'pipeline': 'default', 'database_latency': 12.0})
+    server = serve_metrics(0, registry=registry)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as response:
+            text = response.read().decode()
+    finally:
+        server.shutdown()
+
+    assert f'autoed_pipelines_outstanding{{watcher="{watcher}"}} 1' in text
+    assert f'autoed_datasets_detected_total{{watcher="{watcher}"}} 1' in text
+    assert watcher_metrics.database_latency.get(watcher=watcher) == 1
@@ -1,6 +1,6 @@
 import pytest
 import os
-from autoed.utility.misc_functions import scrap
+from autoed.utility.misc_functions import scrap, parse_text_file
 
 
 @pytest.fixture
@@ -32,3 +32,55 @@ def test_scrap_correct(make_correct_scrap_file):
                           default_type=int, default_value=-1)
     assert value == -1 and not succes
     print('scrap: Missing variable OK')
+
+
+def test_parse_text_file(make_correct_scrap_file):
+
+    test_file = make_correct_scrap_file
+    variables = parse_text_file(test_file)
+    assert variables['test_var'] == '2.05'
+    assert variables['framerate'] == 'None'
+
+    # The parse is cached until the file changes
+    assert parse_text_file(test_file) is variables
+
+    with open(test_file, 'a') as file:
+        file.write('new_var = 3\n')
+    succes, value = scrap(test_file, 'new_var',
+                          default_type=int, default_value=-1)
+    assert succes and value == 3
+
+
+def test_overwrite_mask(tmp_path):
+
+    import h5py
+    import numpy as np
+    from autoed.utility.mask import get_singla_mask
+    from autoed.utility.misc_functions import (overwrite_mask,
+                                               PIXEL_MASK_PATH,
+                                               MASK_CHECKSUM_ATTR)
+
+    singla_mask = get_singla_mask()
+    mask = np.array(singla_mask.mask, dtype='int8')
+    mask[:10, :10] = 1 - mask[:10, :10]
+
+    master_file = str(tmp_path / 'sample_master.h5')
+    with h5py.File(master_file, 'w') as file:
+        file.create_dataset(PIXEL_MASK_PATH, data=mask, chunks=(133, 129))
+
+    # Only the single differing chunk is written
+    assert overwrite_mask(master_file) == 1
+    with h5py.File(master_file, 'r') as file:
+        pixel_mask = file[PIXEL_MASK_PATH]
+        assert np.array_equal(pixel_mask[()], singla_mask.mask)
+        assert pixel_mask.attrs[MASK_CHECKSUM_ATTR] == singla_mask.checksum
+
+    # The stored checksum matches, nothing is written
+    assert overwrite_mask(master_file) == 0
+
+    empty_file = str(tmp_path / 'empty.h5')
+    h5py.File(empty_file, 'w').close()
+    assert overwrite_mask(empty_file) is None
+
+    with pytest.raises(TimeoutError):
+        overwrite_mask(str(tmp_path / 'missing.h5'), timeout=0.3)
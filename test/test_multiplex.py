@@ -0,0 +1,181 @@
+import os
+import time
+from autoed.constants import (multiplex_output_dir, multiplex_merged_dir,
+                              PROCESS_DONE_TRIGGER)
+from autoed.global_config import global_config
+import autoed.process.multiplex
+from autoed.process.multiplex import (MultiplexDataset, MultiplexInfo,
+                                      MultiplexManifest, MultiplexState,
+                                      SampleLock, gather_multiplex_inputs)
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w'):
+        pass
+
+
+def test_gather_multiplex_inputs(tmp_path):
+
+    for name in ['a_sweep10', 'a_sweep2', 'a_sweep1']:
+        touch(os.path.join(tmp_path, f"{name}.expt"))
+        touch(os.path.join(tmp_path, f"{name}.refl"))
+    touch(os.path.join(tmp_path, 'no_refl.expt'))
+    touch(os.path.join(tmp_path, multiplex_output_dir, 'scaled.expt'))
+    touch(os.path.join(tmp_path, multiplex_output_dir, 'scaled.refl'))
+
+    names = [os.path.basename(f) for f in gather_multiplex_inputs(tmp_path)]
+    assert names == ['a_sweep1.expt', 'a_sweep2.expt', 'a_sweep10.expt']
+
+
+def test_multiplex_manifest(tmp_path):
+
+    output_path = os.path.join(tmp_path, multiplex_output_dir)
+    manifest = MultiplexManifest(tmp_path)
+    assert manifest.needs_full_merge(5, factor=2, interval=3600)
+
+    inputs = [f"{i}.expt" for i in range(5)]
+    manifest.set_pending(inputs, full=True)
+    manifest.save()
+
+    # The run has not finished yet
+    manifest = MultiplexManifest(tmp_path)
+    assert not manifest.promote(output_path)
+    assert manifest.pending_inputs == inputs
+
+    touch(os.path.join(output_path, 'scaled.expt'))
+    touch(os.path.join(output_path, 'scaled.refl'))
+    assert manifest.promote(output_path)
+    manifest.save()
+
+    manifest = MultiplexManifest(tmp_path)
+    assert manifest.has_merged_result()
+    assert manifest.merged_inputs == inputs
+    assert manifest.last_full_merge_count == 5
+
+    assert not manifest.needs_full_merge(9, factor=2, interval=3600)
+    assert manifest.needs_full_merge(10, factor=2, interval=3600)
+
+    manifest.last_full_merge_time = time.time() - 7200
+    assert manifest.needs_full_merge(6, factor=2, interval=3600)
+
+
+def test_multiplex_state(tmp_path):
+
+    output_path = os.path.join(tmp_path, multiplex_output_dir)
+
+    with SampleLock(tmp_path):
+        state = MultiplexState(tmp_path)
+        assert not state.run_in_flight(output_path, timeout=60)
+
+        state.count = 5
+        state.pending = True
+        state.start_run()
+        state.save()
+
+    with SampleLock(tmp_path):
+        state = MultiplexState(tmp_path)
+        assert not state.pending
+        assert state.last_run_count == 5
+        assert state.run_in_flight(output_path, timeout=60)
+        assert not state.run_in_flight(output_path, timeout=0)
+
+    touch(os.path.join(output_path, PROCESS_DONE_TRIGGER))
+    assert not state.run_in_flight(output_path, timeout=60)
+
+
+def make_multiplex_dataset(tmp_path, monkeypatch):
+
+    info = MultiplexInfo(*[None] * len(MultiplexInfo._fields))
+    info = info._replace(multiplex_dir_path=str(tmp_path),
+                         sample_dirs='sample')
+    dataset = MultiplexDataset.__new__(MultiplexDataset)
+    dataset.master_file = None
+    dataset.info = info
+    dataset.local = True
+    os.makedirs(dataset.output_path, exist_ok=True)
+    monkeypatch.setattr(dataset, 'copy_files', lambda: True)
+    monkeypatch.setattr(dataset, 'run_condition', lambda state: True)
+    return dataset
+
+
+def test_multiplex_pending_request(tmp_path, monkeypatch):
+
+    first = make_multiplex_dataset(tmp_path, monkeypatch)
+    second = make_multiplex_dataset(tmp_path, monkeypatch)
+    runs = []
+
+    def run():
+        runs.append(time.time())
+        if len(runs) == 1:
+            # Requests during the run return at once and are left pending
+            assert not second.submit()
+            assert not second.submit()
+
+    monkeypatch.setattr(first, 'run', run)
+    assert first.submit()
+
+    # The first process ran multiplex again, once for both requests
+    assert len(runs) == 2
+    with SampleLock(first.sample_path):
+        state = MultiplexState(first.sample_path)
+        assert not state.pending
+        assert not state.running
+    assert not second.submit_pending()
+
+
+def test_multiplex_full_merge_skips_merged_result(tmp_path, monkeypatch):
+
+    dataset = make_multiplex_dataset(tmp_path, monkeypatch)
+    for name in ['s1', 's2']:
+        touch(os.path.join(dataset.sample_path, f"{name}.expt"))
+        touch(os.path.join(dataset.sample_path, f"{name}.refl"))
+    # Left by an earlier run in the incremental mode
+    for ext in ('expt', 'refl'):
+        touch(os.path.join(dataset.sample_path, multiplex_merged_dir,
+                           f"merged.{ext}"))
+
+    commands = []
+    monkeypatch.setattr(autoed.process.multiplex.subprocess, 'run',
+                        lambda cmd, **kwargs: commands.append(cmd))
+    monkeypatch.setitem(global_config, 'multiplex_incremental', False)
+    dataset.run()
+
+    names = [os.path.basename(f) for f in commands[0].split()[1:]]
+    assert commands[0].startswith('xia2.multiplex ')
+    assert names == ['s1.expt', 's2.expt', 's1.refl', 's2.refl']
+
+
+def test_multiplex_pending_request_slurm(tmp_path, monkeypatch):
+
+    first = make_multiplex_dataset(tmp_path, monkeypatch)
+    second = make_multiplex_dataset(tmp_path, monkeypatch)
+    first.local = second.local = False
+    first.master_file = 'sample_master.h5'
+    jobs, watches = [], []
+    monkeypatch.setattr(autoed.process.multiplex, 'multiplex_with_slurm',
+                        lambda info, cmd: jobs.append(cmd))
+    monkeypatch.setattr(autoed.process.multiplex.subprocess, 'Popen',
+                        lambda cmds, **kwargs: watches.append(cmds))
+    monkeypatch.setitem(global_config, 'multiplex_incremental', False)
+    monkeypatch.setitem(global_config, 'multiplex_run_timeout_sec', 60)
+
+    # The job is submitted, and a local process waits for it
+    assert first.submit()
+    assert len(jobs) == 1
+    assert watches == [['autoed_multiplex', '--pending', 'sample_master.h5']]
+    assert not second.submit()
+
+    # The job has finished: the pending request runs
+    touch(os.path.join(first.output_path, PROCESS_DONE_TRIGGER))
+    assert first.submit_pending(poll_interval=0)
+    assert len(jobs) == 2 and len(watches) == 2
+
+    # The job was killed: the pending request runs after the timeout
+    assert not second.submit()
+    monkeypatch.setitem(global_config, 'multiplex_run_timeout_sec', 0)
+    assert first.submit_pending(poll_interval=0)
+    assert len(jobs) == 3
+    assert not first.submit_pending(poll_interval=0)   # Nothing pending
+    with open(os.path.join(first.output_path, 'multiplex.log')) as file:
+        assert 'did not finish within 0 seconds' in file.read()
@@ -0,0 +1,82 @@
+from autoed.report.parser import (scan_xia2_txt_file,
+                                  count_xds_indexed_spots,
+                                  parse_dials_indexed_stats,
+                                  parse_xia2_error)
+
+XIA2_TXT = """xia2 output
+Error: indexing failed for sweep 1
+Assuming spacegroup: P 21 21 21
+Unit cell (with estimated std devs):
+10.1(2) 20.2(3) 30.3(4)
+90.0 90.0 90.0
+Assuming spacegroup: P 1
+Unit cell (with estimated std devs):
+11.1(2) 21.2(3) 31.3(4)
+89.5 91.0 92.0
+Unit cell:
+1.0 2.0 3.0
+Status: normal termination
+"""
+
+XDS_TXT = """xia2 output
+Assuming spacegroup: C 2
+Unit cell:
+5.000 6.000 7.000
+90.000 100.000 90.000
+"""
+
+DIALS_INDEX_LOG = """Refined crystal models:
+| Imageset | # indexed | # unindexed |
+| 0        | 1234      | 56          |
++----------+-----------+-------------+
+Saving refined experiments to indexed.expt
+| 0        | 1         | 2           |
+Saving refined experiments to indexed.expt
+"""
+
+
+def test_scan_xia2_txt_file(tmp_path):
+
+    xia2_file = tmp_path / 'xia2.txt'
+    xia2_file.write_text(XIA2_TXT)
+
+    summary = scan_xia2_txt_file(xia2_file)
+    assert summary.normal_termination
+    assert summary.error == 'Error: indexing failed for sweep 1\n'
+    # The last DIALS unit cell wins over the XDS one
+    assert summary.values() == [11.1, 21.2, 31.3, 89.5, 91.0, 92.0, ' P 1']
+
+    xia2_file.write_text(XDS_TXT)
+    summary = scan_xia2_txt_file(xia2_file)
+    assert not summary.normal_termination
+    assert summary.values() == [5.0, 6.0, 7.0, 90.0, 100.0, 90.0, ' C 2']
+    assert parse_xia2_error(xia2_file) == 'Error not parsed correctely.'
+
+
+def test_parse_dials_indexed_stats(tmp_path):
+
+    index_file = tmp_path / 'dials.index.log'
+    index_file.write_text(DIALS_INDEX_LOG)
+    assert parse_dials_indexed_stats(index_file) == (1290, 1234)
+
+    index_file.write_text('No refined experiments\n')
+    assert parse_dials_indexed_stats(index_file) is None
+
+
+def test_count_xds_indexed_spots(tmp_path):
+
+    spots_file = tmp_path / 'SPOT.XDS'
+    spots_file.write_text(" 1030.68 1032.81 1.56 1234.      0      0      0\n"
+                          "  512.20  300.01 4.20  567.      1     -2      3\n"
+                          "  100.00  200.00 5.00   89.      0      0      1\n")
+    assert count_xds_indexed_spots(spots_file) == (3, 2)
+
+    # Lines with a different number of columns
+    with open(spots_file, 'a') as file:
+        file.write("   10.00   20.00   5.00     89.\n")
+    assert count_xds_indexed_spots(spots_file) == (4, 2)
+
+    # Spots found but not indexed yet
+    spots_file.write_text("  1030.68  1032.81   1.56   1234.\n"
+                          "   512.20   300.01   4.20    567.\n")
+    assert count_xds_indexed_spots(spots_file) == (2, 2)
@@ -0,0 +1,76 @@
+import pytest
+from autoed.global_config import default_global_config, global_config
+from autoed.metadata import Metadata
+from autoed.process.pipeline_registry import (PipelineRegistry,
+                                              PipelineDefinitionError,
+                                              compile_condition,
+                                              get_pipeline_registry)
+
+
+def make_pipeline(**kwargs):
+    pipeline = {'pipeline_name': 'test', 'type': 'dials',
+                'run_condition': True, 'script': ['echo {nexus_file};']}
+    pipeline.update(kwargs)
+    return pipeline
+
+
+def test_default_pipelines():
+
+    registry = PipelineRegistry(default_global_config['defined_pipelines'])
+    enabled = registry.enabled(default_global_config['run_pipelines'])
+    assert [p.name for p in enabled] == ['default', 'user', 'ice',
+                                         'max_lattices',
+                                         'real_space_indexing']
+
+    m = Metadata()
+    user = registry['user']
+    assert not user.evaluate_condition(m, global_config)
+    m.space_group = 'P1'
+    assert user.evaluate_condition(m, global_config)
+    assert not registry['real_space_indexing'].evaluate_condition(
+        m, global_config)
+
+    cmd = registry['max_lattices'].format_script(
+        {'nexus_file': 'a.nxs', 'imported_file': 'imported.expt',
+         'processed_dir': 'out', 'g': global_config})
+    assert cmd.startswith('dials.import a.nxs goniometer.axis=0,-1,0; ')
+    assert 'dials.index out/imported.expt  out/strong.refl ' in cmd
+
+    assert get_pipeline_registry() is get_pipeline_registry()
+
+
+def test_script_concatenation():
+
+    pipeline = make_pipeline(script=['cmd', 'option=%%', '{g.gain};'])
+    template = PipelineRegistry([pipeline])['test']
+    cmd = template.format_script({'g': global_config})
+    assert cmd == f"cmd option={global_config.gain}; "
+
+
+@pytest.mark.parametrize('condition', [
+    "__import__('os').system('ls')",
+    "m.__class__",
+    "open('file')",
+    "lambda: True",
+    "m.unit_cell is not",
+    ])
+def test_invalid_run_condition(condition):
+
+    with pytest.raises(PipelineDefinitionError):
+        compile_condition(condition)
+
+
+def test_invalid_pipelines():
+
+    pipelines = [make_pipeline(pipeline_name='a', script=['{unknown}']),
+                 make_pipeline(pipeline_name='b', script=['{g.__class__}']),
+                 make_pipeline(pipeline_name='c', run_condition=1),
+                 make_pipeline(pipeline_name='c')]
+
+    with pytest.raises(PipelineDefinitionError) as error:
+        PipelineRegistry(pipelines)
+
+    msg = str(error.value)
+    for name in ("'a'", "'b'", "'c'"):
+        assert name in msg
+    assert 'more than once' not in msg
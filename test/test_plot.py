@@ -0,0 +1,57 @@
+import os
+import threading
+import numpy as np
+from autoed.beam_position.plot import (DeferredPlotQueue, Line2D,
+                                       PlotParams)
+
+
+def make_params(filename):
+
+    image = np.zeros((100, 100))
+    line = Line2D(x=np.arange(100), y=np.linspace(0, 1, 100))
+    return PlotParams(image=image, profiles_x=[line], profiles_y=[line],
+                      beam_position=(50, 50), span_xy=None,
+                      filename=filename)
+
+
+def test_deferred_plot_queue(tmp_path):
+
+    plots = DeferredPlotQueue(max_pending=0)
+    filenames = [os.path.join(tmp_path, f"fig_{i}.png") for i in range(2)]
+
+    for filename in filenames:
+        assert plots.submit(make_params(filename))
+
+    plots.wait()
+    assert plots.pending() == 0
+    for filename in filenames:
+        assert os.path.exists(filename)
+
+
+def test_deferred_plot_queue_skips_when_full(tmp_path, monkeypatch):
+
+    import autoed.beam_position.plot
+
+    rendering = threading.Event()
+    release = threading.Event()
+    rendered = []
+
+    def plot_profile(params):
+        rendering.set()
+        release.wait(10)
+        rendered.append(params.filename)
+
+    monkeypatch.setattr(autoed.beam_position.plot, 'plot_profile',
+                        plot_profile)
+    plots = DeferredPlotQueue(max_pending=1)
+
+    # The first figure is still rendering, so the second one is skipped
+    try:
+        assert plots.submit(make_params(os.path.join(tmp_path, 'a.png')))
+        assert rendering.wait(10)
+        assert not plots.submit(make_params(os.path.join(tmp_path, 'b.png')))
+    finally:
+        release.set()
+
+    plots.wait()
+    assert rendered == [os.path.join(tmp_path, 'a.png')]
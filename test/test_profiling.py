@@ -0,0 +1,42 @@
+import pstats
+import threading
+from autoed.utility.profiling import profiled, profiling_requested
+
+
+def test_profiling_requested(monkeypatch):
+
+    monkeypatch.delenv('AUTOED_PROFILE', raising=False)
+    argv = ['autoed_watch', '--profile', 'dir']
+    assert profiling_requested(argv)
+    assert argv == ['autoed_watch', 'dir']
+    assert not profiling_requested(argv)
+
+    monkeypatch.setenv('AUTOED_PROFILE', '0')
+    assert not profiling_requested(argv)
+    monkeypatch.setenv('AUTOED_PROFILE', '1')
+    assert profiling_requested(argv)
+
+
+def test_profiled(tmp_path, monkeypatch):
+
+    monkeypatch.setenv('AUTOED_PROFILE', str(tmp_path))
+    monkeypatch.setattr('sys.argv', ['autoed_test'])
+
+    def work_in_thread():
+        sum(range(1000))
+
+    @profiled
+    def main():
+        thread = threading.Thread(target=work_in_thread)
+        thread.start()
+        thread.join()
+        return 'done'
+
+    assert main() == 'done'
+
+    profiles = list(tmp_path.glob('autoed_profile_autoed_test_*.prof'))
+    assert len(profiles) == 1
+    assert profiles[0].with_suffix('.txt').exists()
+    functions = [key[2] for key in pstats.Stats(str(profiles[0])).stats]
+    assert 'main' in functions
+    assert 'work_in_thread' in functions
@@ -0,0 +1,166 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from autoed.supervisor import WatcherProcess, WatcherSupervisor, send_command
+
+
+@pytest.fixture
+def fake_watcher(monkeypatch):
+    """Run a short python script instead of autoed_watch"""
+
+    def command(self):
+        seconds = 0.2 if 'crash' in self.path else 60
+        return [sys.executable, '-c', f"import time; time.sleep({seconds})"]
+
+    monkeypatch.setattr(WatcherProcess, 'command', command)
+
+
+def test_supervisor_restarts_with_backoff(tmp_path, fake_watcher):
+
+    (tmp_path / 'crash').mkdir()
+    (tmp_path / 'crash' / 'sub').mkdir()
+    supervisor = WatcherSupervisor(min_delay=10, max_delay=25,
+                                   dirs_file=str(tmp_path / 'dirs.txt'))
+
+    watcher = supervisor.watch(str(tmp_path / 'crash'))
+    with pytest.raises(ValueError):
+        supervisor.watch(str(tmp_path / 'crash'))
+    with pytest.raises(ValueError):
+        supervisor.watch(str(tmp_path / 'crash' / 'sub'))
+    with pytest.raises(ValueError):
+        supervisor.watch(str(tmp_path / 'missing'))
+
+    first_pid = watcher.pid
+    watcher.process.wait()
+    now = time.time()
+    delays = []
+    for _ in range(3):
+        supervisor.check_watchers(now)       # Detects the crash
+        assert supervisor.list()[0]['status'] == 'restarting'
+        delays.append(watcher.restart_time - now)
+        now = watcher.restart_time
+        supervisor.check_watchers(now)       # Restarts the watcher
+        watcher.process.wait()
+
+    assert delays == [10, 20, 25]
+    assert watcher.pid != first_pid
+    with open(tmp_path / 'dirs.txt') as f:
+        assert f.read().split() == [str(watcher.pid), watcher.path]
+
+    supervisor.stop_all()
+    assert supervisor.list() == []
+
+
+def test_supervisor_socket(tmp_path, fake_watcher):
+
+    socket_file = str(tmp_path / 'autoed.sock')
+    supervisor = WatcherSupervisor(socket_file=socket_file)
+    thread = threading.Thread(target=supervisor.serve,
+                              kwargs={'poll_interval': 0.1})
+    thread.start()
+    while not os.path.exists(socket_file):
+        time.sleep(0.01)
+
+    try:
+        response = send_command(socket_file, 'watch', path=str(tmp_path))
+        assert response['ok']
+        pid = response['watcher']['pid']
+
+        response = send_command(socket_file, 'list')
+        assert [w['pid'] for w in response['watchers']] == [pid]
+
+        response = send_command(socket_file, 'kill', pid=pid + 1)
+        assert not response['ok']
+        assert send_command(socket_file, 'kill', pid=pid)['ok']
+        assert send_command(socket_file, 'list')['watchers'] == []
+    finally:
+        send_command(socket_file, 'shutdown')
+        thread.join()
+        supervisor.stop_all()
+
+    assert not os.path.exists(socket_file)
+    with pytest.raises(ConnectionError):
+        send_command(socket_file, 'list')
+
+
+def test_supervisor_adopts_watchers(tmp_path):
+
+    # A watcher left running by a supervisor that crashed
+    script = tmp_path / 'autoed_watch'
+    script.write_text('import time\ntime.sleep(60)\n')
+    watched = tmp_path / 'watched'
+    watched.mkdir()
+    orphan = subprocess.Popen([sys.executable, str(script), '-t', '2.0',
+                               str(watched)], start_new_session=True)
+
+    dirs_file = tmp_path / 'dirs.txt'
+    dirs_file.write_text(f"{orphan.pid} {watched}\n"
+                         f"{orphan.pid} {tmp_path / 'other'}\n")
+    supervisor = WatcherSupervisor(dirs_file=str(dirs_file))
+    try:
+        adopted = supervisor.adopt_watchers()
+        assert [w.path for w in adopted] == [str(watched)]
+        assert adopted[0].sleep_time == 2.0
+        assert supervisor.list()[0]['status'] == 'running'
+        with pytest.raises(ValueError):      # No duplicate watcher
+            supervisor.watch(str(watched))
+        assert dirs_file.read_text() == f"{orphan.pid} {watched}\n"
+
+        supervisor.kill(pid=orphan.pid)
+        assert orphan.wait(5) is not None
+    finally:
+        orphan.kill()
+        orphan.wait()
+
+
+def test_supervisor_shutdown(tmp_path, fake_watcher):
+
+    supervisor = WatcherSupervisor(allow_shutdown=False)
+    watcher = supervisor.watch(str(tmp_path))
+    try:
+        # Refused while the server owns the supervisor
+        assert not supervisor.handle_request({'command': 'shutdown'})['ok']
+        assert watcher.is_running()
+
+        supervisor.allow_shutdown = True
+        assert supervisor.handle_request({'command': 'shutdown'})['ok']
+        assert not watcher.is_running()
+        assert supervisor.list() == []
+    finally:
+        supervisor.stop_all()
+
+
+def test_supervisor_restart_holds_lock(tmp_path, fake_watcher, monkeypatch):
+
+    supervisor = WatcherSupervisor()
+    watcher = supervisor.watch(str(tmp_path))
+    starts = []
+    starting = threading.Event()
+    start = WatcherProcess.start
+
+    def slow_start(self):
+        starts.append(self.path)
+        starting.set()
+        time.sleep(0.2)
+        start(self)
+
+    monkeypatch.setattr(WatcherProcess, 'start', slow_start)
+    try:
+        # The watcher is stopped while restarting: check_watchers must not
+        # start it a second time
+        thread = threading.Thread(target=supervisor.restart)
+        thread.start()
+        starting.wait(10)
+        now = time.time()
+        for delay in (0, 1000):
+            supervisor.check_watchers(now=now + delay)
+        thread.join()
+        assert starts == [watcher.path]
+        assert watcher.is_running()
+    finally:
+        supervisor.stop_all()
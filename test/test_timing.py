@@ -0,0 +1,47 @@
+import json
+import pytest
+from autoed.events import EventFileWriter
+from autoed.timing import Span, TimingRecorder, span, timed, timings
+
+
+def test_nested_spans(tmp_path):
+
+    recorder = TimingRecorder()
+    events_file = tmp_path / 'timings.jsonl'
+    recorder.subscribe(EventFileWriter(str(events_file)))
+
+    with Span('process', recorder, dataset='/data/sample') as outer:
+        with Span('nexgen', recorder):
+            pass
+        with pytest.raises(ValueError):
+            with Span('pipelines', recorder):
+                raise ValueError('failed')
+
+    assert set(outer.children) == {'nexgen', 'pipelines'}
+    assert outer.format_children().startswith('nexgen ')
+
+    records = [json.loads(line)
+               for line in events_file.read_text().splitlines()]
+    assert [r['stage'] for r in records] == ['nexgen', 'pipelines',
+                                             'process']
+    # Nested spans inherit the fields of the spans around them
+    assert all(r['dataset'] == '/data/sample' for r in records)
+    assert [r['status'] for r in records] == ['ok', 'error', 'ok']
+    assert records[2]['duration'] >= records[0]['duration']
+
+    summary = recorder.summary()
+    assert summary['pipelines']['errors'] == 1
+    assert summary['process']['count'] == 1
+    assert 'nexgen' in recorder.format_summary()
+
+
+def test_timed():
+
+    @timed('test_timed_stage')
+    def add(a, b):
+        return a + b
+
+    with span('test_timed_outer', dataset='sample') as outer:
+        assert add(1, 2) == 3
+    assert 'test_timed_stage' in outer.children
+    assert timings.summary()['test_timed_stage']['count'] == 1
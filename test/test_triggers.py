@@ -0,0 +1,67 @@
+import logging
+import os
+import threading
+from types import SimpleNamespace
+from watchdog.events import FileCreatedEvent
+from autoed.global_config import global_config
+from autoed.watch import DirectoryHandler, TriggerDebouncer
+
+
+def test_trigger_debouncer():
+
+    triggers = TriggerDebouncer(quiet_time=2., max_delay=10.)
+    parent = os.path.join('data', 'ED', 'sample')
+    child = os.path.join(parent, 'crystal_1')
+    other = os.path.join('data', 'ED', 'other')
+
+    # A burst of events in a directory is merged
+    assert triggers.add(child, now=0.)
+    assert not triggers.add(child, now=1.)
+    assert triggers.add(parent, now=1.5)
+    assert triggers.pop_ready(now=2.5) == []
+
+    # The parent is searched recursively, so the child is dropped
+    assert triggers.pop_ready(now=3.5) == [parent]
+    assert triggers.pending == {}
+
+    # A directory that never goes quiet is evaluated after max_delay
+    for t in range(12):
+        triggers.add(other, now=float(t))
+        if t < 10:
+            assert triggers.pop_ready(now=float(t)) == []
+    assert triggers.pop_ready(now=11.) == [other]
+
+
+def test_triggers_processed_in_one_thread(tmp_path, monkeypatch):
+
+    config = SimpleNamespace(max_known_datasets=10,
+                             trigger_quiet_time_sec=0,
+                             trigger_file=global_config.trigger_file)
+    trigger = os.path.join(str(tmp_path), global_config['ed_root_dir'],
+                           'sample', 'data' + global_config.trigger_file)
+    threads = []
+    processed = threading.Event()
+
+    def process_directory(dir_name):
+        threads.append(threading.current_thread().name)
+        processed.set()
+
+    # Without a quiet time, the event is still handled by the trigger
+    # thread, not by the observer thread
+    handler = DirectoryHandler(str(tmp_path), None,
+                               logging.getLogger(__name__), config)
+    monkeypatch.setattr(handler, 'process_directory', process_directory)
+    handler.on_created(FileCreatedEvent(trigger))
+    assert processed.wait(5)
+    assert threads == ['autoed-triggers']
+
+    # A quiet time reloaded to 0 is applied to the next event
+    config.trigger_quiet_time_sec = 2.
+    handler = DirectoryHandler(str(tmp_path), None,
+                               logging.getLogger(__name__), config)
+    monkeypatch.setattr(handler, 'process_directory', process_directory)
+    config.trigger_quiet_time_sec = 0
+    processed.clear()
+    handler.on_created(FileCreatedEvent(trigger))
+    assert processed.wait(1)
+    assert threads == ['autoed-triggers'] * 2